@@ -3,10 +3,27 @@
 # to render the sent data in WebGL
 # 24/11/2024
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS, cross_origin
 from city_agents.model import CityModel 
-from city_agents.agent import Car, Traffic_Light, Destination, Obstacle, Road
+from city_agents.agent import Car
+from city_agents.metrics import HTTP_REQUEST_SECONDS, HTTP_SERIALIZE_SECONDS, REGISTRY, SESSIONS
+from city_agents.citymap import MAP_DIR, allowed_map_path
+from city_agents.binframe import MIME_TYPE as BINARY_MIME_TYPE, encode_cars
+from city_agents.frames import build_frame
+from city_agents.payloads import static_payload
+from city_agents.replay import EXTENSION as REPLAY_EXTENSION, ReplayReader
+from city_agents.sessions import SessionRegistry
+from city_agents.snapshot import MIME_TYPE as SNAPSHOT_MIME_TYPE, restore_snapshot, take_snapshot
+from city_agents.trace import CATEGORIES as TRACE_CATEGORIES, LEVELS as TRACE_LEVELS, Tracer, format_event
+from collections import OrderedDict
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
 
 # with open('city_files/2022_base.txt') as baseFile:
 #     lines = baseFile.readlines()
@@ -14,57 +31,160 @@ from city_agents.agent import Car, Traffic_Light, Destination, Obstacle, Road
 #     height = len(lines)
 
 numAgents = 1
-cityModel = None
-currentStep = 0
+
+# Every /init creates its own session; these limits can be changed with environment variables
+MAX_SESSIONS = int(os.environ.get('CITY_MAX_SESSIONS', 8))
+SESSION_IDLE_SECONDS = float(os.environ.get('CITY_SESSION_IDLE_SECONDS', 1800))
+sessions = SessionRegistry(max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_SECONDS)
+
+# Simulation events are not printed. Set CITY_TRACE to a comma separated list of categories
+# (or "all") to keep the latest CITY_TRACE_BUFFER events of each session in memory; they are
+# read with GET /trace.
+TRACE_CATEGORIES_ENABLED = [c for c in os.environ.get('CITY_TRACE', '').split(',') if c]
+if 'all' in TRACE_CATEGORIES_ENABLED:
+    TRACE_CATEGORIES_ENABLED = list(TRACE_CATEGORIES)
+TRACE_LEVEL = TRACE_LEVELS[os.environ.get('CITY_TRACE_LEVEL', 'info')]
+TRACE_BUFFER = int(os.environ.get('CITY_TRACE_BUFFER', 10000))
+
+# Replay logs are written to CITY_REPLAY_DIR, one file per recorded session; /replay serves
+# at most MAX_REPLAY_STEPS steps per request
+REPLAY_DIR = os.environ.get('CITY_REPLAY_DIR', 'replays')
+MAX_REPLAY_STEPS = int(os.environ.get('CITY_REPLAY_MAX_STEPS', 1000))
+replayReaders = OrderedDict()  # {replay id: ReplayReader}, the most recently used last
+replayReadersLock = threading.Lock()
+
+# /step advances at most MAX_STEPS_PER_REQUEST steps per request, since it holds the session lock
+# while it steps; longer runs go through /run or headless runs
+MAX_STEPS_PER_REQUEST = int(os.environ.get('CITY_STEP_MAX_STEPS', 100))
+
+# Maps that /init and /restore accept besides the bundled years, by file name
+MAPS_DIR = os.environ.get('CITY_MAP_DIR', MAP_DIR)
+
+def newTracer():
+    if not TRACE_CATEGORIES_ENABLED:
+        return None
+    return Tracer(TRACE_CATEGORIES_ENABLED, level=TRACE_LEVEL, capacity=TRACE_BUFFER)
 
 # This application will be used to interact with WebGL
 app = Flask("Traffic Simulation")
 cors = CORS(app, origins=['http://localhost'])
 
+# Sends a precomputed static layer. Answers 304 when the client already has the same
+# version (If-None-Match), and sends the gzip body when the client accepts it.
+def staticResponse(payload):
+    useGzip = 'gzip' in request.accept_encodings
+    etag = payload.etag_for(useGzip)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload.gzip_body if useGzip else payload.body, mimetype='application/json')
+        if useGzip:
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Every request is timed into the city_http_request_seconds histogram of /metrics
+@app.before_request
+def startRequestTimer():
+    g.requestStart = time.perf_counter()
+
+@app.after_request
+def observeRequestTime(response):
+    if 'requestStart' in g:
+        HTTP_REQUEST_SECONDS.labels(endpoint=request.endpoint or 'unknown').observe(
+            time.perf_counter() - g.requestStart
+        )
+    return response
+
+# jsonify, timed into the city_http_serialize_seconds histogram of /metrics
+def timedJson(data):
+    start = time.perf_counter()
+    response = jsonify(data)
+    HTTP_SERIALIZE_SECONDS.labels(endpoint=request.endpoint).observe(time.perf_counter() - start)
+    return response
+
+# Returns the session addressed by the request (query parameter "session" or the
+# X-Session-Id header), or None if it does not exist or was evicted.
+def findSession():
+    sessionId = request.args.get('session') or request.headers.get('X-Session-Id')
+    if not sessionId:
+        return None
+    return sessions.get(sessionId)
+
+def sessionNotFound():
+    return jsonify({"message": "Model not initialized or session expired. Call /init again."}), 404
+
+# /update and /step would race with the background simulator, so they are refused
+# while the session is free-running
+def sessionFreeRunning():
+    return jsonify({"message": "Session is free-running. Read /frames or call /stop first."}), 409
+
 # This route will be used to send the parameters of the simulation to the server.
 # The server expects a POST request with the parameters in JSON.
 @app.route('/init', methods=['POST'])
 @cross_origin()
 def initModel():
-    global currentStep, cityModel, numAgents, width, height
+    global numAgents, width, height
 
     if request.method == 'POST':
         try:
             numAgents = 4
             width = int(request.json.get('width'))
             height = int(request.json.get('height'))
-            currentStep = 0
+            engine = request.json.get('engine', 'agents')
+            activation = request.json.get('activation', 'random')
+            routing = request.json.get('routing', 'shortest')
+            # Only bundled maps or map names inside CITY_MAP_DIR; never a path from the request
+            try:
+                mapFile = allowed_map_path(request.json.get('map', '2024'), MAPS_DIR)
+            except ValueError as e:
+                return jsonify({"message": f"Invalid map: {e}"}), 400
 
             print(request.json)
-            print(f"Model parameters: {numAgents, width, height}")
+            print(f"Model parameters: {numAgents, width, height, engine, mapFile}")
 
-            # Create the model using the parameters sent by the application
-            cityModel = CityModel()
+            # Create the model of a new session using the parameters sent by the application
+            session = sessions.create(lambda: CityModel(engine=engine, map_file=mapFile, activation=activation, routing=routing, tracer=newTracer()))
 
-            # Return a message saying that the model was created successfully
-            return jsonify({"message": "Parameters received, model initiated."})
+            # Return a message saying that the model was created successfully, and its session
+            return jsonify({"message": "Parameters received, model initiated.", "session": session.id})
 
         except Exception as e:
             print(e)
             return jsonify({"message": "Error initializing the model"}), 500
 
-# This route will be used to get the positions of the car agents
+# This route will be used to get the positions of the car agents.
+# Clients that prefer "application/octet-stream" in their Accept header get the packed binary
+# frame described in README.md instead of JSON.
 @app.route('/getAgents', methods=['GET'])
 @cross_origin()
 def getAgents():
-    global cityModel
-
-    if cityModel is None:
-        return jsonify({"message": "Model not initialized"}), 400
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
 
     if request.method == 'GET':
         try:
-            carPositions = [
-                {"id": str(a.unique_id), "x": a.pos[0], "y": 1.05, "z": a.pos[1], "direction": a.direction}
-                for a in cityModel.schedule.agents
-                if isinstance(a, Car)
-            ]
-            return jsonify({'positions': carPositions})
+            if request.accept_mimetypes.best_match(['application/json', BINARY_MIME_TYPE]) == BINARY_MIME_TYPE:
+                with session.lock:
+                    step = session.model.step_count
+                    ids, xs, zs, directions = session.model.get_car_arrays()
+                start = time.perf_counter()
+                response = Response(encode_cars(step, ids, xs, zs, directions), mimetype=BINARY_MIME_TYPE)
+                HTTP_SERIALIZE_SECONDS.labels(endpoint=request.endpoint).observe(time.perf_counter() - start)
+                response.vary.add('Accept')
+                return response
+
+            with session.lock:
+                carPositions = [
+                    {"id": str(carId), "x": pos[0], "y": 1.05, "z": pos[1], "direction": direction}
+                    for carId, pos, direction in session.model.get_car_states()
+                ]
+            return timedJson({'positions': carPositions})
         except Exception as e:
             print(f"Exception in getAgents: {e}")
             return jsonify({"message": "Error with the agent positions", "error": str(e)}), 500
@@ -73,20 +193,20 @@ def getAgents():
 @app.route('/getObstacles', methods=['GET'])
 @cross_origin()
 def getObstacles():
-    global cityModel
-
-    if cityModel is None:
-        return jsonify({"message": "Model not initialized"}), 400
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    # Static layers never change, so they are read without taking the session lock
+    cityModel = session.model
 
     if request.method == 'GET':
         try:
-            obsPositions = [
-                {"id": str(a.unique_id), "x": x, "y": 1, "z": y}
-                for cell_contents, (x, y) in cityModel.grid.coord_iter()
-                for a in cell_contents if isinstance(a, Obstacle)
-            ]
+            payload = static_payload(cityModel.city_map.source_hash, 'obstacles', lambda: {'positions': [
+                {"id": obsId, "x": x, "y": 1, "z": y}
+                for obsId, (x, y) in cityModel.get_obstacles()
+            ]})
 
-            return jsonify({'positions': obsPositions})
+            return staticResponse(payload)
         except Exception as e:
             print(traceback.format_exc())
             print(f"Exception in getObstacles: {e}")
@@ -95,44 +215,95 @@ def getObstacles():
 @app.route('/getLights', methods=['GET'])
 @cross_origin()
 def getLights():
-    global cityModel
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
     if request.method == 'GET':
         try:
-            lightPositions = [
-                {"id": str(a.unique_id), "x": x, "y": 2, "z": y, "state": a.state}
-                for cell_contents, (x, y) in cityModel.grid.coord_iter()
-                for a in cell_contents if isinstance(a, Traffic_Light)
-            ]
-
-            return jsonify({'positions': lightPositions})
+            # ?since=<step>: only the lights whose state changed after that step
+            since = request.args.get('since')
+            with session.lock:
+                model = session.model
+                lights = model.get_lights() if since is None else model.get_changed_lights(int(since))
+                lightPositions = [
+                    {"id": str(lightId), "x": x, "y": 2, "z": y, "state": state}
+                    for lightId, (x, y), state in lights
+                ]
+                step = model.step_count
+
+            if since is None:
+                return timedJson({'positions': lightPositions})
+            return timedJson({'positions': lightPositions, 'step': step})
         except Exception as e:
             print(traceback.format_exc())
             print(f"Exception in getObstacles: {e}")
             return jsonify({"message": "Error with the obstacle positions"}), 500
 
 
+# Traffic light phase groups. GET lists every group with its period, offset and lights.
+# POST changes them from the current step on, keeping the current light states:
+#   {"groups": [0, 3], "period": 12, "offset": 4}: set the period and/or offset of some groups (all if omitted)
+#   {"groups": [4, 7, 9], "wave": 3}: green wave, every group switches 3 steps after the previous one
+@app.route('/lightPhases', methods=['GET', 'POST'])
+@cross_origin()
+def lightPhases():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    if request.method == 'GET':
+        with session.lock:
+            return jsonify({'step': session.model.step_count, 'groups': session.model.lights.group_info()})
+
+    try:
+        body = request.get_json(silent=True) or {}
+        groups = body.get('groups')
+        if groups is not None:
+            groups = [int(group) for group in groups]
+        period = None if body.get('period') is None else int(body['period'])
+        offset = None if body.get('offset') is None else int(body['offset'])
+        wave = None if body.get('wave') is None else int(body['wave'])
+        with session.lock:
+            lights = session.model.lights
+            if groups is not None and not all(0 <= group < lights.group_count for group in groups):
+                raise ValueError(f'groups must be between 0 and {lights.group_count - 1}')
+            if wave is not None:
+                if not groups:
+                    raise ValueError('a green wave needs the list of groups')
+                if period is not None and period <= 0:
+                    raise ValueError('period must be positive')
+                lights.green_wave(session.model.step_count, groups, wave, period=period)
+            else:
+                lights.set_phase(session.model.step_count, groups, period=period, offset=offset)
+            step = session.model.step_count
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"message": f"Invalid light phases: {e}"}), 400
+    return jsonify({"message": "Light phases updated.", "step": step})
+
+
 @app.route('/getDestinations', methods=['GET'])
 @cross_origin()
 def getDestinations():
-    global cityModel
-
-    if cityModel is None:
-        return jsonify({"message": "Model not initialized"}), 400
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    # Static layers never change, so they are read without taking the session lock
+    cityModel = session.model
 
     if request.method == 'GET':
         try:
-            destPositions = [
-                {"id": str(a.unique_id), "x": x, "y": 0.99, "z": y}
-                for cell_contents, (x, y) in cityModel.grid.coord_iter()
-                for a in cell_contents if isinstance(a, Destination)
-            ]
+            payload = static_payload(cityModel.city_map.source_hash, 'destinations', lambda: {'positions': [
+                {"id": destId, "x": x, "y": 0.99, "z": y}
+                for destId, (x, y) in cityModel.get_destination_cells()
+            ]})
 
             # for cell_contents, x, y in cityModel.grid.coord_iter():
             #     for a in cell_contents:
             #         if isinstance(a, Obstacle):
             #             destPositions.append({"id": str(a.unique_id), "x": x, "y": 1, "z": y})
 
-            return jsonify({'positions': destPositions})
+            return staticResponse(payload)
         except Exception as e:
             print(traceback.format_exc())
             print(f"Exception in getObstacles: {e}")
@@ -141,20 +312,20 @@ def getDestinations():
 @app.route('/getRoads', methods=['GET'])
 @cross_origin()
 def getRoads():
-    global cityModel
-
-    if cityModel is None:
-        return jsonify({"message": "Model not initialized"}), 400
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    # Static layers never change, so they are read without taking the session lock
+    cityModel = session.model
 
     if request.method == 'GET':
         try:
-            roadPositions = [
-                {"id": str(a.unique_id), "x": x, "y": 0.999, "z": y, "direction": a.direction}
-                for cell_contents, (x, y) in cityModel.grid.coord_iter()
-                for a in cell_contents if isinstance(a, Road)
-            ]
+            payload = static_payload(cityModel.city_map.source_hash, 'roads', lambda: {'positions': [
+                {"id": roadId, "x": x, "y": 0.999, "z": y, "direction": directions}
+                for roadId, (x, y), directions in cityModel.get_roads()
+            ]})
 
-            return jsonify({'positions': roadPositions})
+            return staticResponse(payload)
         except Exception as e:
             print(traceback.format_exc())
             print(f"Exception in getObstacles: {e}")
@@ -165,21 +336,465 @@ def getRoads():
 @app.route('/update', methods=['GET'])
 @cross_origin()
 def updateModel():
-    global currentStep, cityModel
-
-    if cityModel is None:
-        return jsonify({"message": "Model not initialized"}), 400
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
 
     if request.method == 'GET':
         try:
-            cityModel.step()
-            currentStep += 1
+            # The check and the step run under the same locks, so /run or /stream cannot start in between
+            with session.stepping() as stepping:
+                if not stepping:
+                    return sessionFreeRunning()
+                session.model.step()
+                session.current_step += 1
+                currentStep = session.current_step
             return jsonify({'message': f'Model updated to step {currentStep}.', 'currentStep': currentStep})
         except Exception as e:
             print(f"Exception in updateModel: {e}")
             return jsonify({"message": "Error during step."}), 500
 
+# This route advances the model N steps and returns a single frame with what changed.
+# Query parameters:
+#   steps: number of steps to advance (default 1, 0 only reads the current frame, at most MAX_STEPS_PER_REQUEST)
+#   ack: last step the client already has; the frame only carries changes since that step
+#   full: 1 to force a full resync (all cars and lights)
+#   session: session returned by /init
+@app.route('/step', methods=['GET'])
+@cross_origin()
+def stepModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    try:
+        steps = int(request.args.get('steps', 1))
+        ack = request.args.get('ack')
+        ack = int(ack) if ack is not None else None
+        full = request.args.get('full', '0') in ('1', 'true')
+    except ValueError:
+        return jsonify({"message": "Invalid step parameters"}), 400
+    if not 0 <= steps <= MAX_STEPS_PER_REQUEST:
+        return jsonify({"message": f"steps must be between 0 and {MAX_STEPS_PER_REQUEST}"}), 400
+
+    try:
+        with session.stepping() as stepping:
+            if not stepping:
+                return sessionFreeRunning()
+            for _ in range(steps):
+                session.model.step()
+                session.current_step += 1
+            frame = session.frames.frame(ack=ack, full=full)
+        return timedJson(frame)
+    except Exception as e:
+        print(traceback.format_exc())
+        print(f"Exception in stepModel: {e}")
+        return jsonify({"message": "Error during step."}), 500
+
+# Starts free-running mode: a background thread steps the model ahead of the viewers and
+# keeps the frames in a ring buffer, so /frames never waits for a step to be computed.
+# Query parameters:
+#   lookahead: steps the simulation may run ahead of the last frame read (default 32)
+#   sps: target steps per second (default: as fast as possible)
+#   session: session returned by /init
+@app.route('/run', methods=['POST'])
+@cross_origin()
+def runModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    try:
+        lookahead = int(request.args.get('lookahead', 32))
+        stepsPerSecond = request.args.get('sps')
+        stepsPerSecond = float(stepsPerSecond) if stepsPerSecond else None
+    except ValueError:
+        return jsonify({"message": "Invalid run parameters"}), 400
+
+    simulator = session.start_simulator(lookahead=lookahead, steps_per_second=stepsPerSecond)
+    return jsonify({"message": "Simulation running.", **simulator.info()})
+
+# Pauses, resumes or stops the background simulator of a session
+@app.route('/pause', methods=['POST'])
+@cross_origin()
+def pauseModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    if session.simulator is None:
+        return jsonify({"message": "Session is not free-running. Call /run first."}), 409
+    session.simulator.pause()
+    return jsonify({"message": "Simulation paused.", **session.simulator.info()})
+
+@app.route('/resume', methods=['POST'])
+@cross_origin()
+def resumeModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    if session.simulator is None:
+        return jsonify({"message": "Session is not free-running. Call /run first."}), 409
+    session.simulator.resume()
+    return jsonify({"message": "Simulation resumed.", **session.simulator.info()})
+
+@app.route('/stop', methods=['POST'])
+@cross_origin()
+def stopModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    session.stop_simulator()
+    return jsonify({"message": "Simulation stopped.", "step": session.model.step_count})
+
+# Returns the next precomputed frame of a free-running session, as a delta from ack.
+# Query parameters:
+#   ack: last step the client already has (without it the latest frame is sent in full)
+#   full: 1 to force a full resync
+#   wait: seconds to wait for a new frame before answering 204 (default 0, max 5)
+#   session: session returned by /init
+@app.route('/frames', methods=['GET'])
+@cross_origin()
+def getFrames():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    simulator = session.simulator
+    if simulator is None:
+        return jsonify({"message": "Session is not free-running. Call /run first."}), 409
+
+    try:
+        ack = request.args.get('ack')
+        ack = int(ack) if ack is not None else None
+        full = request.args.get('full', '0') in ('1', 'true')
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), 5.0)
+    except ValueError:
+        return jsonify({"message": "Invalid frame parameters"}), 400
+
+    frame = simulator.frame(ack=ack, full=full, wait=wait)
+    if frame is None:
+        return Response(status=204)
+    return timedJson(frame)
+
+# Pushes the frames of a session as Server-Sent Events while the background simulator runs.
+# Each event carries the latest buffered frame as a delta from the last one this viewer got,
+# so a slow viewer skips intermediate frames instead of falling behind. Every viewer of the
+# session reads the same buffer; subscribing never adds steps. When the last viewer disconnects,
+# a simulator started by the stream is stopped so the session can be stepped again (one started
+# with /run keeps running).
+# Query parameters:
+#   sps: target steps per second if the stream has to start the simulator (default 4)
+#   lookahead: steps the simulator may run ahead if the stream starts it (default 8)
+#   session: session returned by /init
+# A reconnecting EventSource sends Last-Event-ID, which is used as the acknowledged step.
+STREAM_KEEPALIVE_SECONDS = 15
+
+def frameEvents(simulator, ack):
+    while True:
+        frame = simulator.frame(ack=ack, wait=STREAM_KEEPALIVE_SECONDS, latest=True)
+        if frame is None:
+            if simulator.done:
+                yield "event: end\ndata: {}\n\n"
+                return
+            # Comment line that keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            continue
+        ack = frame["step"]
+        yield f"id: {ack}\ndata: {json.dumps(frame, separators=(',', ':'))}\n\n"
+
+@app.route('/stream', methods=['GET'])
+@cross_origin()
+def streamFrames():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    try:
+        ack = request.headers.get('Last-Event-ID') or request.args.get('ack')
+        ack = int(ack) if ack is not None else None
+        stepsPerSecond = float(request.args.get('sps', 4))
+        lookahead = int(request.args.get('lookahead', 8))
+    except ValueError:
+        return jsonify({"message": "Invalid stream parameters"}), 400
+
+    simulator = session.open_stream(lookahead=lookahead, steps_per_second=stepsPerSecond)
+
+    response = Response(
+        frameEvents(simulator, ack),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Runs when the viewer disconnects; the last viewer stops a simulator the stream started
+    response.call_on_close(session.close_stream)
+    return response
+
+# Returns the latest traced events of a session (see CITY_TRACE)
+# Query parameters:
+#   since: only events of later steps
+#   limit: maximum number of events, the most recent ones (default 500)
+#   session: session returned by /init
+@app.route('/trace', methods=['GET'])
+@cross_origin()
+def getTrace():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    try:
+        since = int(request.args.get('since', -1))
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({"message": "Invalid trace parameters"}), 400
+
+    with session.lock:
+        events = [event for event in session.model.tracer.events() if event[0] > since]
+    events = events[-limit:] if limit > 0 else []
+    return jsonify({
+        'enabled': TRACE_CATEGORIES_ENABLED,
+        'events': [{'step': event[0], 'message': format_event(event)} for event in events],
+    })
+
+# Step phase timers, routing and lane-change counters and HTTP latencies in the
+# Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    SESSIONS.set(len(sessions.list()))
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Captures a cProfile of the next steps of a session.
+# POST starts the capture (query parameter steps, default 50); GET returns the report of the
+# last finished capture as text, or 202 while it is still running.
+@app.route('/profile', methods=['GET', 'POST'])
+@cross_origin()
+def profileModel():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+
+    if request.method == 'POST':
+        try:
+            steps = int(request.args.get('steps', 50))
+        except ValueError:
+            return jsonify({"message": "Invalid profile parameters"}), 400
+        if steps <= 0:
+            return jsonify({"message": "steps must be positive"}), 400
+        with session.lock:
+            session.model.start_profile(steps)
+        return jsonify({"message": f"Profiling the next {steps} steps."})
+
+    with session.lock:
+        profiler = session.model.profiler
+        report = session.model.profile_report
+    if profiler is not None:
+        return jsonify({"message": f"Profiling, {profiler.remaining} steps left."}), 202
+    if report is None:
+        return jsonify({"message": "No profile captured. POST /profile first."}), 404
+    return Response(report, mimetype='text/plain')
+
+# Branch parameters accepted by /restore (query) and /fork (JSON); a new seed makes the branch diverge
+def branchOptions(values):
+    options = {}
+    for key, name in (('seed', 'seed'), ('spawnInterval', 'spawn_interval'), ('lightPeriod', 'light_period')):
+        if values.get(key) is not None:
+            options[name] = int(values.get(key))
+    if options.get('spawn_interval', 1) <= 0 or options.get('light_period', 1) <= 0:
+        raise ValueError('spawnInterval and lightPeriod must be positive')
+    return options
+
+# Creates a session from a snapshot, at the same step as the snapshot. With evict=False it returns
+# None instead of evicting another live session when the registry is full
+def restoredSession(data, options, evict=True):
+    session = sessions.create(lambda: restore_snapshot(data, tracer=newTracer(), map_dir=MAPS_DIR, **options), evict)
+    if session is not None:
+        session.current_step = session.model.step_count
+    return session
+
+# Returns the binary snapshot of a session: car arrays, routes, lights, RNG state and counters
+@app.route('/snapshot', methods=['GET'])
+@cross_origin()
+def getSnapshot():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    with session.lock:
+        data = take_snapshot(session.model)
+        step = session.model.step_count
+    response = Response(data, mimetype=SNAPSHOT_MIME_TYPE)
+    response.headers['Content-Disposition'] = f'attachment; filename="step_{step}.citysnap"'
+    return response
+
+# Creates a new session from a snapshot sent as the request body.
+# Query parameters (optional): seed, spawnInterval, lightPeriod
+@app.route('/restore', methods=['POST'])
+@cross_origin()
+def restoreSession():
+    try:
+        options = branchOptions(request.args)
+        session = restoredSession(request.get_data(), options)
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        return jsonify({"message": f"Invalid snapshot: {e}"}), 400
+    return jsonify({"message": "Snapshot restored.", "session": session.id, "step": session.current_step})
+
+# Forks a session into several what-if branches, each a new session starting at the current step.
+# JSON body: {"branches": [{"lightPeriod": 5}, {"seed": 2, "spawnInterval": 4}, ...]}, or
+# ?count=N for N identical copies. Forks only use free session slots: a fork never evicts
+# another live session, so a request for more branches than free slots is refused with 409
+@app.route('/fork', methods=['POST'])
+@cross_origin()
+def forkSession():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    try:
+        body = request.get_json(silent=True) or {}
+        branches = body.get('branches') or [{}] * int(request.args.get('count', 1))
+        options = [branchOptions(branch) for branch in branches]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"message": f"Invalid fork parameters: {e}"}), 400
+    if not options:
+        return jsonify({"message": "At least one branch must be forked."}), 400
+    free = sessions.free_slots()
+    if len(options) > free:
+        return jsonify({"message": f"Only {max(free, 0)} sessions are free; forking more would evict other sessions."}), 409
+
+    # The snapshot is taken once, under the lock; the branches are built without holding it
+    with session.lock:
+        data = take_snapshot(session.model)
+    forks = []
+    for branch, branchOption in zip(branches, options):
+        fork = restoredSession(data, branchOption, evict=False)
+        if fork is None:
+            # Another request took the free slots in the meantime
+            return jsonify({"message": f"Forked {len(forks)} branches before the sessions ran out.", "branches": forks}), 409
+        fork.forked_from = session.id
+        forks.append({**branch, 'session': fork.id, 'step': fork.current_step})
+    return jsonify({"message": f"Forked {len(forks)} branches.", "branches": forks})
+
+# Starts recording every step of a session to an append-only replay log. Every recording gets its
+# own replay id, "<session id>-<suffix>", so recording again never overwrites an earlier log.
+# Query parameters: chunk (steps per compressed chunk, default 64)
+@app.route('/record', methods=['POST'])
+@cross_origin()
+def startRecording():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    try:
+        chunk = int(request.args.get('chunk', 64))
+    except ValueError:
+        return jsonify({"message": "Invalid record parameters"}), 400
+    if chunk <= 0:
+        return jsonify({"message": "chunk must be positive"}), 400
+    replayId = f"{session.id}-{uuid.uuid4().hex[:8]}"
+    with session.lock:
+        session.model.start_recording(replayPath(replayId), chunk_steps=chunk)
+        step = session.model.step_count
+    return jsonify({"message": f"Recording from step {step}.", "replay": replayId})
+
+# Stops the recording of a session and writes its last chunk
+@app.route('/record/stop', methods=['POST'])
+@cross_origin()
+def stopRecording():
+    session = findSession()
+    if session is None:
+        return sessionNotFound()
+    with session.lock:
+        recorder = session.model.recorder
+        session.model.stop_recording()
+    replayId = os.path.basename(recorder.path)[:-len(REPLAY_EXTENSION)] if recorder is not None else None
+    return jsonify({"message": "Recording stopped.", "replay": replayId})
+
+def replayPath(replayId):
+    return os.path.join(REPLAY_DIR, replayId + REPLAY_EXTENSION)
+
+def replayReader(replayId):
+    path = replayPath(replayId)
+    if not re.fullmatch(r'[0-9A-Za-z_-]+', replayId) or not os.path.isfile(path):
+        return None
+    # A session that is still recording this log writes its pending steps first. The log is found
+    # by its path, and sessions.list() does not touch the sessions, so browsing a replay never
+    # changes their eviction order; logs of closed sessions are read straight from disk
+    for session in sessions.list():
+        recorder = session.model.recorder
+        if recorder is not None and recorder.path == path:
+            with session.lock:
+                if session.model.recorder is recorder:
+                    recorder.flush()
+            break
+    with replayReadersLock:
+        reader = replayReaders.pop(replayId, None) or ReplayReader(path)
+        replayReaders[replayId] = reader
+        while len(replayReaders) > 16:
+            replayReaders.popitem(last=False)
+    return reader
+
+# Lists the replay logs with their recorded step range
+@app.route('/replays', methods=['GET'])
+@cross_origin()
+def listReplays():
+    replays = []
+    if os.path.isdir(REPLAY_DIR):
+        for name in sorted(os.listdir(REPLAY_DIR)):
+            if name.endswith(REPLAY_EXTENSION):
+                reader = replayReader(name[:-len(REPLAY_EXTENSION)])
+                if reader is not None:
+                    with reader.lock:
+                        reader.refresh()
+                        replays.append({'replay': name[:-len(REPLAY_EXTENSION)], **reader.info()})
+    return jsonify({'replays': replays})
+
+# Serves recorded steps without simulating them, in the same frame format as /step: the first
+# frame is full and every other one is a delta from the previous frame (all full with full=1).
+# Query parameters:
+#   replay: replay id (returned by /record)
+#   start, end: first and last step (default: the whole log, at most MAX_REPLAY_STEPS steps)
+#   full: 1 to send every frame in full
+@app.route('/replay', methods=['GET'])
+@cross_origin()
+def getReplay():
+    reader = replayReader(request.args.get('replay', ''))
+    if reader is None:
+        return jsonify({"message": "Replay not found."}), 404
+    try:
+        with reader.lock:
+            reader.refresh()
+            start = int(request.args.get('start', reader.first_step or 0))
+            end = int(request.args.get('end', start + MAX_REPLAY_STEPS - 1))
+            full = request.args.get('full', '0') in ('1', 'true')
+            end = min(end, start + MAX_REPLAY_STEPS - 1)
+
+            frames = []
+            base = None
+            for step, cars, lights in reader.states(start, end):
+                frames.append(build_frame(step, cars, lights, None if full else base))
+                base = (cars, lights)
+            lastStep = reader.last_step
+    except ValueError:
+        return jsonify({"message": "Invalid replay parameters"}), 400
+    nextStep = frames[-1]['step'] + 1 if frames and lastStep is not None and frames[-1]['step'] < lastStep else None
+    return timedJson({'start': start, 'end': end, 'lastStep': lastStep, 'next': nextStep, 'frames': frames})
+
+# Lists the live sessions with their step, number of cars and approximate memory
+@app.route('/sessions', methods=['GET'])
+@cross_origin()
+def listSessions():
+    live = sessions.list()
+    return jsonify({
+        'sessions': [session.info() for session in live],
+        'maxSessions': sessions.max_sessions,
+        'idleTimeout': sessions.idle_timeout,
+        'evicted': sessions.evicted,
+    })
+
+# Closes a session and frees its model
+@app.route('/close', methods=['POST'])
+@cross_origin()
+def closeSession():
+    sessionId = request.args.get('session') or request.headers.get('X-Session-Id')
+    if not sessionId or not sessions.remove(sessionId):
+        return sessionNotFound()
+    return jsonify({"message": f"Session {sessionId} closed."})
+
 if __name__ == '__main__':
-    # Run the flask server on port 8585
-    app.run(host="localhost", port=8585, debug=False)
+    # Run the flask server on port 8585 (CITY_PORT changes it)
+    app.run(host="localhost", port=int(os.environ.get('CITY_PORT', 8585)), debug=False)
 
@@ -0,0 +1,282 @@
+# 17/10/2026
+# File with the command line entry point of the city simulation
+
+import argparse
+import json
+import sys
+from urllib.parse import urlsplit
+
+from .bench import compare_results, run_benchmark
+from .citymap import DEFAULT_MAP
+from .frames import build_frame
+from .headless import run_simulation
+from .loadtest import DEFAULT_URL, PATTERNS, UPDATE_INTERVAL, format_stage, run_stage, start_server, stop_server
+from .mapgen import write_map
+from .replay import ReplayReader
+from .sweep import run_sweep
+from .trace import CATEGORIES, LEVELS, Tracer, decode_trace
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m city_agents",
+        description="Herramientas de línea de comandos de la simulación de la ciudad.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Corre una simulación sin interfaz y escribe su resumen")
+    run.add_argument("--map", default=DEFAULT_MAP, help="Año del mapa (2021-2024) o ruta de un mapa")
+    run.add_argument("--steps", type=int, default=1000, help="Número de pasos a simular")
+    run.add_argument("--seed", type=int, default=None, help="Semilla del generador aleatorio")
+    run.add_argument(
+        "--spawn-interval", type=int, default=None, help="Pasos entre generaciones de coches (por defecto 10)"
+    )
+    run.add_argument("--light-period", type=int, default=None, help="Pasos entre cambios de los semáforos")
+    run.add_argument("--engine", choices=("agents", "numpy"), default="agents", help="Motor de los coches")
+    run.add_argument(
+        "--activation", choices=("random", "event"), default="random",
+        help="Activación de los coches: todos en cada paso, o los bloqueados solo cuando se libera su celda",
+    )
+    run.add_argument(
+        "--routing", choices=("shortest", "congestion"), default="shortest",
+        help="Rutas de menos saltos, o A* con pesos de ocupación y colas (solo con --engine agents)",
+    )
+    run.add_argument("--no-cache", action="store_true", help="Compilar el mapa sin usar el caché")
+    run.add_argument("--output", default="-", help="Archivo JSON del resumen ('-' para la salida estándar)")
+    run.add_argument(
+        "--restore", default=None, metavar="SNAPSHOT",
+        help="Continúa desde un snapshot; --seed, --spawn-interval y --light-period lo modifican si se indican",
+    )
+    run.add_argument("--save-snapshot", default=None, metavar="PATH", help="Guarda el snapshot final del modelo")
+    run.add_argument("--record", default=None, metavar="PATH", help="Graba cada paso en un log de repetición")
+    run.add_argument(
+        "--metrics-steps", default=None, metavar="PATH",
+        help="Exporta los agregados de cada paso a un CSV (o Parquet si termina en .parquet)",
+    )
+    run.add_argument(
+        "--metrics-trips", default=None, metavar="PATH",
+        help="Exporta un registro por viaje terminado a un CSV (o Parquet si termina en .parquet)",
+    )
+    run.add_argument(
+        "--profile", type=int, default=0, metavar="N",
+        help="Captura con cProfile los primeros N pasos y escribe el reporte en la salida de errores",
+    )
+    run.add_argument(
+        "--trace", nargs="+", choices=CATEGORIES + ("all",), default=[],
+        help="Categorías de eventos a registrar",
+    )
+    run.add_argument("--trace-level", choices=tuple(LEVELS), default="info", help="Nivel mínimo de los eventos")
+    run.add_argument(
+        "--trace-file", default="-",
+        help="Archivo binario de la traza ('-' imprime los eventos en la salida de errores)",
+    )
+
+    trace = commands.add_parser("trace", help="Decodifica un archivo binario de traza")
+    trace.add_argument("path", help="Archivo de traza escrito por run --trace-file")
+    trace.add_argument("--category", nargs="+", choices=CATEGORIES, default=None, help="Categorías a mostrar")
+    trace.add_argument("--level", choices=tuple(LEVELS), default="debug", help="Nivel mínimo de los eventos")
+
+    sweep = commands.add_parser(
+        "sweep", help="Corre un barrido de parámetros en paralelo y guarda cada corrida en JSON Lines"
+    )
+    sweep.add_argument("--maps", nargs="+", default=["2021", "2022", "2023", "2024"], help="Mapas a probar")
+    sweep.add_argument("--spawn-intervals", nargs="+", type=int, default=[10], help="Intervalos de generación")
+    sweep.add_argument(
+        "--light-periods", nargs="+", default=["map"],
+        help="Pasos entre cambios de los semáforos ('map' usa los del mapa)",
+    )
+    sweep.add_argument("--seeds", type=int, default=10, help="Número de semillas por escenario")
+    sweep.add_argument("--seed-start", type=int, default=0, help="Primera semilla")
+    sweep.add_argument("--steps", type=int, default=1000, help="Pasos por corrida")
+    sweep.add_argument("--engine", choices=("agents", "numpy"), default="agents", help="Motor de los coches")
+    sweep.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto, uno por CPU)")
+    sweep.add_argument(
+        "--output", required=True,
+        help="Archivo JSON Lines de resultados; si ya existe, el barrido continúa donde se quedó",
+    )
+
+    replay = commands.add_parser(
+        "replay", help="Muestra el rango de pasos de un log de repetición o exporta algunos pasos"
+    )
+    replay.add_argument("path", help="Log escrito por run --record o por /record")
+    replay.add_argument("--start", type=int, default=None, help="Primer paso a exportar")
+    replay.add_argument("--end", type=int, default=None, help="Último paso a exportar (por defecto, --start)")
+    replay.add_argument("--output", default="-", help="Archivo JSON de salida ('-' para la salida estándar)")
+
+    generate = commands.add_parser("generate", help="Genera un mapa de ciudad con el formato de city_files")
+    generate.add_argument("--width", type=int, required=True, help="Ancho del mapa en celdas")
+    generate.add_argument("--height", type=int, required=True, help="Alto del mapa en celdas")
+    generate.add_argument("--block", type=int, default=6, help="Tamaño aproximado de las manzanas")
+    generate.add_argument("--destinations", type=int, default=None, help="Número de destinos")
+    generate.add_argument("--light-fraction", type=float, default=0.5, help="Proporción de cruces con semáforos")
+    generate.add_argument("--seed", type=int, default=0, help="Semilla del generador")
+    generate.add_argument("--output", required=True, help="Archivo del mapa")
+
+    bench = commands.add_parser(
+        "bench", help="Mide inicio, latencia de paso, memoria y endpoints en mapas generados de varios tamaños"
+    )
+    bench.add_argument("--sizes", nargs="+", type=int, default=[30, 100, 300], help="Lados de los mapas")
+    bench.add_argument("--cars", nargs="+", type=int, default=[0, 100, 1000], help="Coches iniciales por caso")
+    bench.add_argument(
+        "--engines", nargs="+", choices=("agents", "numpy"), default=["agents", "numpy"], help="Motores a medir"
+    )
+    bench.add_argument("--steps", type=int, default=100, help="Pasos medidos por caso")
+    bench.add_argument("--requests", type=int, default=50, help="Peticiones por endpoint (0 para omitirlos)")
+    bench.add_argument("--seed", type=int, default=0, help="Semilla de los mapas y de los coches")
+    bench.add_argument("--output", default="-", help="Archivo JSON de resultados ('-' para la salida estándar)")
+    bench.add_argument("--compare", default=None, help="Resultados previos para comparar la latencia de paso")
+
+    load = commands.add_parser(
+        "loadtest", help="Simula visores del frontend contra city-server.py y mide latencia y errores"
+    )
+    load.add_argument("--url", default=DEFAULT_URL, help="Dirección del servidor")
+    load.add_argument(
+        "--start-server", action="store_true",
+        help="Inicia city-server.py en el puerto de --url con espacio para todas las sesiones",
+    )
+    load.add_argument(
+        "--clients", nargs="+", type=int, default=[1, 5, 10], help="Visores simultáneos de cada etapa"
+    )
+    load.add_argument("--duration", type=float, default=30.0, help="Segundos de carga de cada etapa")
+    load.add_argument("--ramp-up", type=float, default=5.0, help="Segundos en los que entran los visores")
+    load.add_argument("--interval", type=float, default=UPDATE_INTERVAL, help="Segundos entre actualizaciones")
+    load.add_argument("--pattern", choices=PATTERNS, default="poll", help="Peticiones de cada actualización")
+    load.add_argument("--map", default="2024", help="Mapa de las sesiones")
+    load.add_argument("--engine", choices=("agents", "numpy"), default="agents", help="Motor de las sesiones")
+    load.add_argument("--processes", type=int, default=1, help="Procesos en los que se reparten los visores")
+    load.add_argument("--output", default="-", help="Archivo JSON del reporte ('-' para la salida estándar)")
+
+    return parser.parse_args(argv)
+
+
+def write_json(data, output):
+    """Escribe data como JSON en el archivo output, o en la salida estándar si es '-'."""
+    if output == "-":
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output, "w") as file:
+            json.dump(data, file, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        tracer = None
+        if args.trace:
+            categories = CATEGORIES if "all" in args.trace else args.trace
+            to_stderr = args.trace_file == "-"
+            tracer = Tracer(
+                categories,
+                level=LEVELS[args.trace_level],
+                path=None if to_stderr else args.trace_file,
+                echo=sys.stderr if to_stderr else None,
+            )
+        summary = run_simulation(
+            map_file=args.map,
+            steps=args.steps,
+            seed=args.seed,
+            spawn_interval=args.spawn_interval,
+            light_period=args.light_period,
+            engine=args.engine,
+            activation=args.activation,
+            routing=args.routing,
+            use_map_cache=not args.no_cache,
+            tracer=tracer,
+            profile_steps=args.profile,
+            restore_from=args.restore,
+            snapshot_path=args.save_snapshot,
+            record_path=args.record,
+            metrics_steps_path=args.metrics_steps,
+            metrics_trips_path=args.metrics_trips,
+        )
+        if args.profile > 0:
+            sys.stderr.write(summary.pop("profile"))
+        write_json(summary, args.output)
+    elif args.command == "trace":
+        for line in decode_trace(args.path, categories=args.category, level=LEVELS[args.level]):
+            print(line)
+    elif args.command == "sweep":
+        light_periods = [None if period == "map" else int(period) for period in args.light_periods]
+
+        def progress(finished, total, result):
+            status = "error" if "error" in result else f"{result['timing']['run_seconds']} s"
+            print(f"[{finished}/{total}] {result['run']} ({status})", file=sys.stderr)
+
+        executed, failed = run_sweep(
+            args.output,
+            maps=args.maps,
+            spawn_intervals=args.spawn_intervals,
+            light_periods=light_periods,
+            seeds=range(args.seed_start, args.seed_start + args.seeds),
+            steps=args.steps,
+            engine=args.engine,
+            workers=args.workers,
+            progress=progress,
+        )
+        print(f"{executed} corridas ejecutadas, {failed} con error.", file=sys.stderr)
+    elif args.command == "replay":
+        reader = ReplayReader(args.path)
+        if args.start is None:
+            write_json(reader.info(), args.output)
+        else:
+            end = args.start if args.end is None else args.end
+            frames, base = [], None
+            for step, cars, lights in reader.states(args.start, end):
+                frames.append(build_frame(step, cars, lights, base))  # Igual que /replay: deltas tras el primero
+                base = (cars, lights)
+            write_json({"frames": frames}, args.output)
+    elif args.command == "generate":
+        write_map(
+            args.output,
+            args.width,
+            args.height,
+            block=args.block,
+            destinations=args.destinations,
+            light_fraction=args.light_fraction,
+            seed=args.seed,
+        )
+    elif args.command == "bench":
+        results = run_benchmark(
+            sizes=args.sizes,
+            car_counts=args.cars,
+            engines=args.engines,
+            steps=args.steps,
+            requests=args.requests,
+            seed=args.seed,
+            progress=lambda line: print(line, file=sys.stderr),
+        )
+        write_json(results, args.output)
+        if args.compare:
+            with open(args.compare) as file:
+                previous = json.load(file)
+            for line in compare_results(previous, results):
+                print(line, file=sys.stderr)
+    elif args.command == "loadtest":
+        server = None
+        if args.start_server:
+            server = start_server(urlsplit(args.url).port or 80, max_sessions=max(args.clients))
+        try:
+            stages = []
+            for clients in args.clients:
+                stage = run_stage(
+                    url=args.url,
+                    clients=clients,
+                    duration=args.duration,
+                    ramp_up=args.ramp_up,
+                    interval=args.interval,
+                    pattern=args.pattern,
+                    map_file=args.map,
+                    engine=args.engine,
+                    processes=args.processes,
+                )
+                print(format_stage(stage), file=sys.stderr)
+                stages.append(stage)
+        finally:
+            if server is not None:
+                stop_server(server)
+        write_json({"url": args.url, "map": args.map, "engine": args.engine, "stages": stages}, args.output)
+
+
+if __name__ == "__main__":
+    main()
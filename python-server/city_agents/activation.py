@@ -0,0 +1,119 @@
+# 17/10/2026
+# File with the event-driven scheduler of the city simulation
+
+from mesa.time import RandomActivation
+
+from .metrics import WOKEN_BY_CELL, WOKEN_BY_LIGHT, WOKEN_BY_TIMEOUT
+
+
+class EventActivation(RandomActivation):
+    """
+    Activación aleatoria de los coches activos; los coches estacionados esperan un evento.
+    Los diccionarios se usan como conjuntos ordenados, para que el orden (y con él la
+    simulación) sea el mismo con la misma semilla.
+    """
+
+    def __init__(self, model, patience=10):
+        """
+        Args:
+            model: CityModel del schedule
+            patience: Pasos que espera un coche bloqueado por otro antes de volver a intentar
+                un cambio de carril o una ruta alternativa
+        """
+        super().__init__(model)
+        self.patience = patience
+        self.active = {}  # {coche: None} en orden de llegada; se baraja una copia en cada paso
+        self.parked = {}  # {coche: (celda, paso en que despierta o None)} en orden de espera
+        self.waiting = {}  # {celda: {coche: None}}
+        self.deadlines = {}  # {paso: {coche: None}}
+        self.lights_version = None  # Versión de la tabla de semáforos vista en el último paso
+
+    def add(self, agent):
+        super().add(agent)
+        self.active[agent] = None
+
+    def remove(self, agent):
+        super().remove(agent)
+        self.active.pop(agent, None)
+        if agent in self.parked:
+            self._unpark(agent)
+
+    def park(self, agent, cell, timeout=True):
+        """
+        Saca al coche del orden de activación hasta que cell se libere o su semáforo se ponga
+        en verde. Con timeout, también despierta después de patience pasos.
+        Se llama durante el paso del coche (el paso en curso es model.step_count + 1).
+        """
+        until = self.model.step_count + 1 + self.patience if timeout else None
+        self._park(agent, cell, until)
+
+    def _park(self, agent, cell, until):
+        self.active.pop(agent, None)
+        self.parked[agent] = (cell, until)
+        self.waiting.setdefault(cell, {})[agent] = None
+        if until is not None:
+            self.deadlines.setdefault(until, {})[agent] = None
+
+    def _unpark(self, agent):
+        cell, until = self.parked.pop(agent)
+        waiting = self.waiting[cell]
+        del waiting[agent]
+        if not waiting:
+            del self.waiting[cell]
+        if until is not None:
+            deadlines = self.deadlines[until]
+            del deadlines[agent]
+            if not deadlines:
+                del self.deadlines[until]
+
+    def _wake(self, cell, counter):
+        """Regresa al orden de activación los coches que esperan cell."""
+        waiting = list(self.waiting.get(cell, ()))
+        for agent in waiting:
+            self._unpark(agent)
+            self.active[agent] = None
+        if waiting:
+            counter.inc(len(waiting))
+
+    def _wake_lights(self, step):
+        """Despierta los coches detenidos en semáforos que se ponen en verde en el paso step."""
+        lights = self.model.lights
+        if lights.version != self.lights_version:
+            # Fases editadas: no se sabe qué cambió, se revisan todos los semáforos
+            self.lights_version = lights.version
+            changed = range(len(lights))
+        else:
+            changed = lights.changed(step).tolist()
+        for light in changed:
+            pos = lights.positions[light]
+            if pos in self.waiting and lights.is_green(pos, step):
+                self._wake(pos, WOKEN_BY_LIGHT)
+
+    def _wake_deadlines(self, step):
+        """Despierta los coches a los que se les acabó la paciencia."""
+        deadlines = list(self.deadlines.get(step, ()))
+        for agent in deadlines:
+            self._unpark(agent)
+            self.active[agent] = None
+        if deadlines:
+            WOKEN_BY_TIMEOUT.inc(len(deadlines))
+
+    def step(self):
+        """Activa en orden aleatorio solo los coches que no esperan un evento."""
+        step = self.model.step_count + 1
+        if self.waiting:
+            self._wake_lights(step)
+            self._wake_deadlines(step)
+        order = list(self.active)
+        self.model.random.shuffle(order)
+        for agent in order:
+            if agent not in self.active:
+                continue  # Se quitó del modelo durante este paso
+            cell = agent.pos
+            agent.step()
+            # Un coche que se movió, cambió de carril o llegó deja libre su celda; los coches que
+            # la esperaban se activan desde el siguiente paso
+            if agent.pos != cell:
+                self._wake(cell, WOKEN_BY_CELL)
+        self.steps += 1
+        self.time += 1
@@ -1,17 +1,29 @@
-
 # Gabriel Muñoz Luna A01028774
 # 24/11/2024
 # File with the agents for the city simulation
-# This file contains the agents for the city simulation, such as cars, traffic lights, and obstacles.
+# This file contains the agents for the city simulation: the cars.
+# Roads, obstacles and destinations are static and live in the model's cell arrays, and the
+# traffic lights are a phase table in the model (lights.py).
 
 from mesa import Agent
 from collections import deque
+from .citymap import CELL_ROAD, CELL_TRAFFIC_LIGHT, DIRECTION_BITS
+from .engine import DIRECTION_CODES, NO_DIRECTION
+from .metrics import CONGESTION_REROUTES, LANE_CHANGE_FAILED, LANE_CHANGED
+from .trace import (
+    ARRIVED, BLOCKED, CELL_CONTENTS, CONGESTION_REROUTE, DIRECTION_CHANGED, LANE_CHANGE,
+    LANE_REJECTED, MOVE, NO_ROUTE, RED_LIGHT, REROUTE, ROUTE_FOUND, ROUTE_NOT_FOUND,
+    ROUTE_NO_DESTINATION, ROUTE_SEARCH,
+)
+
+# Ruteo por congestión: cada cuántos pasos un coche revisa el costo de su ruta
+ROUTE_CHECK_INTERVAL = 5
 
 
 class Car(Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
-        self.map_knowledge = model.static_map
+        self.number = int(unique_id[4:])  # N de "car_N", para los eventos de la traza
         self.destination = None
         self.path = []
         self.steps_waited = 0  # Contador de pasos esperando
@@ -21,54 +33,112 @@ class Car(Agent):
         self.direction = None
         self.inactive_steps = 0  # Contador de pasos inactivos
         self.blocked_node = None  # Nodo que se debe evitar
+        self.path_costs = []  # Ruteo por congestión: costo planeado de cada arista de path
+        self.queued_at = None  # Ruteo por congestión: celda en cuya cola espera el coche
+        # Registro del viaje: paso en que apareció, celdas avanzadas y rutas alternativas
+        self.spawn_step = model.step_count
+        self.moves = 0
+        self.reroutes = 0
 
     def bfs_find_shortest_path(self, start, destination, avoid_node=None):
         """
-        Realiza BFS para encontrar la ruta más corta desde el inicio hasta el destino en el grafo.
+        Obtiene la ruta más corta desde el inicio hasta el destino en el grafo.
         Permite evitar un nodo específico si está definido.
+        Usa el servicio de ruteo del modelo, que comparte su caché entre todos los coches.
         """
-        visited = set()
-        queue = deque()
-        queue.append((start, [start]))
-
-        while queue:
-            current_node, path = queue.popleft()
-
-            if current_node == destination:
-                return path
-
-            visited.add(current_node)
-
-            neighbors = self.model.graph.get(current_node, [])
-            for neighbor in neighbors:
-                if neighbor not in visited and neighbor != avoid_node:
-                    visited.add(neighbor)
-                    queue.append((neighbor, path + [neighbor]))
-
-        return None
+        return self.model.router.shortest_path(start, destination, avoid_node)
 
     def calculate_path(self, avoid_node=None):
         """
-        Calcula la rut
-        a más corta al destino usando BFS.
+        Calcula la ruta más corta al destino usando el servicio de ruteo del modelo.
         Si avoid_node está definido, evita ese nodo durante el cálculo.
         """
+        trace = self.model.tracer
         if not self.destination:
-            print(f"Coche {self.unique_id} no tiene destino asignado.")
+            if trace.route:
+                trace.emit(ROUTE_NO_DESTINATION, self.number)
             return
 
         start = self.pos
         destination = self.destination
-        print(
-            f"Coche {self.unique_id} buscando la ruta más corta de {start} a {destination}, evitando {avoid_node}."
-        )
+        if trace.route:
+            trace.emit(ROUTE_SEARCH, self.number, *start, *destination)
 
-        self.path = self.bfs_find_shortest_path(start, destination, avoid_node)
+        congestion = self.model.congestion
+        if congestion is not None:
+            self.path, costs = self.model.router.congested_path(start, destination, congestion, avoid_node)
+            self.path_costs = costs or []
+        else:
+            self.path = self.bfs_find_shortest_path(start, destination, avoid_node)
 
-        if self.path:
-            print(f"Coche {self.unique_id} calculó la ruta más corta: {self.path}")
+        if trace.route:
+            if self.path:
+                trace.emit(ROUTE_FOUND, self.number, len(self.path), *destination)
+            else:
+                trace.emit(ROUTE_NOT_FOUND, self.number, *destination)
+
+    def check_route(self):
+        """
+        Ruteo por congestión: si el costo actual del resto de la ruta supera el costo planeado
+        en más de reroute_threshold, busca otra ruta y la toma solo si es más barata.
+        """
+        congestion = self.model.congestion
+        current = congestion.edge_costs(self.path)
+        current_cost = sum(current)
+        if current_cost - sum(self.path_costs) <= self.model.reroute_threshold:
+            return
+
+        path, costs = self.model.router.congested_path(self.pos, self.destination, congestion)
+        if path and sum(costs) < current_cost:
+            trace = self.model.tracer
+            if trace.route:
+                trace.emit(CONGESTION_REROUTE, self.number, round(current_cost), round(sum(costs)))
+            CONGESTION_REROUTES.inc()
+            self.reroutes += 1
+            self.path, self.path_costs = path, costs
         else:
-            print(f"Coche {self.unique_id} no encontró un camino a {destination}.")
+            self.path_costs = current  # La ruta sigue siendo la mejor: su costo actual es la nueva referencia
+
+    def move_to(self, pos):
+        """Mueve el coche a pos en la cuadrícula y en el campo de congestión."""
+        congestion = self.model.congestion
+        if congestion is not None:
+            congestion.leave(self.pos)
+            congestion.enter(pos)
+            self.leave_queue()
+        self.model.grid.move_agent(self, pos)
+        self.moves += 1
+
+    def join_queue(self, pos):
+        """Ruteo por congestión: cuenta al coche en la cola de la celda pos."""
+        if self.queued_at != pos:
+            self.leave_queue()
+            self.model.congestion.join_queue(pos)
+            self.queued_at = pos
+
+    def leave_queue(self):
+        if self.queued_at is not None:
+            self.model.congestion.leave_queue(self.queued_at)
+            self.queued_at = None
+
+    def trace_rejected_lanes(self, next_node, until=None):
+        """
+        Traza: calles vecinas libres de next_node que no permiten la dirección del coche,
+        en el orden de revisión y hasta el carril elegido (until).
+        """
+        next_x, next_y = next_node
+        bit = DIRECTION_BITS.get(self.direction, 0)
+        for lateral in [(next_x, next_y + 1), (next_x, next_y - 1), (next_x + 1, next_y), (next_x - 1, next_y)]:
+            if lateral == until:
+                return
+            if (
+                0 <= lateral[0] < self.model.width
+                and 0 <= lateral[1] < self.model.height
+                and self.model.cell_type[lateral[1], lateral[0]] == CELL_ROAD
+                and not self.model.cell_directions[lateral[1], lateral[0]] & bit
+                and self.model.grid.is_cell_empty(lateral)
+            ):
+                self.model.tracer.emit(LANE_REJECTED, self.number, *lateral)
 
     def update_direction(self, current_pos, next_pos):
         """
@@ -82,7 +152,11 @@ class Car(Agent):
             self.direction = "Up"
         elif next_pos[1] < current_pos[1]:
             self.direction = "Down"
-        print(f"Coche {self.unique_id} cambió dirección a {self.direction}.")
+        trace = self.model.tracer
+        if trace.move:
+            trace.emit(
+                DIRECTION_CHANGED, self.number, DIRECTION_CODES.get(self.direction, NO_DIRECTION)
+            )
 
     def move(self):
         """
@@ -90,182 +164,123 @@ class Car(Agent):
         Si está bloqueado por 2 pasos consecutivos, intenta cambiar de carril.
         Si está bloqueado por 10 pasos, recalcula una ruta alternativa evitando el nodo bloqueado.
         """
+        trace = self.model.tracer
         if self.pos == self.destination:
-            print(f"Coche {self.unique_id} ha llegado a su destino en {self.pos}.")
+            if trace.arrival:
+                trace.emit(ARRIVED, self.number, *self.pos)
 
             # Incrementar el contador de coches que llegaron a su destino en el modelo
             self.model.agents_reached_destination += 1
+            # El coche pudo avanzar en los pasos entre el que apareció y este; los demás esperó
+            arrival_step = self.model.step_count + 1
+            self.model.metrics_store.record_trip(
+                self.number,
+                self.spawn_step,
+                arrival_step,
+                arrival_step - self.spawn_step - 1 - self.moves,
+                self.reroutes,
+            )
+            if self.model.congestion is not None:
+                self.model.congestion.leave(self.pos)
+                self.leave_queue()
 
             self.model.grid.remove_agent(self)
             self.model.schedule.remove(self)
             return
 
+        if (
+            self.model.congestion is not None
+            and self.path
+            and len(self.path) > 1
+            and (self.model.step_count + self.number) % ROUTE_CHECK_INTERVAL == 0
+        ):
+            self.check_route()
+
         if not self.path or len(self.path) <= 1:
             self.calculate_path()
             if not self.path or len(self.path) <= 1:
-                print(
-                    f"Coche {self.unique_id} no tiene una ruta válida o ya está en el destino."
-                )
+                if trace.route:
+                    trace.emit(NO_ROUTE, self.number)
                 return
 
         next_node = self.path[1]
-        cell_contents = self.model.grid.get_cell_list_contents(next_node)
-        print(
-            f"Coche {self.unique_id}: nodo {next_node} contiene {[type(agent).__name__ for agent in cell_contents]}"
-        )
-
-        other_car = next(
-            (agent for agent in cell_contents if isinstance(agent, Car)), None
-        )
-        if other_car:
-            print(
-                f"Coche {self.unique_id} detectó un coche bloqueando el nodo {next_node}. Evaluando cambio de carril."
+        if trace.move:
+            cell_contents = self.model.grid.get_cell_list_contents(next_node)
+            trace.emit(
+                CELL_CONTENTS,
+                self.number,
+                *next_node,
+                sum(isinstance(agent, Car) for agent in cell_contents),
+                int(self.model.cell_type[next_node[1], next_node[0]] == CELL_TRAFFIC_LIGHT),
             )
+
+        # En la cuadrícula solo hay coches: una celda ocupada tiene otro coche
+        if not self.model.grid.is_cell_empty(next_node):
             self.inactive_steps += 8
+            if self.model.congestion is not None:
+                self.join_queue(next_node)
+            if trace.block:
+                trace.emit(BLOCKED, self.number, *next_node, self.inactive_steps)
 
             # Intentar cambio de carril tras 2 pasos bloqueados
             if self.inactive_steps >= 1:
-                print(
-                    f"Coche {self.unique_id} bloqueado por {self.inactive_steps} pasos. Buscando cambio de carril."
-                )
-                next_x, next_y = next_node
-                lateral_moves = [
-                    (next_x, next_y + 1),  # Arriba
-                    (next_x, next_y - 1),  # Abajo
-                    (next_x + 1, next_y),  # Derecha
-                    (next_x - 1, next_y),  # Izquierda
-                ]
-
-                for lateral in lateral_moves:
-                    if (
-                        0 <= lateral[0] < self.model.width
-                        and 0 <= lateral[1] < self.model.height
-                    ):
-                        lateral_contents = self.model.grid.get_cell_list_contents(
-                            lateral
-                        )
-                        if not any(
-                            isinstance(
-                                agent, (Car, Obstacle, Destination, Traffic_Light)
-                            )
-                            for agent in lateral_contents
-                        ):
-                            lateral_directions = self.model.static_map[lateral[1]][
-                                lateral[0]
-                            ].get("directions", [])
-                            if self.direction in lateral_directions:
-                                print(
-                                    f"Coche {self.unique_id} cambia al carril {lateral}."
-                                )
-                                self.model.grid.move_agent(self, lateral)
-                                self.calculate_path()
-                                return
-                            else:
-                                print(
-                                    f"Coche {self.unique_id} no puede cambiar al carril {lateral} porque no tiene la misma dirección."
-                                )
+                direction = DIRECTION_CODES.get(self.direction)
+                width = self.model.width
+                next_index = next_node[1] * width + next_node[0]
+                # Calles vecinas de next_node que permiten la dirección del coche, precalculadas
+                targets = self.model.lane_targets[next_index, direction].tolist() if direction is not None else ()
+                for target in targets:
+                    if target < 0:
+                        break
+                    lateral = (target % width, target // width)
+                    if self.model.grid.is_cell_empty(lateral):
+                        if trace.lane:
+                            self.trace_rejected_lanes(next_node, lateral)
+                            trace.emit(LANE_CHANGE, self.number, *lateral)
+                        LANE_CHANGED.inc()
+                        self.move_to(lateral)
+                        self.calculate_path()
+                        return
+                if trace.lane:
+                    self.trace_rejected_lanes(next_node)
+                LANE_CHANGE_FAILED.inc()
 
             # Recalcular ruta alternativa tras 10 pasos bloqueados
             if self.inactive_steps >= 10:
-                print(
-                    f"Coche {self.unique_id} bloqueado por 10 pasos. Recalculando ruta alternativa evitando {next_node}."
-                )
+                if trace.block:
+                    trace.emit(REROUTE, self.number, *next_node)
                 self.blocked_node = next_node
                 self.calculate_path(avoid_node=self.blocked_node)
+                self.reroutes += 1
                 self.inactive_steps = 0  # Reiniciar contador tras recalcular
+            elif self.model.activation == "event":
+                # Esperar fuera del schedule a que se libere la celda (o a que se acabe la paciencia)
+                self.model.schedule.park(self, next_node)
             return
 
         # Resetear pasos inactivos si puede moverse
         self.inactive_steps = 0
-        traffic_light = next(
-            (agent for agent in cell_contents if isinstance(agent, Traffic_Light)), None
-        )
-        if traffic_light and not traffic_light.state:
-            print(
-                f"Coche {self.unique_id} se detuvo frente al semáforo en el nodo {next_node}."
-            )
+        # Semáforo en rojo durante este paso (el paso en curso es step_count + 1)
+        if not self.model.lights.is_green(next_node, self.model.step_count + 1):
+            if trace.light:
+                trace.emit(RED_LIGHT, self.number, *next_node)
+            if self.model.congestion is not None:
+                self.join_queue(next_node)
+            if self.model.activation == "event":
+                self.model.schedule.park(self, next_node, timeout=False)
             return
 
-        print(f"Coche {self.unique_id} avanzando de {self.pos} al nodo {next_node}.")
+        if trace.move:
+            trace.emit(MOVE, self.number, *self.pos, *next_node)
         self.update_direction(self.pos, next_node)
-        self.model.grid.move_agent(self, next_node)
+        self.move_to(next_node)
         self.pos = next_node
         self.path.pop(0)
+        if self.path_costs:
+            self.path_costs.pop(0)
 
     def step(self):
         """
         Determina el movimiento del coche en el paso actual.
         """
         self.move()
-
-
-class Traffic_Light(Agent):
-    """
-    Traffic light. Where the traffic lights are in the grid.
-    """
-
-    def __init__(self, unique_id, model, state=False, timeToChange=10):
-        super().__init__(unique_id, model)
-        """
-        Creates a new Traffic light.
-        Args:
-            unique_id: The agent's ID
-            model: Model reference for the agent
-            state: Whether the traffic light is green or red
-            timeToChange: After how many steps the traffic light changes color 
-        """
-        self.state = state
-        self.timeToChange = timeToChange
-
-    def step(self):
-        """
-        Change the state (green or red) of the traffic light based on the time to change.
-        """
-        if self.model.schedule.steps % self.timeToChange == 0:
-            self.state = not self.state
-
-
-class Destination(Agent):
-    """
-    Destination agent. Where each car should go.
-    """
-
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-
-    def step(self):
-        pass
-
-
-class Obstacle(Agent):
-    """
-    Obstacle agent. Just to add obstacles to the grid.
-    """
-
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-
-    def step(self):
-        pass
-
-
-class Road(Agent):
-    """
-    Road agent. Determines where the cars can move, and in which direction.
-    """
-
-    def __init__(self, unique_id, model, direction="Left"):
-        """
-        Creates a new road.
-        Args:
-            unique_id: The agent's ID
-            model: Model reference for the agent
-            direction: Direction where the cars can move
-        """
-        super().__init__(unique_id, model)
-        self.direction = direction
-
-    def step(self):
-        pass
-
-
@@ -0,0 +1,244 @@
+# 17/10/2026
+# File with the scaling benchmark of the city simulation
+
+from contextlib import redirect_stdout
+import importlib.util
+import io
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from .citymap import CELL_ROAD, DEFAULT_CACHE_DIR, MAP_DIR, load_map, mask_to_directions
+from .agent import Car
+from .mapgen import write_map
+from .model import CityModel
+
+try:
+    import resource
+except ImportError:  # Windows: no se mide la memoria máxima
+    resource = None
+
+GENERATED_DIR = MAP_DIR
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "city-server.py")
+
+# Endpoints medidos: (nombre, método, ruta, encabezados)
+ENDPOINTS = (
+    ("getAgents", "get", "/getAgents", {}),
+    ("getAgents_binary", "get", "/getAgents", {"Accept": "application/octet-stream"}),
+    ("getLights", "get", "/getLights", {}),
+    ("update", "get", "/update", {}),
+    ("step", "get", "/step", {}),
+)
+
+
+def peak_rss_bytes():
+    """Memoria residente máxima del proceso en bytes, o None si no se puede medir."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reporta KiB
+
+
+def percentiles(seconds):
+    """Resumen en milisegundos de una lista de duraciones en segundos."""
+    if len(seconds) == 0:
+        return None
+    ms = 1000 * np.asarray(seconds)
+    return {
+        "mean": round(float(ms.mean()), 4),
+        "p50": round(float(np.percentile(ms, 50)), 4),
+        "p95": round(float(np.percentile(ms, 95)), 4),
+        "p99": round(float(np.percentile(ms, 99)), 4),
+        "max": round(float(ms.max()), 4),
+    }
+
+
+def populate_cars(model, count, rng):
+    """
+    Coloca hasta count coches en celdas de calle libres elegidas al azar, cada uno con un
+    destino al azar y la primera dirección de su celda. Regresa cuántos coches colocó.
+    """
+    roads = np.flatnonzero(np.asarray(model.cell_type).ravel() == CELL_ROAD)
+    rng.shuffle(roads)
+    placed = 0
+    for cell in roads.tolist():
+        if placed >= count:
+            break
+        pos = (cell % model.width, cell // model.width)
+        directions = mask_to_directions(int(model.cell_directions[pos[1], pos[0]]))
+        direction = directions[0] if directions else None
+        destination = int(rng.integers(len(model.destinations)))
+
+        if model.car_engine is not None:
+            if not model.car_engine.is_free(pos):
+                continue
+            model.car_engine.add_car(pos, direction, destination, model.spawned_agents)
+        else:
+            if not model.grid.is_cell_empty(pos):
+                continue
+            car = Car(f"car_{model.spawned_agents}", model)
+            car.direction = direction
+            car.destination = model.destinations[destination]
+            model.grid.place_agent(car, pos)
+            model.schedule.add(car)
+            if model.congestion is not None:
+                model.congestion.enter(pos)
+        model.spawned_agents += 1
+        placed += 1
+    return placed
+
+
+def _load_server():
+    spec = importlib.util.spec_from_file_location("city_server", SERVER_SCRIPT)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    return server
+
+
+def _endpoint_latency(map_path, engine, cars, requests, rng):
+    """Latencia de cada endpoint de ENDPOINTS con el cliente de pruebas de Flask, sin red."""
+    server = _load_server()
+    client = server.app.test_client()
+    # El servidor solo acepta nombres de mapas dentro de MAP_DIR
+    init = {"width": 0, "height": 0, "engine": engine, "map": os.path.basename(map_path)}
+    session_id = client.post("/init", json=init).get_json()["session"]
+    session = server.sessions.get(session_id)
+    with session.lock:
+        populate_cars(session.model, cars, rng)
+
+    endpoints = {}
+    for name, method, route, headers in ENDPOINTS:
+        latencies, errors = [], 0
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = getattr(client, method)(f"{route}?session={session_id}", headers=headers)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+        endpoints[name] = {"latency_ms": percentiles(latencies), "errors": errors, "bytes": len(response.data)}
+    return endpoints
+
+
+def run_case(map_path, engine, cars, steps, requests, seed):
+    """
+    Mide un caso completo. Se corre en un proceso nuevo para que la memoria máxima sea solo suya.
+    """
+    rng = np.random.default_rng(seed)
+    rss_before = peak_rss_bytes()
+
+    start = time.perf_counter()
+    model = CityModel(engine=engine, map_file=map_path, seed=seed)
+    init_seconds = time.perf_counter() - start
+    placed = populate_cars(model, cars, rng)
+
+    step_seconds = []
+    for _ in range(steps):
+        if not model.running:
+            break
+        start = time.perf_counter()
+        model.step()
+        step_seconds.append(time.perf_counter() - start)
+    cars_after = model.get_current_agents()
+
+    endpoints = {}
+    if requests > 0:
+        with redirect_stdout(io.StringIO()):  # El servidor imprime cada /init
+            endpoints = _endpoint_latency(map_path, engine, cars, requests, rng)
+
+    return {
+        "engine": engine,
+        "cars_requested": cars,
+        "cars_placed": placed,
+        "cars_after_steps": cars_after,
+        "init_seconds": round(init_seconds, 4),
+        "steps_run": len(step_seconds),
+        "step_latency_ms": percentiles(step_seconds),
+        "endpoints": endpoints,
+        "rss_before_model_bytes": rss_before,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def run_benchmark(
+    sizes=(30, 100, 300),
+    car_counts=(0, 100, 1000),
+    engines=("agents", "numpy"),
+    steps=100,
+    requests=50,
+    seed=0,
+    progress=None,
+):
+    """
+    Corre todos los casos y regresa el diccionario de resultados.
+    Args:
+        sizes: Lados de los mapas generados (mapas cuadrados)
+        car_counts: Coches colocados al inicio de cada caso
+        engines: Motores a medir
+        steps: Pasos medidos por caso
+        requests: Peticiones por endpoint (0 para no medir el servidor)
+        seed: Semilla del mapa y de los coches
+        progress: Función opcional llamada con el texto de cada caso terminado
+    """
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "steps": steps,
+            "requests": requests,
+            "seed": seed,
+        },
+        "maps": [],
+        "cases": [],
+    }
+    context = multiprocessing.get_context("spawn")
+
+    for size in sizes:
+        map_path = write_map(os.path.join(GENERATED_DIR, f"city_{size}x{size}_seed{seed}.txt"), size, size, seed=seed)
+        start = time.perf_counter()
+        city_map = load_map(map_path, cache_dir=DEFAULT_CACHE_DIR)
+        results["maps"].append({
+            "size": size,
+            "path": map_path,
+            "load_seconds": round(time.perf_counter() - start, 4),  # Incluye la compilación si no estaba en caché
+            "destinations": len(city_map.destinations),
+            "lights": len(city_map.light_cells),
+            "road_cells": int((np.asarray(city_map.cell_type) == CELL_ROAD).sum()),
+            "compiled_bytes": city_map.nbytes(),
+        })
+
+        for engine in engines:
+            for cars in car_counts:
+                with context.Pool(1) as pool:
+                    case = pool.apply(run_case, (map_path, engine, cars, steps, requests, seed))
+                case["size"] = size
+                results["cases"].append(case)
+                if progress is not None:
+                    latency = case["step_latency_ms"] or {}
+                    progress(f"{size}x{size} {engine} {case['cars_placed']} coches: "
+                             f"paso p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms")
+    return results
+
+
+def compare_results(previous, current):
+    """Líneas de texto con el cambio de la latencia de paso (p50, p95) entre dos corridas."""
+    def key(case):
+        return (case["size"], case["engine"], case["cars_requested"])
+
+    before = {key(case): case for case in previous["cases"]}
+    lines = []
+    for case in current["cases"]:
+        old = before.get(key(case))
+        if old is None or not old["step_latency_ms"] or not case["step_latency_ms"]:
+            continue
+        changes = []
+        for stat in ("p50", "p95"):
+            a, b = old["step_latency_ms"][stat], case["step_latency_ms"][stat]
+            changes.append(f"{stat} {a:.3f} -> {b:.3f} ms ({(b - a) / a * 100:+.1f}%)" if a else f"{stat} {b:.3f} ms")
+        size, engine, cars = key(case)
+        lines.append(f"{size}x{size} {engine} {cars} coches: " + ", ".join(changes))
+    return lines
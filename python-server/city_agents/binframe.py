@@ -0,0 +1,49 @@
+# 17/10/2026
+# File with the binary encoding of car frames
+
+import struct
+import numpy as np
+
+MIME_TYPE = "application/octet-stream"
+
+# Encabezado: paso (uint32) y número de coches (uint32)
+HEADER = struct.Struct("<II")
+
+# Código de dirección en el frame cuando el coche no tiene dirección
+NO_DIRECTION_CODE = 255
+
+
+def encode_cars(step, ids, xs, zs, directions):
+    """
+    Empaqueta los coches de un paso.
+    Args:
+        step: Número de paso
+        ids: Número de cada coche ("car_N" -> N)
+        xs, zs: Coordenadas de la celda de cada coche
+        directions: Códigos de dirección (0 Up, 1 Down, 2 Left, 3 Right, negativo sin dirección)
+    Bloques, en orden y sin relleno: int32 ids[n], uint16 x[n], uint16 z[n], uint8 dirección[n].
+    Con el encabezado de 8 bytes cada bloque queda alineado a su tamaño de elemento.
+    """
+    count = len(ids)
+    directions = np.asarray(directions)
+    return b"".join((
+        HEADER.pack(step, count),
+        np.asarray(ids, dtype="<i4").tobytes(),
+        np.asarray(xs, dtype="<u2").tobytes(),
+        np.asarray(zs, dtype="<u2").tobytes(),
+        np.where(directions < 0, NO_DIRECTION_CODE, directions).astype(np.uint8).tobytes(),
+    ))
+
+
+def decode_cars(data):
+    """Inverso de encode_cars: regresa (paso, ids, x, z, direcciones)."""
+    step, count = HEADER.unpack_from(data)
+    offset = HEADER.size
+    ids = np.frombuffer(data, dtype="<i4", count=count, offset=offset)
+    offset += 4 * count
+    xs = np.frombuffer(data, dtype="<u2", count=count, offset=offset)
+    offset += 2 * count
+    zs = np.frombuffer(data, dtype="<u2", count=count, offset=offset)
+    offset += 2 * count
+    directions = np.frombuffer(data, dtype=np.uint8, count=count, offset=offset)
+    return step, ids, xs, zs, directions
@@ -0,0 +1,489 @@
+# 17/10/2026
+# File with the static map representation for the city simulation
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+from .routing import RoutingTables
+
+# Códigos de tipo de celda
+CELL_EMPTY = 0
+CELL_ROAD = 1
+CELL_OBSTACLE = 2
+CELL_DESTINATION = 3
+CELL_TRAFFIC_LIGHT = 4
+
+CELL_TYPE_NAMES = {
+    CELL_EMPTY: None,
+    CELL_ROAD: "Road",
+    CELL_OBSTACLE: "Obstacle",
+    CELL_DESTINATION: "Destination",
+    CELL_TRAFFIC_LIGHT: "Traffic_Light",
+}
+
+# Bits de dirección
+DIRECTION_BITS = {"Up": 1, "Down": 2, "Left": 4, "Right": 8}
+
+# Símbolos del mapa que son calles
+ROAD_SYMBOLS = ["V", "v", "^", ">", "<", "I", "i", "O", "o", "A", "a", "Z", "z"]
+
+
+def directions_to_mask(directions):
+    """Convierte una lista de direcciones en su máscara de bits."""
+    mask = 0
+    for direction in directions:
+        mask |= DIRECTION_BITS.get(direction, 0)
+    return mask
+
+
+def mask_to_directions(mask):
+    """Convierte una máscara de bits en la lista de direcciones que contiene."""
+    return [name for name, bit in DIRECTION_BITS.items() if mask & bit]
+
+
+def new_static_arrays(width, height):
+    """Crea los arreglos vacíos de tipo de celda y de direcciones."""
+    cell_type = np.zeros((height, width), dtype=np.int8)
+    cell_directions = np.zeros((height, width), dtype=np.uint8)
+    return cell_type, cell_directions
+
+
+def build_lane_targets(cell_type, cell_directions):
+    """
+    Candidatos de cambio de carril: para cada celda y dirección (en el orden de
+    DIRECTION_BITS), las celdas vecinas que son calle y permiten esa dirección, en el orden
+    en que las revisa Car.move() (arriba, abajo, derecha, izquierda). Regresa un arreglo
+    int32 [celdas, direcciones, 4] con el índice plano de cada candidato, rellenado con -1.
+    """
+    height, width = cell_type.shape
+    num_cells = width * height
+    targets = np.full((num_cells, len(DIRECTION_BITS), 4), -1, dtype=np.int32)
+    filled = np.zeros((num_cells, len(DIRECTION_BITS)), dtype=np.int32)
+    ys, xs = np.divmod(np.arange(num_cells), width)
+
+    for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+        lx, ly = xs + dx, ys + dy
+        inside = (lx >= 0) & (lx < width) & (ly >= 0) & (ly < height)
+        lx, ly = np.where(inside, lx, 0), np.where(inside, ly, 0)
+        is_road = inside & (cell_type[ly, lx] == CELL_ROAD)
+        for code, bit in enumerate(DIRECTION_BITS.values()):
+            cells = np.flatnonzero(is_road & ((cell_directions[ly, lx] & bit) != 0))
+            targets[cells, code, filled[cells, code]] = ly[cells] * width + lx[cells]
+            filled[cells, code] += 1
+    return targets
+
+
+def cells_of_type(cell_type, code):
+    """Regresa las posiciones (x, y) de todas las celdas de un tipo."""
+    ys, xs = np.nonzero(cell_type == code)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+# ---------------------------------------------------------------------------
+# Compilador de mapas
+# Convierte un mapa de texto y su diccionario en un archivo binario con todos los
+# arreglos que necesita el modelo. El archivo se guarda en caché con el hash del
+# contenido, así que las siguientes inicializaciones solo lo abren con memmap.
+# ---------------------------------------------------------------------------
+
+COMPILER_VERSION = 2
+MAGIC = b"CITYMAP\0"
+ALIGNMENT = 64
+
+DEFAULT_DICTIONARY = "city_files/mapDictionary.json"
+DEFAULT_CACHE_DIR = "city_files/.cache"
+
+# Mapas incluidos en el repositorio
+MAP_FILES = {
+    "2021": "city_files/2021_base.txt",
+    "2022": "city_files/2022_base.txt",
+    "2023": "city_files/2023_base.txt",
+    "2024": "city_files/2024_base.txt",
+}
+DEFAULT_MAP = MAP_FILES["2024"]
+
+# Carpeta de los mapas generados: los clientes remotos solo pueden pedir mapas por su nombre
+# dentro de ella (o el año de un mapa incluido); las rutas libres quedan para la línea de comandos
+MAP_DIR = "city_files/generated"
+
+
+def resolve_map_path(map_name):
+    """
+    Regresa la ruta del archivo de mapa: acepta el año de un mapa incluido
+    ("2021" a "2024") o la ruta de un mapa propio.
+    """
+    path = MAP_FILES.get(str(map_name), map_name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No existe el mapa {map_name}")
+    return path
+
+
+def allowed_map_path(map_name, map_dir=MAP_DIR):
+    """
+    Ruta de un mapa pedido por un cliente remoto: el año de un mapa incluido o el nombre de
+    un archivo .txt dentro de map_dir. Nunca acepta rutas, así que no abre otros archivos.
+    Lanza ValueError si el nombre no está permitido o el mapa no existe.
+    """
+    map_name = str(map_name)
+    if map_name in MAP_FILES:
+        return MAP_FILES[map_name]
+    if (
+        not map_name.endswith(".txt")
+        or map_name.startswith(".")
+        or "/" in map_name
+        or "\\" in map_name
+        or os.path.basename(map_name) != map_name
+    ):
+        raise ValueError(f"Mapa no permitido: {map_name}")
+    path = os.path.join(map_dir, map_name)
+    # Un enlace simbólico dentro de map_dir tampoco puede apuntar fuera de ella
+    if not os.path.isfile(path) or os.path.dirname(os.path.realpath(path)) != os.path.realpath(map_dir):
+        raise ValueError(f"No existe el mapa {map_name}")
+    return path
+
+
+class CompiledMap:
+    """
+    Mapa compilado: arreglos planos indexados por celda (y * ancho + x).
+    """
+
+    # Arreglos que se guardan en el archivo compilado
+    ARRAYS = (
+        "cell_type",  # int8 [alto, ancho]
+        "cell_directions",  # uint8 [alto, ancho]
+        "indptr",  # int32 [celdas + 1], adyacencia CSR
+        "indices",  # int32 [aristas]
+        "graph_nodes",  # int32, celdas que son nodo del grafo en orden del archivo
+        "spawn_points",  # int32, esquinas donde aparecen los coches
+        "destinations",  # int32, celdas destino en orden del archivo
+        "light_cells",  # int32, celdas con semáforo en orden del archivo
+        "light_states",  # bool, estado inicial (True = verde)
+        "light_periods",  # int32, pasos entre cambios
+        "light_groups",  # int32, grupo de semáforos adyacentes (misma intersección)
+        "lane_targets",  # int32 [celdas, direcciones, 4], candidatos de cambio de carril
+        "next_hop",  # int32 [destinos, celdas], tabla de siguiente salto
+        "distance",  # int32 [destinos, celdas], saltos hasta cada destino
+    )
+
+    def __init__(self, width, height, source_hash, arrays):
+        self.width = width
+        self.height = height
+        self.source_hash = source_hash
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def cell_pos(self, index):
+        """Convierte un índice plano en la posición (x, y)."""
+        index = int(index)
+        return (index % self.width, index // self.width)
+
+    def positions(self, indices):
+        """Convierte un arreglo de índices planos en una lista de posiciones (x, y)."""
+        return [(i % self.width, i // self.width) for i in np.asarray(indices).tolist()]
+
+    def graph(self):
+        """Reconstruye la lista de adyacencia {nodo: [vecinos]} a partir del CSR."""
+        width = self.width
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        return {
+            (node % width, node // width): [
+                (n % width, n // width) for n in indices[indptr[node] : indptr[node + 1]]
+            ]
+            for node in self.graph_nodes.tolist()
+        }
+
+    def nbytes(self):
+        """Tamaño total de los arreglos del mapa."""
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+
+def _ray_neighbors(pos, directions, dataDictionary, lines, width, height):
+    """
+    Obtiene las celdas vecinas según las direcciones permitidas.
+    Los semáforos heredan la dirección del nodo previo y se conectan correctamente al siguiente nodo.
+    """
+    x, y = pos
+    neighbors = []
+
+    for direction in directions:
+        current = (x, y)
+        while True:
+            if direction == "Right":
+                next_pos = (current[0] + 1, current[1])
+            elif direction == "Left":
+                next_pos = (current[0] - 1, current[1])
+            elif direction == "Up":
+                next_pos = (current[0], current[1] + 1)
+            elif direction == "Down":
+                next_pos = (current[0], current[1] - 1)
+            else:
+                break
+
+            # Verificar límites del mapa
+            if not (0 <= next_pos[0] < width and 0 <= next_pos[1] < height):
+                break
+
+            neighbor_cell = lines[height - next_pos[1] - 1][next_pos[0]]
+
+            # Si es un obstáculo, detener
+            if neighbor_cell == "#":
+                break
+
+            # Si es un semáforo, agregarlo y detener el loop
+            if neighbor_cell in ["S", "s"]:
+                neighbors.append(next_pos)  # Conectar solo al semáforo
+                break  # No continuar más allá del semáforo
+
+            # Si es un nodo transitable y no es un semáforo, agregarlo como vecino
+            if neighbor_cell in dataDictionary:
+                neighbors.append(next_pos)
+                break
+
+            current = next_pos
+
+    return neighbors
+
+
+def _inherited_directions(pos, lines, width, height):
+    """
+    Obtiene la dirección heredada para una celda de semáforo.
+    """
+    x, y = pos
+    inherited_directions = []
+
+    # Revisar las celdas adyacentes para heredar la dirección
+    for dx, dy, direction in [
+        (-1, 0, "Right"),
+        (1, 0, "Left"),
+        (0, -1, "Up"),
+        (0, 1, "Down"),
+    ]:
+        neighbor = (x + dx, y + dy)
+        if 0 <= neighbor[0] < width and 0 <= neighbor[1] < height:
+            neighbor_cell = lines[height - neighbor[1] - 1][neighbor[0]]
+            if neighbor_cell in ROAD_SYMBOLS and neighbor_cell != "V":
+                inherited_directions.append(direction)
+
+    return inherited_directions
+
+
+def _light_groups(light_positions):
+    """Agrupa los semáforos adyacentes entre sí (los pares S/s de una misma intersección)."""
+    index = {pos: i for i, pos in enumerate(light_positions)}
+    groups = np.full(len(light_positions), -1, dtype=np.int32)
+    group = 0
+    for i, pos in enumerate(light_positions):
+        if groups[i] >= 0:
+            continue
+        groups[i] = group
+        stack = [pos]
+        while stack:
+            x, y = stack.pop()
+            for neighbor in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
+                j = index.get(neighbor)
+                if j is not None and groups[j] < 0:
+                    groups[j] = group
+                    stack.append(neighbor)
+        group += 1
+    return groups
+
+
+def compile_map(map_path, dictionary_path=DEFAULT_DICTIONARY):
+    """
+    Lee un mapa de texto y su diccionario y regresa el CompiledMap correspondiente.
+    """
+    with open(dictionary_path) as dictionaryFile:
+        dataDictionary = json.load(dictionaryFile)
+    with open(map_path) as baseFile:
+        lines = baseFile.readlines()
+
+    width = len(lines[0]) - 1
+    height = len(lines)
+    cell_type, cell_directions = new_static_arrays(width, height)
+
+    graph = {}
+    destinations = []
+    lights = []  # (posición, estado inicial, periodo)
+
+    for r, row in enumerate(lines):
+        for c, col in enumerate(row[:width]):
+            cell_pos = (c, height - r - 1)  # Ajustar posición según Mesa
+            if col not in dataDictionary:
+                continue
+            x, y = cell_pos
+
+            # Direcciones específicas de cada celda
+            directions = (
+                dataDictionary[col]
+                if isinstance(dataDictionary[col], list)
+                else [dataDictionary[col]]
+            )
+            graph[cell_pos] = _ray_neighbors(
+                cell_pos, directions, dataDictionary, lines, width, height
+            )
+
+            if col in ROAD_SYMBOLS:
+                cell_type[y, x] = CELL_ROAD
+                cell_directions[y, x] = directions_to_mask(directions)
+            elif col == "D":
+                cell_type[y, x] = CELL_DESTINATION
+                destinations.append(cell_pos)
+            elif col in ["S", "s"]:
+                cell_type[y, x] = CELL_TRAFFIC_LIGHT
+                cell_directions[y, x] = directions_to_mask(
+                    _inherited_directions(cell_pos, lines, width, height)
+                )
+                lights.append((cell_pos, col == "s", int(dataDictionary[col][0])))
+            elif col == "#":
+                cell_type[y, x] = CELL_OBSTACLE
+
+    def flat(positions):
+        return np.array([y * width + x for x, y in positions], dtype=np.int32)
+
+    # Adyacencia en formato CSR
+    indptr = np.zeros(width * height + 1, dtype=np.int32)
+    for (x, y), neighbors in graph.items():
+        indptr[y * width + x + 1] = len(neighbors)
+    indptr = np.cumsum(indptr, dtype=np.int32)
+    indices = np.zeros(int(indptr[-1]), dtype=np.int32)
+    for (x, y), neighbors in graph.items():
+        start = indptr[y * width + x]
+        indices[start : start + len(neighbors)] = flat(neighbors)
+
+    # Tablas de siguiente salto por destino
+    tables = RoutingTables(graph, destinations, width, height)
+
+    light_positions = [pos for pos, _, _ in lights]
+    arrays = {
+        "cell_type": cell_type,
+        "cell_directions": cell_directions,
+        "indptr": indptr,
+        "indices": indices,
+        "graph_nodes": flat(graph.keys()),
+        "spawn_points": flat(
+            [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)]
+        ),
+        "destinations": flat(destinations),
+        "light_cells": flat(light_positions),
+        "light_states": np.array([state for _, state, _ in lights], dtype=bool),
+        "light_periods": np.array([period for _, _, period in lights], dtype=np.int32),
+        "light_groups": _light_groups(light_positions),
+        "lane_targets": build_lane_targets(cell_type, cell_directions),
+        "next_hop": tables.next_hop,
+        "distance": tables.distance,
+    }
+    return CompiledMap(width, height, source_hash(map_path, dictionary_path), arrays)
+
+
+def source_hash(map_path, dictionary_path=DEFAULT_DICTIONARY):
+    """Hash del contenido del mapa, su diccionario y la versión del compilador."""
+    digest = hashlib.sha256(f"citymap-v{COMPILER_VERSION}".encode())
+    for path in (map_path, dictionary_path):
+        with open(path, "rb") as sourceFile:
+            digest.update(sourceFile.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_compiled(city_map, path):
+    """
+    Escribe el mapa compilado: MAGIC, largo del encabezado (uint64), encabezado JSON
+    y después cada arreglo alineado a 64 bytes.
+    """
+    arrays = {name: np.ascontiguousarray(getattr(city_map, name)) for name in CompiledMap.ARRAYS}
+    header = {
+        "version": COMPILER_VERSION,
+        "width": city_map.width,
+        "height": city_map.height,
+        "source_hash": city_map.source_hash,
+        "arrays": {},
+    }
+    layout = {name: [array.dtype.str, list(array.shape), 0] for name, array in arrays.items()}
+    header["arrays"] = layout
+
+    # Los offsets dependen del tamaño del encabezado y viceversa: se ajusta hasta que quepa
+    header_size = ALIGNMENT
+    while True:
+        offset = header_size
+        for name, array in arrays.items():
+            layout[name][2] = offset
+            offset = _aligned(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        if len(MAGIC) + 8 + len(header_bytes) <= header_size:
+            break
+        header_size = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as outFile:
+        outFile.write(MAGIC)
+        outFile.write(struct.pack("<Q", len(header_bytes)))
+        outFile.write(header_bytes)
+        for name, array in arrays.items():
+            outFile.seek(layout[name][2])
+            outFile.write(array.tobytes())
+        outFile.truncate(offset)
+    # Reemplazo atómico: otros procesos nunca ven un archivo a medio escribir
+    os.replace(temp_path, path)
+
+
+def load_compiled(path):
+    """Abre un mapa compilado; los arreglos quedan mapeados en memoria (solo lectura)."""
+    with open(path, "rb") as inFile:
+        if inFile.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} no es un mapa compilado")
+        (header_length,) = struct.unpack("<Q", inFile.read(8))
+        header = json.loads(inFile.read(header_length))
+    if header["version"] != COMPILER_VERSION:
+        raise ValueError(f"{path} fue compilado con otra versión")
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            # Vista ndarray sobre el memmap: comparte la memoria sin el costo de la subclase
+            arrays[name] = np.asarray(
+                np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=tuple(shape))
+            )
+    return CompiledMap(header["width"], header["height"], header["source_hash"], arrays)
+
+
+def load_map(
+    map_path=DEFAULT_MAP,
+    dictionary_path=DEFAULT_DICTIONARY,
+    cache_dir=DEFAULT_CACHE_DIR,
+    use_cache=True,
+):
+    """
+    Regresa el mapa compilado de map_path (año o ruta del mapa).
+    Si ya existe en el caché un archivo con el mismo hash de contenido, solo se abre;
+    en otro caso se compila y se guarda en el caché.
+    """
+    map_path = resolve_map_path(map_path)
+    if not use_cache:
+        return compile_map(map_path, dictionary_path)
+
+    cache_path = os.path.join(cache_dir, f"{source_hash(map_path, dictionary_path)}.citymap")
+    if os.path.isfile(cache_path):
+        try:
+            return load_compiled(cache_path)
+        except (ValueError, OSError, KeyError):
+            pass  # Archivo dañado o de otra versión: se vuelve a compilar
+
+    city_map = compile_map(map_path, dictionary_path)
+    try:
+        save_compiled(city_map, cache_path)
+    except OSError:
+        return city_map  # Sin permiso de escritura: se usa el mapa en memoria
+    return load_compiled(cache_path)
@@ -0,0 +1,189 @@
+# 17/10/2026
+# File with the contracted routing graph of the city simulation
+
+import heapq
+
+import numpy as np
+
+
+class ContractedGraph:
+    """
+    Grafo de rutas contraído: nodos clave y super-aristas con las celdas que recorren.
+    Las celdas se indexan como y * ancho + x.
+    """
+
+    def __init__(self, graph, width, height, keep=()):
+        """
+        Args:
+            graph: Lista de adyacencia de celdas {nodo: [vecinos]}
+            width, height: Dimensiones del mapa
+            keep: Posiciones que siempre son nodos (destinos, semáforos, esquinas)
+        """
+        self.width = width
+        in_degree = {}
+        for neighbors in graph.values():
+            for neighbor in neighbors:
+                in_degree[neighbor] = in_degree.get(neighbor, 0) + 1
+        # Celdas con alguna arista; los obstáculos también son nodos del grafo de celdas, pero aislados
+        connected = set(in_degree)
+        connected.update(node for node, neighbors in graph.items() if neighbors)
+        self.cell_count = len(connected)
+
+        keys = {node for node in keep if node in connected}
+        keys.update(
+            node for node in connected
+            if len(graph.get(node, ())) != 1 or in_degree.get(node, 0) != 1
+        )
+
+        self.nodes = []  # Posición de cada nodo clave
+        self.node_index = {}  # {posición: nodo}
+        self.out_edges = []  # Super-aristas que salen de cada nodo
+        self.edge_source = []
+        self.edge_target = []
+        self.edge_cells = []  # Celdas de cada super-arista, sin el origen y con el destino al final
+        self.edge_hops = []  # Saltos de la cadena (celdas recorridas)
+        self.edge_length = []  # Suma de las distancias Manhattan de cada salto
+        # Super-arista y posición dentro de ella de cada celda interior (-1 en nodos clave)
+        self.cell_edge = np.full(width * height, -1, dtype=np.int32)
+        self.cell_offset = np.zeros(width * height, dtype=np.int32)
+
+        cell_order = lambda pos: (pos[1], pos[0])
+        for node in sorted(keys, key=cell_order):
+            self._add_node(node)
+        for node in list(self.nodes):
+            for neighbor in graph.get(node, ()):
+                self._add_chain(graph, node, neighbor)
+        # Ciclos sin ningún nodo clave: una celda de cada uno se vuelve nodo
+        for node in sorted(connected - keys, key=cell_order):
+            if node not in self.node_index and self.cell_edge[node[1] * width + node[0]] < 0:
+                self._add_node(node)
+                self._add_chain(graph, node, graph[node][0])
+
+    def _add_node(self, node):
+        self.node_index[node] = len(self.nodes)
+        self.nodes.append(node)
+        self.out_edges.append([])
+
+    def _add_chain(self, graph, source, first):
+        """Sigue la cadena que empieza en source -> first hasta el siguiente nodo clave."""
+        edge = len(self.edge_source)
+        cells = [first]
+        length = abs(first[0] - source[0]) + abs(first[1] - source[1])
+        while cells[-1] not in self.node_index:
+            cell = cells[-1]
+            index = cell[1] * self.width + cell[0]
+            self.cell_edge[index] = edge
+            self.cell_offset[index] = len(cells) - 1
+            following = graph[cell][0]
+            length += abs(following[0] - cell[0]) + abs(following[1] - cell[1])
+            cells.append(following)
+        self.edge_source.append(self.node_index[source])
+        self.edge_target.append(self.node_index[cells[-1]])
+        self.edge_cells.append(tuple(cells))
+        self.edge_hops.append(len(cells))
+        self.edge_length.append(length)
+        self.out_edges[self.node_index[source]].append(edge)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_source)
+
+    def lead_in(self, start):
+        """
+        Celdas forzadas desde start hasta el primer nodo clave (start incluido) y ese nodo.
+        Una celda interior solo puede avanzar por su cadena.
+        """
+        if start in self.node_index:
+            return [start], self.node_index[start]
+        index = start[1] * self.width + start[0]
+        edge = int(self.cell_edge[index])
+        if edge < 0:
+            return [start], None  # Celda fuera del grafo
+        cells = self.edge_cells[edge]
+        return [start, *cells[int(self.cell_offset[index]) + 1:]], self.edge_target[edge]
+
+    def search(self, start, destination, avoid_node=None, weights=None, edge_weights=None, hops=None):
+        """
+        Ruta de celdas de start a destination, o None si no existe o destination no es un nodo.
+        Sin weights, minimiza los saltos, como la BFS del grafo de celdas. Con weights (peso de
+        entrar a cada celda) y edge_weights (suma de los pesos de las celdas interiores de cada
+        super-arista, ver CongestionField), cada super-arista cuesta su largo más sus pesos.
+        hops, la fila de la tabla de distancias del destino, sirve de cota inferior en los dos casos;
+        con weights se usa además la distancia Manhattan.
+        """
+        goal = self.node_index.get(destination)
+        if goal is None:
+            return None
+        prefix, origin = self.lead_in(start)
+        if origin is None or avoid_node in prefix[1:]:
+            return None
+        if origin == goal:
+            return prefix
+
+        avoid_node_index = self.node_index.get(avoid_node)
+        avoid_edge = -1
+        if avoid_node is not None and avoid_node_index is None:
+            avoid_edge = int(self.cell_edge[avoid_node[1] * self.width + avoid_node[0]])
+
+        width = self.width
+        goal_x, goal_y = destination
+        nodes, out_edges, edge_target = self.nodes, self.out_edges, self.edge_target
+        edge_hops, edge_length = self.edge_hops, self.edge_length
+        best = {origin: 0}
+        parents = {origin: None}  # {nodo: super-arista por la que se llegó}
+        closed = set()
+        heap = [(0, 0, 0, origin)]
+        pushed = 1  # Desempate por orden de llegada
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        while heap:
+            _, cost, _, node = heappop(heap)
+            if node in closed:
+                continue
+            if node == goal:
+                edges = []
+                while parents[node] is not None:
+                    edge = parents[node]
+                    edges.append(edge)
+                    node = self.edge_source[edge]
+                path = prefix
+                for edge in reversed(edges):
+                    path.extend(self.edge_cells[edge])
+                return path
+            closed.add(node)
+
+            for edge in out_edges[node]:
+                target = edge_target[edge]
+                if target in closed or target == avoid_node_index or edge == avoid_edge:
+                    continue
+                tx, ty = nodes[target]
+                index = ty * width + tx
+                if weights is None:
+                    new_cost = cost + edge_hops[edge]
+                    estimate = 0
+                else:
+                    new_cost = cost + edge_length[edge] + edge_weights[edge] + weights[index]
+                    estimate = abs(tx - goal_x) + abs(ty - goal_y)
+                if hops is not None:
+                    estimate = max(estimate, int(hops[index]))
+                if new_cost < best.get(target, new_cost + 1):
+                    best[target] = new_cost
+                    parents[target] = edge
+                    heappush(heap, (new_cost + estimate, new_cost, pushed, target))
+                    pushed += 1
+
+        return None
+
+    def nbytes(self):
+        """Memoria aproximada: arreglos por celda más un apuntador por celda guardada en las super-aristas."""
+        cells = sum(self.edge_hops)
+        return self.cell_edge.nbytes + self.cell_offset.nbytes + 8 * (cells + 6 * self.edge_count + 2 * len(self.nodes))
+
+    def info(self):
+        """Tamaño del grafo de celdas y del contraído."""
+        return {
+            "cells": self.cell_count,
+            "nodes": len(self.nodes),
+            "edges": self.edge_count,
+            "contraction": round(self.cell_count / len(self.nodes), 2) if self.nodes else None,
+        }
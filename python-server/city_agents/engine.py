@@ -0,0 +1,444 @@
+# 17/10/2026
+# File with the vectorized car engine for the city simulation
+
+import numpy as np
+from .citymap import CELL_OBSTACLE, DIRECTION_BITS
+from .metrics import LANE_CHANGE_FAILED, LANE_CHANGED
+
+# Códigos de dirección usados en los arreglos
+DIRECTIONS = list(DIRECTION_BITS)  # Mismo orden que la tabla de cambios de carril del mapa
+DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTIONS)}
+NO_DIRECTION = -1
+
+
+class VectorCarEngine:
+    """
+    Motor de coches en arreglos de NumPy.
+    Cada coche ocupa un índice (slot) en los arreglos; la ocupación del mapa es una
+    cuadrícula de enteros con el slot del coche en cada celda, o -1 si está libre.
+    """
+
+    def __init__(self, model, capacity=1024):
+        """
+        Args:
+            model: CityModel que usa el motor
+            capacity: Número inicial de slots, crece al doble cuando se llena
+        """
+        self.model = model
+        self.width = model.width
+        self.height = model.height
+        self.num_cells = self.width * self.height
+        self.rng = np.random.default_rng(model.random.getrandbits(64))
+
+        # Destinos; la tabla de siguiente salto se lee del servicio de ruteo del modelo
+        self.destination_cells = np.array(
+            [self.cell_index(pos) for pos in model.destinations], dtype=np.int32
+        )
+
+        # Semáforos: celdas en rojo según la tabla de fases del modelo, al día hasta red_step pasos
+        self.red = np.zeros(self.num_cells, dtype=bool)
+        self.red_step = None
+        self.red_version = None
+
+        # Celdas laterales a las que se puede cambiar de carril: [celda, dirección, k],
+        # precalculadas en el mapa compilado y compartidas con Car.move()
+        self.lane_targets = model.lane_targets
+
+        # Cuadrícula de ocupación
+        self.occupancy = np.full(self.num_cells, -1, dtype=np.int32)
+
+        # Estado de los coches (estructura de arreglos)
+        self.capacity = 0
+        self.alive = np.zeros(0, dtype=bool)
+        self.car_id = np.zeros(0, dtype=np.int64)
+        self.position = np.zeros(0, dtype=np.int32)
+        self.destination = np.zeros(0, dtype=np.int32)
+        self.direction = np.zeros(0, dtype=np.int8)
+        self.inactive_steps = np.zeros(0, dtype=np.int32)
+        self.steps_waited = np.zeros(0, dtype=np.int32)
+        self.route_index = np.zeros(0, dtype=np.int32)
+        # Registro del viaje: paso en que apareció, celdas avanzadas y rutas alternativas
+        self.spawn_step = np.zeros(0, dtype=np.int64)
+        self.moves = np.zeros(0, dtype=np.int32)
+        self.reroutes = np.zeros(0, dtype=np.int32)
+        self._grow(capacity)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        # Rutas alternativas tras quedar bloqueado: {slot: arreglo de celdas}
+        self.detours = {}
+
+        self.count = 0
+        self.arrived = 0
+
+    def cell_index(self, pos):
+        """Convierte una posición (x, y) en el índice plano de la celda."""
+        return pos[1] * self.width + pos[0]
+
+    def cell_pos(self, index):
+        """Convierte un índice plano en la posición (x, y)."""
+        return (int(index % self.width), int(index // self.width))
+
+    def _grow(self, capacity):
+        """Amplía los arreglos de estado a la nueva capacidad."""
+        extra = capacity - self.capacity
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        self.car_id = np.concatenate([self.car_id, np.zeros(extra, dtype=np.int64)])
+        self.position = np.concatenate(
+            [self.position, np.full(extra, -1, dtype=np.int32)]
+        )
+        self.destination = np.concatenate(
+            [self.destination, np.zeros(extra, dtype=np.int32)]
+        )
+        self.direction = np.concatenate(
+            [self.direction, np.full(extra, NO_DIRECTION, dtype=np.int8)]
+        )
+        self.inactive_steps = np.concatenate(
+            [self.inactive_steps, np.zeros(extra, dtype=np.int32)]
+        )
+        self.steps_waited = np.concatenate(
+            [self.steps_waited, np.zeros(extra, dtype=np.int32)]
+        )
+        self.route_index = np.concatenate(
+            [self.route_index, np.zeros(extra, dtype=np.int32)]
+        )
+        self.spawn_step = np.concatenate([self.spawn_step, np.zeros(extra, dtype=np.int64)])
+        self.moves = np.concatenate([self.moves, np.zeros(extra, dtype=np.int32)])
+        self.reroutes = np.concatenate([self.reroutes, np.zeros(extra, dtype=np.int32)])
+        if self.capacity:
+            self.free_slots = list(range(capacity - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = capacity
+
+    def add_car(self, pos, direction, destination_index, car_id):
+        """Coloca un coche nuevo en la celda pos."""
+        if not self.free_slots:
+            self._grow(self.capacity * 2)
+        slot = self.free_slots.pop()
+        cell = self.cell_index(pos)
+
+        self.alive[slot] = True
+        self.car_id[slot] = car_id
+        self.position[slot] = cell
+        self.destination[slot] = destination_index
+        self.direction[slot] = DIRECTION_CODES.get(direction, NO_DIRECTION)
+        self.inactive_steps[slot] = 0
+        self.steps_waited[slot] = 0
+        self.route_index[slot] = 0
+        self.spawn_step[slot] = self.model.step_count
+        self.moves[slot] = 0
+        self.reroutes[slot] = 0
+        self.occupancy[cell] = slot
+        self.count += 1
+        return slot
+
+    def _remove(self, slots):
+        """Saca del mapa a los coches indicados."""
+        self.occupancy[self.position[slots]] = -1
+        self.alive[slots] = False
+        self.position[slots] = -1
+        for slot in slots.tolist():
+            self.detours.pop(slot, None)
+            self.free_slots.append(slot)
+        self.count -= len(slots)
+
+    def _record_trips(self, slots, step):
+        """Registra los viajes de los coches que llegan en el paso step (igual que Car.move())."""
+        spawn_step = self.spawn_step[slots]
+        arrival_step = np.full(len(slots), step, dtype=np.int64)
+        self.model.metrics_store.record_trips(
+            self.car_id[slots],
+            spawn_step,
+            arrival_step,
+            arrival_step - spawn_step - 1 - self.moves[slots],
+            self.reroutes[slots],
+        )
+
+    def is_free(self, pos):
+        """Indica si no hay ningún coche en la celda pos."""
+        return self.occupancy[self.cell_index(pos)] == -1
+
+    def spawn(self, spawn_positions, spawn_directions):
+        """
+        Genera un coche en cada esquina libre.
+        Regresa True si al menos una esquina permitió generar un coche.
+        """
+        spawned = False
+        for spawn_pos in spawn_positions:
+            if self.model.cell_type[spawn_pos[1], spawn_pos[0]] == CELL_OBSTACLE:
+                continue
+            if not self.is_free(spawn_pos):
+                continue
+            destination_index = (
+                int(self.rng.integers(len(self.destination_cells)))
+                if len(self.destination_cells)
+                else 0
+            )
+            self.add_car(
+                spawn_pos,
+                spawn_directions.get(spawn_pos),
+                destination_index,
+                self.model.spawned_agents,
+            )
+            self.model.spawned_agents += 1
+            spawned = True
+        return spawned
+
+    def _targets(self, slots):
+        """Siguiente celda de cada coche: su ruta alternativa o la tabla de siguiente salto."""
+        if len(self.destination_cells) == 0:
+            return np.full(len(slots), -1, dtype=np.int32)
+        next_hop = self.model.router.tables.next_hop
+        targets = next_hop[self.destination[slots], self.position[slots]]
+        if self.detours:
+            for i, slot in enumerate(slots.tolist()):
+                detour = self.detours.get(slot)
+                if detour is not None:
+                    next_index = self.route_index[slot] + 1
+                    targets[i] = detour[next_index] if next_index < len(detour) else -1
+        return targets
+
+    def _contest(self, slots, cells, rank):
+        """
+        Resuelve conflictos cuando varios coches quieren la misma celda:
+        gana el de menor rango (el que se activaría primero en orden aleatorio).
+        Regresa la máscara de ganadores.
+        """
+        order = np.lexsort((rank, cells))
+        _, first = np.unique(cells[order], return_index=True)
+        winners = np.zeros(len(slots), dtype=bool)
+        winners[order[first]] = True
+        return winners
+
+    def _move(self, slots, cells):
+        """Mueve los coches a sus nuevas celdas y actualiza la dirección."""
+        old = self.position[slots]
+        self.occupancy[old] = -1
+        self.occupancy[cells] = slots
+        self.position[slots] = cells
+        self.moves[slots] += 1
+
+        dx = cells % self.width - old % self.width
+        dy = cells // self.width - old // self.width
+        direction = self.direction[slots]
+        direction = np.where(dx > 0, DIRECTION_CODES["Right"], direction)
+        direction = np.where(dx < 0, DIRECTION_CODES["Left"], direction)
+        direction = np.where((dx == 0) & (dy > 0), DIRECTION_CODES["Up"], direction)
+        direction = np.where((dx == 0) & (dy < 0), DIRECTION_CODES["Down"], direction)
+        self.direction[slots] = direction
+
+    def step(self):
+        """
+        Resuelve un paso completo de todos los coches.
+        El orden aleatorio de RandomActivation se emula con un rango aleatorio por coche:
+        un coche solo puede entrar a una celda que se liberó este paso si el coche que la
+        desocupó tiene un rango menor (se movió antes).
+        """
+        # Semáforos del paso en curso: solo se invierten los que cambiaron desde el paso anterior
+        lights = self.model.lights
+        step = self.model.step_count + 1
+        if self.red_version != lights.version or self.red_step not in (step - 1, step):
+            self.red[:] = False
+            self.red[lights.cells] = ~lights.states(step)
+        elif self.red_step == step - 1:
+            self.red[lights.cells[lights.changed(step)]] ^= True
+        self.red_step = step
+        self.red_version = lights.version
+
+        slots = np.flatnonzero(self.alive)
+        if len(slots) == 0:
+            return
+
+        # Coches que llegaron a su destino
+        arrived = self.position[slots] == self.destination_cells[self.destination[slots]]
+        if arrived.any():
+            self._record_trips(slots[arrived], step)
+            self._remove(slots[arrived])
+            self.arrived += int(arrived.sum())
+            self.model.agents_reached_destination += int(arrived.sum())
+            slots = slots[~arrived]
+            if len(slots) == 0:
+                return
+
+        rank = self.rng.permutation(len(slots))
+        targets = self._targets(slots)
+        has_route = targets >= 0
+        safe_targets = np.where(has_route, targets, 0)
+
+        # Los semáforos en rojo detienen al coche sin contar como bloqueo
+        stopped = has_route & self.red[safe_targets] & (self.occupancy[safe_targets] == -1)
+        pending = has_route & ~stopped
+        moved = np.zeros(len(slots), dtype=bool)
+        blocked = np.zeros(len(slots), dtype=bool)
+
+        # Rango del coche que desocupó cada celda en este paso (-1 si estaba libre desde el inicio)
+        vacated_by = np.full(self.num_cells, -1, dtype=np.int64)
+        initially_free = self.occupancy == -1
+
+        while pending.any():
+            candidates = np.flatnonzero(pending)
+            cells = targets[candidates]
+            free_now = self.occupancy[cells] == -1
+            reachable = free_now & (
+                initially_free[cells] | (vacated_by[cells] < rank[candidates])
+            )
+            # Celda liberada antes de su turno pero con el semáforo en rojo: se detiene
+            red_light = reachable & self.red[cells]
+            stopped[candidates[red_light]] = True
+            pending[candidates[red_light]] = False
+            eligible = reachable & ~red_light
+
+            # Si la celda sigue ocupada por un coche que aún no se mueve, se espera otra ronda
+            occupant_pending = np.zeros(len(candidates), dtype=bool)
+            if (~free_now).any():
+                occupant = np.searchsorted(slots, self.occupancy[cells[~free_now]])
+                occupant_pending[~free_now] = pending[occupant]
+
+            if not eligible.any():
+                # Nadie más puede avanzar: los pendientes quedan bloqueados
+                still_pending = candidates[pending[candidates]]
+                blocked[still_pending] = True
+                pending[:] = False
+                break
+
+            chosen = candidates[eligible]
+            winners = self._contest(chosen, targets[chosen], rank[chosen])
+            movers = chosen[winners]
+            losers = chosen[~winners]
+
+            vacated_by[self.position[slots[movers]]] = rank[movers]
+            self._move(slots[movers], targets[movers])
+            moved[movers] = True
+            pending[movers] = False
+
+            # Los perdedores encuentran la celda ya ocupada por el ganador
+            blocked[losers] = True
+            pending[losers] = False
+
+            # Celda liberada por un coche de rango mayor, u ocupada por un coche que no se mueve
+            late = candidates[free_now & ~reachable]
+            stuck = candidates[~free_now & ~occupant_pending]
+            blocked[late] = True
+            blocked[stuck] = True
+            pending[late] = False
+            pending[stuck] = False
+
+        # Coches que avanzaron
+        moved_slots = slots[moved]
+        self.inactive_steps[moved_slots] = 0
+        if self.detours:
+            for slot in moved_slots.tolist():
+                if slot in self.detours:
+                    self.route_index[slot] += 1
+        self.inactive_steps[slots[stopped]] = 0
+        self.steps_waited[slots[stopped]] += 1
+
+        # Coches bloqueados por otro coche: intentan cambiar de carril
+        blocked_local = np.flatnonzero(blocked)
+        if len(blocked_local):
+            self._resolve_blocked(slots, blocked_local, targets, rank)
+
+    def _resolve_blocked(self, slots, blocked_local, targets, rank):
+        """Cambio de carril y reruteo de los coches bloqueados, igual que Car.move()."""
+        blocked_slots = slots[blocked_local]
+        self.inactive_steps[blocked_slots] += 8
+        self.steps_waited[blocked_slots] += 1
+
+        remaining = blocked_local
+        changed = np.zeros(len(slots), dtype=bool)
+        for k in range(self.lane_targets.shape[2]):
+            if len(remaining) == 0:
+                break
+            directions = self.direction[slots[remaining]]
+            valid_direction = directions >= 0
+            lateral = np.full(len(remaining), -1, dtype=np.int32)
+            lateral[valid_direction] = self.lane_targets[
+                targets[remaining[valid_direction]], directions[valid_direction], k
+            ]
+            free = lateral >= 0
+            free[free] = self.occupancy[lateral[free]] == -1
+            if not free.any():
+                continue
+            chosen = remaining[free]
+            winners = self._contest(chosen, lateral[free], rank[chosen])
+            movers = chosen[winners]
+            # El cambio de carril no modifica la dirección del coche
+            mover_slots = slots[movers]
+            cells = lateral[free][winners]
+            self.occupancy[self.position[mover_slots]] = -1
+            self.occupancy[cells] = mover_slots
+            self.position[mover_slots] = cells
+            self.moves[mover_slots] += 1
+            for slot in mover_slots.tolist():
+                self.detours.pop(slot, None)
+            changed[movers] = True
+            remaining = remaining[~changed[remaining]]
+
+        changed_count = int(changed.sum())
+        if changed_count:
+            LANE_CHANGED.inc(changed_count)
+        if len(remaining):
+            LANE_CHANGE_FAILED.inc(len(remaining))
+
+        # Tras acumular 10 pasos inactivos se recalcula la ruta evitando el nodo bloqueado
+        rerouted = remaining[self.inactive_steps[slots[remaining]] >= 10]
+        router = self.model.router
+        for local in rerouted.tolist():
+            slot = int(slots[local])
+            path = router.shortest_path(
+                self.cell_pos(self.position[slot]),
+                self.model.destinations[self.destination[slot]],
+                self.cell_pos(targets[local]),
+            )
+            if path:
+                self.detours[slot] = np.array(
+                    [self.cell_index(pos) for pos in path], dtype=np.int32
+                )
+                self.route_index[slot] = 0
+            else:
+                self.detours.pop(slot, None)
+            self.inactive_steps[slot] = 0
+            self.reroutes[slot] += 1
+
+    def nbytes(self):
+        """Memoria de los arreglos del motor en bytes."""
+        arrays = [
+            self.occupancy,
+            self.red,
+            self.alive,
+            self.car_id,
+            self.position,
+            self.destination,
+            self.direction,
+            self.inactive_steps,
+            self.steps_waited,
+            self.route_index,
+            self.spawn_step,
+            self.moves,
+            self.reroutes,
+        ]
+        return sum(array.nbytes for array in arrays) + sum(
+            detour.nbytes for detour in self.detours.values()
+        )
+
+    def car_arrays(self):
+        """Regresa (ids, x, y, códigos de dirección) de los coches en el mapa como arreglos."""
+        slots = np.flatnonzero(self.alive)
+        positions = self.position[slots]
+        return (
+            self.car_id[slots],
+            positions % self.width,
+            positions // self.width,
+            self.direction[slots],
+        )
+
+    def car_states(self):
+        """Regresa (id, (x, y), dirección) de cada coche en el mapa."""
+        slots = np.flatnonzero(self.alive)
+        positions = self.position[slots]
+        xs = (positions % self.width).tolist()
+        ys = (positions // self.width).tolist()
+        ids = self.car_id[slots].tolist()
+        directions = self.direction[slots].tolist()
+        return [
+            (f"car_{car_id}", (x, y), DIRECTIONS[d] if d >= 0 else None)
+            for car_id, x, y, d in zip(ids, xs, ys, directions)
+        ]
@@ -0,0 +1,100 @@
+# 17/10/2026
+# File with the frame history for the city simulation server
+
+from collections import OrderedDict
+
+
+class FrameHistory:
+    """
+    Últimos frames enviados a los clientes, para calcular deltas.
+    """
+
+    def __init__(self, model, max_frames=64):
+        """
+        Args:
+            model: CityModel del que se toman los frames
+            max_frames: Número de frames que se guardan; un ack más viejo recibe el estado completo
+        """
+        self.model = model
+        self.max_frames = max_frames
+        self.frames = OrderedDict()  # {paso: (coches, semáforos)}
+
+    def snapshot(self):
+        """Estado actual: {id: (x, z, dirección)} de los coches y {id: estado} de los semáforos."""
+        return snapshot(self.model)
+
+    def record(self):
+        """Guarda el frame del paso actual y regresa (paso, coches, semáforos)."""
+        step = self.model.step_count
+        if step not in self.frames:
+            self.frames[step] = self.snapshot()
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+        self.frames.move_to_end(step)
+        cars, lights = self.frames[step]
+        return step, cars, lights
+
+    def frame(self, ack=None, full=False):
+        """
+        Frame del paso actual relativo al paso ack que el cliente ya tiene.
+        Si full es True o el paso ack ya no está guardado, el frame trae el estado completo.
+        """
+        step, cars, lights = self.record()
+        base = None if full or ack is None else self.frames.get(ack)
+        return build_frame(step, cars, lights, base)
+
+
+def snapshot(model):
+    """Estado de un modelo: {id: (x, z, dirección)} de los coches y {id: estado} de los semáforos."""
+    cars = {
+        str(car_id): (pos[0], pos[1], direction)
+        for car_id, pos, direction in model.get_car_states()
+    }
+    lights = {light_id: state for light_id, _, state in model.get_lights()}
+    return cars, lights
+
+
+def build_frame(step, cars, lights, base=None):
+    """
+    Frame del paso step relativo al estado base (coches, semáforos) que ya tiene el cliente.
+    Si base es None, el frame trae el estado completo.
+    """
+    if base is None:
+        return {
+            "step": step,
+            "full": True,
+            "spawned": [car_json(car_id, car) for car_id, car in cars.items()],
+            "moved": [],
+            "despawned": [],
+            "lights": [
+                {"id": light_id, "state": state} for light_id, state in lights.items()
+            ],
+        }
+
+    base_cars, base_lights = base
+    return {
+        "step": step,
+        "full": False,
+        "spawned": [
+            car_json(car_id, car)
+            for car_id, car in cars.items()
+            if car_id not in base_cars
+        ],
+        "moved": [
+            car_json(car_id, car)
+            for car_id, car in cars.items()
+            if car_id in base_cars and base_cars[car_id] != car
+        ],
+        "despawned": [car_id for car_id in base_cars if car_id not in cars],
+        "lights": [
+            {"id": light_id, "state": state}
+            for light_id, state in lights.items()
+            if base_lights.get(light_id) != state
+        ],
+    }
+
+
+def car_json(car_id, car):
+    """Coche en el mismo formato que /getAgents."""
+    x, z, direction = car
+    return {"id": car_id, "x": x, "y": 1.05, "z": z, "direction": direction}
@@ -0,0 +1,135 @@
+# 17/10/2026
+# File with the headless runner of the city simulation
+
+import time
+import numpy as np
+
+from .citymap import DEFAULT_MAP
+from .model import CityModel
+from .snapshot import load_snapshot, save_snapshot
+
+
+def run_simulation(
+    map_file=DEFAULT_MAP,
+    steps=1000,
+    seed=None,
+    spawn_interval=10,
+    light_period=None,
+    engine="agents",
+    activation="random",
+    routing="shortest",
+    use_map_cache=True,
+    tracer=None,
+    profile_steps=0,
+    restore_from=None,
+    snapshot_path=None,
+    record_path=None,
+    metrics_steps_path=None,
+    metrics_trips_path=None,
+):
+    """
+    Corre una simulación sin interfaz y regresa un diccionario con el resumen.
+    Args:
+        map_file: Año de un mapa incluido ("2021" a "2024") o ruta de un mapa propio
+        steps: Número máximo de pasos; la simulación termina antes si el modelo se detiene
+        seed: Semilla del modelo; con la misma semilla el resultado es el mismo
+        spawn_interval: Pasos entre cada generación de coches
+        light_period: Pasos entre cambios de los semáforos (None usa los del mapa)
+        engine: "agents" o "numpy"
+        activation: "random" o "event" (ver CityModel)
+        routing: "shortest" o "congestion" (ver CityModel)
+        use_map_cache: Si es False, el mapa se compila sin usar el caché
+        tracer: Tracer para los eventos de la simulación; por defecto no se registra nada
+        profile_steps: Si es mayor que 0, se capturan con cProfile los primeros profile_steps pasos
+        restore_from: Archivo de snapshot desde el que se continúa; map_file, engine, activation y
+            routing salen del snapshot, y seed, spawn_interval y light_period solo lo cambian si no son None
+        snapshot_path: Si se indica, el snapshot del modelo al terminar se guarda en este archivo
+        record_path: Si se indica, cada paso se graba en este log de repetición
+        metrics_steps_path, metrics_trips_path: Si se indican, los agregados por paso y los
+            registros por viaje se exportan por bloques a estos archivos (CSV, o Parquet con pyarrow)
+    """
+    start = time.perf_counter()
+    if restore_from is not None:
+        model = load_snapshot(
+            restore_from,
+            tracer=tracer,
+            seed=seed,
+            spawn_interval=spawn_interval,
+            light_period=light_period,
+        )
+    else:
+        model = CityModel(
+            engine=engine,
+            map_file=map_file,
+            use_map_cache=use_map_cache,
+            seed=seed,
+            spawn_interval=10 if spawn_interval is None else spawn_interval,
+            light_period=light_period,
+            activation=activation,
+            routing=routing,
+            tracer=tracer,
+        )
+    start_step = model.step_count
+    if record_path is not None:
+        model.start_recording(record_path)
+    if metrics_steps_path is not None or metrics_trips_path is not None:
+        model.export_metrics(metrics_steps_path, metrics_trips_path)
+    init_seconds = time.perf_counter() - start
+    if profile_steps > 0:
+        model.start_profile(profile_steps)
+
+    step_seconds = np.zeros(steps)
+    steps_run = 0
+    start = time.perf_counter()
+    while steps_run < steps and model.running:
+        step_start = time.perf_counter()
+        model.step()
+        step_seconds[steps_run] = time.perf_counter() - step_start
+        steps_run += 1
+    run_seconds = time.perf_counter() - start
+    model.tracer.close()
+    model.stop_recording()
+    model.close_metrics()
+    if snapshot_path is not None:
+        save_snapshot(model, snapshot_path)
+    step_ms = 1000 * step_seconds[:steps_run]
+
+    summary = {
+        "parameters": {
+            "map": str(model.map_file),
+            "steps": steps,
+            "seed": seed,
+            "spawn_interval": model.spawn_interval,
+            "light_period": light_period,
+            "engine": model.engine,
+            "activation": model.activation,
+            "routing": model.routing,
+            "restored_from": restore_from,
+            "start_step": start_step,
+        },
+        "result": {
+            "steps_run": steps_run,
+            "stopped_early": not model.running,
+            "spawned": model.spawned_agents,
+            "arrived": model.get_agents_reached_destination(),
+            "current": model.get_current_agents(),
+        },
+        "trips": model.metrics_store.summary(),
+        "timing": {
+            "init_seconds": round(init_seconds, 4),
+            "run_seconds": round(run_seconds, 4),
+            "steps_per_second": round(steps_run / run_seconds, 1) if run_seconds > 0 else None,
+            "step_ms": {
+                "mean": round(float(step_ms.mean()), 4) if steps_run else None,
+                "p50": round(float(np.percentile(step_ms, 50)), 4) if steps_run else None,
+                "p95": round(float(np.percentile(step_ms, 95)), 4) if steps_run else None,
+                "max": round(float(step_ms.max()), 4) if steps_run else None,
+            },
+        },
+        "routing": model.router.cache_info(),
+        "routing_graph": model.router.graph_info(),
+        "memory": model.memory_usage(),
+    }
+    if profile_steps > 0:
+        summary["profile"] = model.profile_report or (model.profiler and model.profiler.report())
+    return summary
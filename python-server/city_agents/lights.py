@@ -0,0 +1,156 @@
+# 17/10/2026
+# File with the traffic light phase table of the city simulation
+
+import numpy as np
+
+
+class LightTable:
+    """
+    Tabla de fases: grupo, estado inicial y posición de cada semáforo; periodo y desfase de cada grupo.
+    El estado "después de n pasos" es el que ven los clientes al terminar el paso n, y el que
+    ven los coches mientras se calcula ese paso.
+    """
+
+    def __init__(self, cells, width, height, initial, periods, groups, ids):
+        """
+        Args:
+            cells: Celda (y * ancho + x) de cada semáforo
+            width, height: Tamaño del mapa
+            initial: Estado inicial de cada semáforo (True = verde)
+            periods: Pasos entre cambios de cada semáforo; un grupo usa el menor de los suyos
+            groups: Grupo de cada semáforo (semáforos coordinados)
+            ids: Identificador de cada semáforo
+        """
+        self.width = width
+        self.cells = np.asarray(cells, dtype=np.int32)
+        self.positions = [(cell % width, cell // width) for cell in self.cells.tolist()]
+        self.ids = list(ids)
+        self.initial = np.asarray(initial, dtype=bool).copy()
+        self.group = np.asarray(groups, dtype=np.int32)
+
+        group_count = int(self.group.max()) + 1 if len(self.group) else 0
+        self.period = np.full(group_count, np.iinfo(np.int32).max, dtype=np.int64)
+        np.minimum.at(self.period, self.group, np.asarray(periods, dtype=np.int64))
+        self.offset = np.zeros(group_count, dtype=np.int64)
+        self.version = 0  # Cambia con cada set_phase o green_wave, para invalidar estados guardados
+
+        # Semáforo de cada celda (-1 sin semáforo) y semáforos de cada grupo en formato CSR
+        self.light_at = np.full(width * height, -1, dtype=np.int32)
+        self.light_at[self.cells] = np.arange(len(self.cells), dtype=np.int32)
+        self.group_order = np.argsort(self.group, kind="stable").astype(np.int32)
+        self.group_start = np.searchsorted(self.group[self.group_order], np.arange(group_count + 1))
+
+    @classmethod
+    def from_map(cls, city_map, ids, light_period=None):
+        """Tabla de un mapa compilado; light_period reemplaza los periodos del mapa."""
+        periods = city_map.light_periods
+        if light_period is not None:
+            periods = np.full(len(periods), light_period, dtype=np.int32)
+        return cls(
+            city_map.light_cells,
+            city_map.width,
+            city_map.height,
+            city_map.light_states,
+            periods,
+            city_map.light_groups,
+            ids,
+        )
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def group_count(self):
+        return len(self.period)
+
+    def _toggles(self, step, lights=None):
+        """Cambios de estado en los primeros step pasos (pasos k = 0 .. step - 1)."""
+        groups = self.group if lights is None else self.group[lights]
+        period = self.period[groups]
+        offset = self.offset[groups]
+        return (step - 1 - offset) // period - (-1 - offset) // period
+
+    def states(self, step):
+        """Estado de todos los semáforos después de step pasos."""
+        return self.initial ^ (self._toggles(step) & 1).astype(bool)
+
+    def is_green(self, pos, step):
+        """Indica si se puede entrar a la celda pos después de step pasos (True si no tiene semáforo)."""
+        light = self.light_at[pos[1] * self.width + pos[0]]
+        if light < 0:
+            return True
+        group = self.group[light]
+        period = self.period[group]
+        offset = self.offset[group]
+        toggles = (step - 1 - offset) // period - (-1 - offset) // period
+        return bool(self.initial[light] ^ (toggles & 1))
+
+    def changed(self, step):
+        """Semáforos que cambiaron de estado en el paso step (de step - 1 a step pasos)."""
+        if step <= 0 or self.group_count == 0:
+            return np.zeros(0, dtype=np.int32)
+        groups = np.flatnonzero((step - 1 - self.offset) % self.period == 0)
+        if len(groups) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([
+            self.group_order[self.group_start[group]:self.group_start[group + 1]] for group in groups.tolist()
+        ])
+
+    def changed_since(self, since, step):
+        """Semáforos cuyo estado después de step pasos es distinto del que tenían después de since."""
+        if step == since + 1:
+            return self.changed(step)
+        return np.flatnonzero(self.states(since) != self.states(step))
+
+    def set_phase(self, step, groups=None, period=None, offset=None):
+        """
+        Cambia el periodo o el desfase de unos grupos (todos si groups es None) a partir del
+        paso step. Los semáforos conservan el estado que tenían después de step pasos.
+        """
+        current = self.states(step)
+        groups = slice(None) if groups is None else np.asarray(groups, dtype=np.int64)
+        if period is not None:
+            if period <= 0:
+                raise ValueError("El periodo debe ser positivo")
+            self.period[groups] = period
+        if offset is not None:
+            self.offset[groups] = offset
+        self.initial ^= self.states(step) != current
+        self.version += 1
+
+    def green_wave(self, step, groups, delay, period=None):
+        """
+        Coordina los grupos en orden (por ejemplo, a lo largo de una avenida): cada grupo
+        cambia delay pasos después del anterior, con el periodo indicado o el del primer grupo.
+        """
+        groups = np.asarray(groups, dtype=np.int64)
+        if len(groups) == 0:
+            return
+        period = int(self.period[groups[0]]) if period is None else period
+        base = int(self.offset[groups[0]])
+        current = self.states(step)
+        self.period[groups] = period
+        self.offset[groups] = base + delay * np.arange(len(groups))
+        self.initial ^= self.states(step) != current
+        self.version += 1
+
+    def group_info(self):
+        """Lista de grupos con su periodo, desfase y semáforos."""
+        return [
+            {
+                "group": group,
+                "period": int(self.period[group]),
+                "offset": int(self.offset[group]),
+                "lights": [
+                    self.ids[light]
+                    for light in self.group_order[self.group_start[group]:self.group_start[group + 1]].tolist()
+                ],
+            }
+            for group in range(self.group_count)
+        ]
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self.cells, self.initial, self.group, self.period, self.offset, self.light_at,
+            self.group_order, self.group_start,
+        ))
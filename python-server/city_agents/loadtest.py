@@ -0,0 +1,295 @@
+# 17/10/2026
+# File with the HTTP load generator for city-server.py
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .bench import percentiles
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_URL = "http://localhost:8585"
+UPDATE_INTERVAL = 0.25  # El mismo valor que en city_agents.js
+BINARY = {"Accept": "application/octet-stream"}
+
+# Peticiones de cada visor al iniciar, en el orden de main() en city_agents.js
+STARTUP = (
+    ("getAgents", "/getAgents", BINARY),
+    ("getObstacles", "/getObstacles", {}),
+    ("getDestinations", "/getDestinations", {}),
+    ("getRoads", "/getRoads", {}),
+    ("getLights", "/getLights", {}),
+)
+
+# Ciclo de actualización de cada patrón:
+#   poll: avanzar con /update y pedir coches y semáforos, como el frontend original
+#   step: un solo /step con el último paso recibido, como el frontend con USE_STREAM = false
+PATTERNS = ("poll", "step")
+POLL_CYCLE = (
+    ("update", "/update", {}),
+    ("getAgents", "/getAgents", BINARY),
+    ("getLights", "/getLights", {}),
+)
+
+
+def start_server(port=8585, max_sessions=None, timeout=60.0):
+    """
+    Inicia city-server.py en un proceso aparte y espera a que acepte conexiones.
+    Regresa el proceso; se detiene con stop_server.
+    """
+    env = dict(os.environ, CITY_PORT=str(port))
+    if max_sessions is not None:
+        env["CITY_MAX_SESSIONS"] = str(max_sessions)
+    server = subprocess.Popen(
+        [sys.executable, "city-server.py"],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"city-server.py terminó con código {server.returncode}")
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"city-server.py no respondió en el puerto {port} en {timeout} s")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+class _Recorder:
+    """Latencias y códigos de estado por endpoint, compartidos por los hilos de un proceso."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = Counter()
+        self.ticks = 0
+        self.late_ticks = 0
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, status):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.statuses.setdefault(name, Counter())[str(status)] += 1
+            if status is None or status >= 400:
+                self.errors[name] += 1
+
+    def result(self):
+        return {
+            "latencies": self.latencies,
+            "statuses": {name: dict(counts) for name, counts in self.statuses.items()},
+            "errors": dict(self.errors),
+            "ticks": self.ticks,
+            "late_ticks": self.late_ticks,
+        }
+
+
+def _request(host, port, recorder, name, method, path, headers=None, body=None, timeout=30.0):
+    """Hace una petición, registra su latencia y regresa (estado, cuerpo); el estado es None si falló."""
+    start = time.perf_counter()
+    status, data = None, b""
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        pass  # Conexión rechazada, cortada o sin respuesta a tiempo: cuenta como error
+    finally:
+        connection.close()
+    recorder.record(name, time.perf_counter() - start, status)
+    return status, data
+
+
+def _viewer(host, port, recorder, pattern, init_body, start_at, stop_at, interval):
+    """Un visor: inicia su sesión, pide las capas estáticas y actualiza cada interval segundos."""
+    time.sleep(max(0.0, start_at - time.monotonic()))
+    status, data = _request(host, port, recorder, "init", "POST", "/init", body=init_body)
+    if status != 200:
+        return
+    session = json.loads(data)["session"]
+    for name, route, headers in STARTUP:
+        _request(host, port, recorder, name, "GET", f"{route}?session={session}", headers)
+
+    last_step = None
+    next_tick = time.monotonic()
+    while next_tick < stop_at:
+        cycle_start = time.perf_counter()
+        if pattern == "poll":
+            for name, route, headers in POLL_CYCLE:
+                _request(host, port, recorder, name, "GET", f"{route}?session={session}", headers)
+        else:
+            ack = f"&ack={last_step}" if last_step is not None else ""
+            status, data = _request(host, port, recorder, "step", "GET", f"/step?session={session}{ack}")
+            if status == 200:
+                last_step = json.loads(data)["step"]
+        cycle = time.perf_counter() - cycle_start
+
+        # Un ciclo más largo que el intervalo atrasa al visor: el siguiente empieza de inmediato
+        with recorder.lock:
+            recorder.latencies.setdefault("cycle", []).append(cycle)
+            recorder.ticks += 1
+            next_tick += interval
+            now = time.monotonic()
+            if next_tick < now:
+                recorder.late_ticks += 1
+                next_tick = now
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    _request(host, port, recorder, "close", "POST", f"/close?session={session}")
+
+
+def _run_viewers(url, viewers, first_viewer, total_viewers, pattern, init_body, start_at, ramp_up, stop_at, interval):
+    """Corre en un proceso los visores [first_viewer, first_viewer + viewers) como hilos."""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    recorder = _Recorder()
+    # Los relojes monotónicos de los procesos no se comparan: se convierten desde time.time()
+    offset = time.monotonic() - time.time()
+    threads = [
+        threading.Thread(
+            target=_viewer,
+            args=(
+                host, port, recorder, pattern, init_body,
+                start_at + offset + ramp_up * index / total_viewers,
+                stop_at + offset,
+                interval,
+            ),
+            daemon=True,
+        )
+        for index in range(first_viewer, first_viewer + viewers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.result()
+
+
+def _merge(results):
+    merged = {"latencies": {}, "statuses": {}, "errors": Counter(), "ticks": 0, "late_ticks": 0}
+    for result in results:
+        for name, values in result["latencies"].items():
+            merged["latencies"].setdefault(name, []).extend(values)
+        for name, counts in result["statuses"].items():
+            merged["statuses"].setdefault(name, Counter()).update(counts)
+        merged["errors"].update(result["errors"])
+        merged["ticks"] += result["ticks"]
+        merged["late_ticks"] += result["late_ticks"]
+    return merged
+
+
+def run_stage(
+    url=DEFAULT_URL,
+    clients=1,
+    duration=30.0,
+    ramp_up=5.0,
+    interval=UPDATE_INTERVAL,
+    pattern="poll",
+    map_file="2024",
+    engine="agents",
+    processes=1,
+):
+    """
+    Corre clients visores contra el servidor en url y regresa el reporte de la etapa.
+    Args:
+        url: Dirección del servidor
+        clients: Número de visores simultáneos
+        duration: Segundos de carga completa, después de la rampa
+        ramp_up: Segundos en los que van entrando los visores
+        interval: Segundos entre ciclos de actualización de cada visor
+        pattern: "poll" (/update, /getAgents, /getLights) o "step" (/step?ack=)
+        map_file: Mapa de las sesiones
+        engine: Motor de las sesiones
+        processes: Procesos en los que se reparten los visores
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Patrón desconocido: {pattern}")
+    init_body = {"NAgents": 1, "width": 0, "height": 0, "map": map_file, "engine": engine}
+    processes = max(1, min(processes, clients))
+    start_at = time.time() + 0.5  # Margen para que arranquen los procesos
+    stop_at = start_at + ramp_up + duration
+
+    shares = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    firsts = [sum(shares[:i]) for i in range(processes)]
+    arguments = [
+        (url, share, first, clients, pattern, init_body, start_at, ramp_up, stop_at, interval)
+        for share, first in zip(shares, firsts)
+    ]
+    if processes == 1:
+        results = [_run_viewers(*arguments[0])]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_run_viewers, *zip(*arguments)))
+    wall_seconds = time.time() - start_at
+    merged = _merge(results)
+
+    endpoints = {}
+    for name, latencies in merged["latencies"].items():
+        requests = len(latencies)
+        errors = merged["errors"].get(name, 0)
+        endpoints[name] = {
+            "requests": requests,
+            "throughput_rps": round(requests / wall_seconds, 2),
+            "errors": errors,
+            "error_rate": round(errors / requests, 4) if requests else 0.0,
+            "statuses": dict(merged["statuses"].get(name, {})),
+            "latency_ms": percentiles(latencies),
+        }
+    cycle = endpoints.pop("cycle", None)
+    requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "clients": clients,
+        "pattern": pattern,
+        "duration": duration,
+        "ramp_up": ramp_up,
+        "interval": interval,
+        "wall_seconds": round(wall_seconds, 3),
+        "requests": requests,
+        "throughput_rps": round(requests / wall_seconds, 2),
+        "error_rate": round(sum(e["errors"] for e in endpoints.values()) / requests, 4) if requests else 0.0,
+        "cycle_latency_ms": cycle["latency_ms"] if cycle else None,
+        "late_cycle_fraction": round(merged["late_ticks"] / merged["ticks"], 4) if merged["ticks"] else None,
+        "endpoints": endpoints,
+    }
+
+
+def format_stage(stage):
+    """Tabla de texto con el resumen de una etapa."""
+    lines = [
+        f"{stage['clients']} visores ({stage['pattern']}): {stage['throughput_rps']} pet/s, "
+        f"errores {stage['error_rate']:.2%}, ciclos atrasados {stage['late_cycle_fraction'] or 0:.2%}",
+        f"  {'endpoint':<16}{'pet':>8}{'pet/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'error':>8}",
+    ]
+    for name, endpoint in stage["endpoints"].items():
+        latency = endpoint["latency_ms"]
+        lines.append(
+            f"  {name:<16}{endpoint['requests']:>8}{endpoint['throughput_rps']:>9}"
+            f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}{endpoint['error_rate']:>8.2%}"
+        )
+    return "\n".join(lines)
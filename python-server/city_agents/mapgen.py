@@ -0,0 +1,111 @@
+# 17/10/2026
+# File with the procedural city map generator
+
+import os
+import random
+
+# Celdas del carril junto al destino, según el lado de la manzana: pueden seguir o entrar al destino
+_TURN_INTO_DESTINATION = {
+    "top": "a",  # carril ">" arriba de la manzana: Right, Down
+    "bottom": "z",  # carril "<" abajo de la manzana: Left, Up
+    "left": "Z",  # carril "^" a la izquierda: Right, Up
+    "right": "O",  # carril "v" a la derecha: Down, Left
+}
+
+# Las tablas de ruteo ocupan destinos x celdas x 8 bytes; este es su límite por defecto
+MAX_TABLE_BYTES = 256 * 1024 * 1024
+
+
+def _spans(length, block):
+    """
+    Reparte length celdas en corredores de 2 celdas y manzanas de alrededor de block celdas.
+    Regresa la posición inicial de cada corredor y las manzanas como (inicio, fin).
+    """
+    count = max(1, round((length - 2) / (block + 2)))
+    free = length - 2 * (count + 1)
+    if free < count:
+        raise ValueError(f"El mapa es demasiado pequeño: {length} celdas para manzanas de {block}")
+    sizes = [free // count + (1 if i < free % count else 0) for i in range(count)]
+
+    corridors, blocks = [], []
+    position = 0
+    for size in sizes:
+        corridors.append(position)
+        blocks.append((position + 2, position + 2 + size))
+        position += 2 + size
+    corridors.append(position)
+    return corridors, blocks
+
+
+def generate_map(width, height, block=6, destinations=None, light_fraction=0.5, seed=0):
+    """
+    Genera un mapa y lo regresa como lista de renglones (sin salto de línea), de arriba abajo.
+    Args:
+        width, height: Tamaño del mapa en celdas (mínimo 5 x 5)
+        block: Tamaño aproximado de cada manzana
+        destinations: Número de destinos; por defecto uno por manzana, limitado para que las
+            tablas de ruteo no pasen de MAX_TABLE_BYTES
+        light_fraction: Proporción de cruces interiores con semáforos
+        seed: Semilla del generador
+    """
+    rng = random.Random(seed)
+    columns, block_columns = _spans(width, block)
+    rows, block_rows = _spans(height, block)
+
+    grid = [bytearray(b"#" * width) for _ in range(height)]
+
+    # Corredores horizontales: "<" en el renglón de arriba, ">" en el de abajo
+    for r in rows:
+        grid[r][:] = b"<" * width
+        grid[r + 1][:] = b">" * width
+    # Corredores verticales: "v" en la columna izquierda, "^" en la derecha; "I" en los cruces
+    horizontal = set()
+    for r in rows:
+        horizontal.update((r, r + 1))
+    for c in columns:
+        for r in range(height):
+            if r in horizontal:
+                grid[r][c] = grid[r][c + 1] = ord("I")
+            else:
+                grid[r][c] = ord("v")
+                grid[r][c + 1] = ord("^")
+
+    # Semáforos: par "SS" arriba del cruce y par "ss" a su derecha, como en los mapas incluidos
+    for r in rows[1:-1]:
+        for c in columns[1:-1]:
+            if rng.random() >= light_fraction:
+                continue
+            grid[r - 1][c] = grid[r - 1][c + 1] = ord("S")
+            grid[r][c + 2] = grid[r + 1][c + 2] = ord("s")
+
+    # Destinos en los bordes de las manzanas, lejos de las esquinas
+    sides = []
+    for top, bottom in block_rows:
+        for left, right in block_columns:
+            if right - left >= 3:
+                sides.append(("top", top, rng.randrange(left + 1, right - 1)))
+                sides.append(("bottom", bottom - 1, rng.randrange(left + 1, right - 1)))
+            if bottom - top >= 3:
+                sides.append(("left", rng.randrange(top + 1, bottom - 1), left))
+                sides.append(("right", rng.randrange(top + 1, bottom - 1), right - 1))
+    if destinations is None:
+        destinations = max(4, min(len(sides) // 4, MAX_TABLE_BYTES // (8 * width * height)))
+    destinations = min(destinations, len(sides))
+
+    for side, r, c in rng.sample(sides, destinations):
+        grid[r][c] = ord("D")
+        lane = {"top": (r - 1, c), "bottom": (r + 1, c), "left": (r, c - 1), "right": (r, c + 1)}[side]
+        grid[lane[0]][lane[1]] = ord(_TURN_INTO_DESTINATION[side])
+
+    return [row.decode() for row in grid]
+
+
+def write_map(path, width, height, **options):
+    """Genera un mapa y lo guarda en path. Regresa path."""
+    lines = generate_map(width, height, **options)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as mapFile:
+        mapFile.write("\n".join(lines) + "\n")
+    return path
@@ -0,0 +1,281 @@
+# 17/10/2026
+# File with the runtime metrics of the city simulation
+
+import abc
+import bisect
+import cProfile
+import io
+import pstats
+import threading
+
+# Límites de los histogramas de tiempo, en segundos
+SECONDS_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    """Métrica con etiquetas: cada combinación de valores tiene su propio hijo."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values, **named):
+        """Hijo de la métrica para unos valores de etiqueta; guardarlo evita buscarlo en cada uso."""
+        if named:
+            values = tuple(named[name] for name in self.label_names)
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Crea el hijo de una combinación de etiquetas (contador, medidor o histograma)."""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, label_names, values):
+        return [f"{name}{_format_labels(label_names, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Valor que solo crece."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(_Metric):
+    """Valor que puede subir y bajar."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, label_names, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(label_names, values, [("le", _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(label_names, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Distribución de valores en cubetas acumuladas."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+
+class Registry:
+    """Métricas del proceso, en el orden en que se registraron."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Paso del modelo
+STEP_SECONDS = REGISTRY.histogram("city_step_seconds", "Duración de un paso completo del modelo.")
+STEP_PHASE_SECONDS = REGISTRY.histogram(
+    "city_step_phase_seconds", "Duración de cada fase de un paso del modelo.", labels=("phase",)
+)
+PHASE_ACTIVATION = STEP_PHASE_SECONDS.labels(phase="activation")
+PHASE_SPAWNING = STEP_PHASE_SECONDS.labels(phase="spawning")
+PHASE_DATA_COLLECTION = STEP_PHASE_SECONDS.labels(phase="data_collection")
+PHASE_RECORDING = STEP_PHASE_SECONDS.labels(phase="recording")
+
+# Ruteo: source es "cache" (ruta guardada), "table" (tablas de siguiente salto),
+# "contracted" (búsqueda en el grafo contraído), "bfs" o "astar" (A* con los pesos de congestión)
+ROUTE_CALLS = REGISTRY.counter(
+    "city_route_calls_total", "Rutas pedidas al servicio de ruteo, por origen de la respuesta.",
+    labels=("source",),
+)
+ROUTE_SECONDS = REGISTRY.histogram(
+    "city_route_seconds", "Tiempo de cálculo de las rutas que no estaban en el caché.",
+    labels=("source",),
+)
+ROUTE_FROM_CACHE = ROUTE_CALLS.labels(source="cache")
+ROUTE_FROM_TABLE = ROUTE_CALLS.labels(source="table")
+ROUTE_FROM_CONTRACTED = ROUTE_CALLS.labels(source="contracted")
+ROUTE_FROM_BFS = ROUTE_CALLS.labels(source="bfs")
+ROUTE_FROM_ASTAR = ROUTE_CALLS.labels(source="astar")
+ROUTE_TABLE_SECONDS = ROUTE_SECONDS.labels(source="table")
+ROUTE_CONTRACTED_SECONDS = ROUTE_SECONDS.labels(source="contracted")
+ROUTE_BFS_SECONDS = ROUTE_SECONDS.labels(source="bfs")
+ROUTE_ASTAR_SECONDS = ROUTE_SECONDS.labels(source="astar")
+CONGESTION_REROUTES = REGISTRY.counter(
+    "city_congestion_reroutes_total", "Coches que cambiaron de ruta porque la suya se congestionó."
+)
+
+# Cambios de carril: result es "changed" o "failed" (no había carril libre en la dirección)
+LANE_CHANGE_ATTEMPTS = REGISTRY.counter(
+    "city_lane_change_attempts_total", "Intentos de cambio de carril de coches bloqueados.",
+    labels=("result",),
+)
+LANE_CHANGED = LANE_CHANGE_ATTEMPTS.labels(result="changed")
+LANE_CHANGE_FAILED = LANE_CHANGE_ATTEMPTS.labels(result="failed")
+
+CARS_SPAWNED = REGISTRY.counter("city_cars_spawned_total", "Coches generados.")
+
+# Activación por eventos: reason es "cell" (se liberó la celda), "light" (semáforo en verde)
+# o "timeout" (se acabó la paciencia del coche)
+CAR_WAKEUPS = REGISTRY.counter(
+    "city_car_wakeups_total", "Coches en espera que volvieron al orden de activación.", labels=("reason",)
+)
+WOKEN_BY_CELL = CAR_WAKEUPS.labels(reason="cell")
+WOKEN_BY_LIGHT = CAR_WAKEUPS.labels(reason="light")
+WOKEN_BY_TIMEOUT = CAR_WAKEUPS.labels(reason="timeout")
+
+# Servidor HTTP
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "city_http_request_seconds", "Duración de las peticiones HTTP, por endpoint.", labels=("endpoint",)
+)
+HTTP_SERIALIZE_SECONDS = REGISTRY.histogram(
+    "city_http_serialize_seconds", "Tiempo de codificación de las respuestas, por endpoint.",
+    labels=("endpoint",),
+)
+SESSIONS = REGISTRY.gauge("city_sessions", "Sesiones de simulación vivas.")
+
+
+class StepProfiler:
+    """
+    Captura de cProfile de los siguientes N pasos de un modelo.
+    El modelo activa el perfilador solo mientras corre cada paso, en el hilo que lo ejecuta.
+    """
+
+    def __init__(self, steps, sort="cumulative", limit=40):
+        self.remaining = steps
+        self.steps = steps
+        self.sort = sort
+        self.limit = limit
+        self.profile = cProfile.Profile()
+
+    @property
+    def done(self):
+        return self.remaining <= 0
+
+    def run_step(self, step):
+        """Corre step() bajo el perfilador y descuenta un paso."""
+        self.profile.enable()
+        try:
+            step()
+        finally:
+            self.profile.disable()
+            self.remaining -= 1
+
+    def report(self):
+        """Estadísticas de los pasos capturados, como texto de pstats."""
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats(self.sort).print_stats(self.limit)
+        return stream.getvalue()
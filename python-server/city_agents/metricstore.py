@@ -0,0 +1,268 @@
+# 17/10/2026
+# File with the columnar metrics store of the city simulation
+
+import numpy as np
+
+# Agregados de cada paso: número de paso, coches en el mapa, coches generados y llegadas
+# (acumulados) y duración del paso
+STEP_COLUMNS = (
+    ("step", np.int64),
+    ("cars", np.int64),
+    ("spawned", np.int64),
+    ("arrived", np.int64),
+    ("step_seconds", np.float64),
+)
+
+# Un registro por viaje terminado: número del coche, paso en que apareció, paso en que llegó,
+# pasos del viaje sin avanzar y rutas alternativas que calculó
+TRIP_COLUMNS = (
+    ("car", np.int64),
+    ("spawn_step", np.int64),
+    ("arrival_step", np.int64),
+    ("wait_steps", np.int64),
+    ("reroutes", np.int64),
+)
+
+
+class CsvSink:
+    """Archivo CSV al que se agregan bloques de filas."""
+
+    def __init__(self, path, names):
+        self.file = open(path, "w")
+        self.file.write(",".join(names) + "\n")
+
+    def write(self, columns):
+        rows = zip(*(column.tolist() for column in columns.values()))
+        self.file.write("".join(",".join(map(str, row)) + "\n" for row in rows))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Archivo Parquet con un row group por bloque de filas (requiere pyarrow)."""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("Exportar a Parquet requiere pyarrow (pip install pyarrow)") from error
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype)) for name, dtype in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, columns):
+        self.writer.write_table(self.pyarrow.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_sink(path, columns):
+    """Abre un archivo de exportación: Parquet si path termina en .parquet, CSV en otro caso."""
+    if str(path).endswith(".parquet"):
+        return ParquetSink(path, columns)
+    return CsvSink(path, [name for name, _ in columns])
+
+
+class ColumnTable:
+    """
+    Tabla de columnas de NumPy preasignadas; las filas se agregan al final.
+    Con un archivo, las filas en memoria se escriben y se descartan cada chunk_rows filas.
+    Sin archivo, guarda a lo más max_rows filas: al llenarse descarta las más viejas.
+    """
+
+    def __init__(self, columns, chunk_rows=4096, max_rows=65536):
+        """
+        Args:
+            columns: Tupla de (nombre, dtype) de cada columna
+            chunk_rows: Filas por bloque (capacidad inicial y tamaño de cada escritura)
+            max_rows: Filas que se guardan en memoria sin archivo (las más recientes)
+        """
+        self.schema = columns
+        self.chunk_rows = chunk_rows
+        self.max_rows = max(max_rows, chunk_rows)
+        self.columns = {name: np.zeros(chunk_rows, dtype=dtype) for name, dtype in columns}
+        self.size = 0  # Filas en memoria
+        self.flushed = 0  # Filas ya escritas en el archivo
+        self.dropped = 0  # Filas descartadas sin archivo
+        self.sink = None
+
+    def __len__(self):
+        """Filas registradas, incluidas las que ya se escribieron en el archivo o se descartaron."""
+        return self.flushed + self.dropped + self.size
+
+    @property
+    def capacity(self):
+        return len(next(iter(self.columns.values())))
+
+    def _make_room(self, count):
+        if self.sink is not None:
+            self.flush()
+        elif self.size + count > self.max_rows:
+            self._drop_oldest(self.size + count - self.max_rows)
+        capacity = self.capacity
+        while self.size + count > capacity:
+            capacity *= 2
+        capacity = min(capacity, max(self.max_rows, count))
+        if capacity != self.capacity:
+            for name, column in self.columns.items():
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+
+    def _drop_oldest(self, count):
+        """Descarta al menos count filas viejas, de chunk_rows en chunk_rows para no mover filas en cada paso."""
+        count = min(self.size, -(-count // self.chunk_rows) * self.chunk_rows)
+        for column in self.columns.values():
+            column[:self.size - count] = column[count:self.size]
+        self.size -= count
+        self.dropped += count
+
+    def append(self, *values):
+        """Agrega una fila con un valor por columna, en el orden del esquema."""
+        if self.size == self.capacity:
+            self._make_room(1)
+        for column, value in zip(self.columns.values(), values):
+            column[self.size] = value
+        self.size += 1
+
+    def extend(self, *arrays):
+        """Agrega varias filas a la vez: un arreglo por columna, en el orden del esquema."""
+        count = len(arrays[0])
+        if self.sink is None and count > self.max_rows:
+            self.dropped += count - self.max_rows
+            arrays = [values[-self.max_rows:] for values in arrays]
+            count = self.max_rows
+        if self.size + count > self.capacity:
+            self._make_room(count)
+        for column, values in zip(self.columns.values(), arrays):
+            column[self.size:self.size + count] = values
+        self.size += count
+
+    def column(self, name):
+        """Vista de las filas en memoria de una columna."""
+        return self.columns[name][:self.size]
+
+    def load(self, arrays, total=None):
+        """
+        Reemplaza las filas en memoria por las de arrays ({nombre: arreglo}).
+        total: Filas registradas en total (las que no vienen en arrays cuentan como descartadas)
+        """
+        count = len(arrays[self.schema[0][0]])
+        self.size = 0
+        self.flushed = 0
+        self.dropped = 0
+        self._make_room(count)
+        for name, column in self.columns.items():
+            column[:count] = arrays[name]
+        self.size = count
+        self.dropped = max(0, (total if total is not None else count) - count)
+
+    def attach(self, path):
+        """Escribe las filas en memoria y las siguientes en path."""
+        self.detach()
+        self.sink = open_sink(path, self.schema)
+
+    def flush(self):
+        """Escribe en el archivo las filas en memoria y las descarta."""
+        if self.sink is not None and self.size:
+            self.sink.write({name: column[:self.size] for name, column in self.columns.items()})
+            self.flushed += self.size
+            self.size = 0
+
+    def detach(self):
+        """Escribe lo pendiente y cierra el archivo, si hay uno."""
+        if self.sink is not None:
+            self.flush()
+            self.sink.close()
+            self.sink = None
+
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class MetricsStore:
+    """Agregados por paso y registros por viaje de un modelo, en tablas de columnas."""
+
+    def __init__(self, chunk_rows=4096, max_rows=65536):
+        self.steps = ColumnTable(STEP_COLUMNS, chunk_rows, max_rows)
+        self.trips = ColumnTable(TRIP_COLUMNS, chunk_rows, max_rows)
+        # Sumas de todos los viajes, también de los que ya se escribieron en el archivo o se descartaron
+        self.trip_steps = 0
+        self.trip_wait_steps = 0
+        self.trip_reroutes = 0
+
+    def record_step(self, step, cars, spawned, arrived, seconds):
+        self.steps.append(step, cars, spawned, arrived, seconds)
+
+    def record_trip(self, car, spawn_step, arrival_step, wait_steps, reroutes):
+        self.trips.append(car, spawn_step, arrival_step, wait_steps, reroutes)
+        self.trip_steps += arrival_step - spawn_step
+        self.trip_wait_steps += wait_steps
+        self.trip_reroutes += reroutes
+
+    def record_trips(self, cars, spawn_steps, arrival_steps, wait_steps, reroutes):
+        """Registra varios viajes a la vez (motor vectorizado)."""
+        self.trips.extend(cars, spawn_steps, arrival_steps, wait_steps, reroutes)
+        self.trip_steps += int((arrival_steps - spawn_steps).sum())
+        self.trip_wait_steps += int(wait_steps.sum())
+        self.trip_reroutes += int(reroutes.sum())
+
+    def totals(self):
+        """Filas registradas y sumas de todos los viajes, para guardarlas en un snapshot."""
+        return {
+            "steps": len(self.steps),
+            "trips": len(self.trips),
+            "trip_steps": self.trip_steps,
+            "trip_wait_steps": self.trip_wait_steps,
+            "trip_reroutes": self.trip_reroutes,
+        }
+
+    def load(self, steps, trips, totals=None):
+        """
+        Reemplaza las filas por las de un snapshot ({nombre: arreglo} de cada tabla).
+        totals: Resultado de totals() al tomar el snapshot; sin él, las sumas salen de las filas.
+        """
+        if totals is None:
+            totals = {
+                "steps": len(steps["step"]),
+                "trips": len(trips["car"]),
+                "trip_steps": int((trips["arrival_step"] - trips["spawn_step"]).sum()),
+                "trip_wait_steps": int(trips["wait_steps"].sum()),
+                "trip_reroutes": int(trips["reroutes"].sum()),
+            }
+        self.steps.load(steps, totals["steps"])
+        self.trips.load(trips, totals["trips"])
+        self.trip_steps = totals["trip_steps"]
+        self.trip_wait_steps = totals["trip_wait_steps"]
+        self.trip_reroutes = totals["trip_reroutes"]
+
+    def export(self, steps_path=None, trips_path=None):
+        """Escribe los agregados por paso y los viajes en archivos CSV o Parquet, por bloques."""
+        if steps_path is not None:
+            self.steps.attach(steps_path)
+        if trips_path is not None:
+            self.trips.attach(trips_path)
+
+    def close(self):
+        """Escribe lo pendiente y cierra los archivos de exportación."""
+        self.steps.detach()
+        self.trips.detach()
+
+    def summary(self):
+        """Número de viajes terminados y sus promedios."""
+        count = len(self.trips)
+        if count == 0:
+            return {"trips": 0}
+        return {
+            "trips": count,
+            "mean_duration": round(self.trip_steps / count, 2),
+            "mean_wait_steps": round(self.trip_wait_steps / count, 2),
+            "mean_reroutes": round(self.trip_reroutes / count, 3),
+        }
+
+    def nbytes(self):
+        return self.steps.nbytes() + self.trips.nbytes()
@@ -1,166 +1,294 @@
-
 # Gabriel Muñoz Luna A01028774
 # 24/11/2024
 # File with the model for the city simulation
 # This file contains the model for the city simulation, which includes the city map, agents, and the simulation itself.
 # The model stops the simulation if all four corners are blocked.
-# The map is loaded from a file and the agents are created based on the map data.
+# The map is loaded from a file (compiled and cached by citymap.py) and the agents are created based on the map data.
 
 
 from mesa import Model, agent
 from mesa.time import RandomActivation
 from mesa.space import MultiGrid
 from .agent import *
-from mesa.datacollection import DataCollector  # Importación del DataCollector
-import json
-import random
+from .activation import EventActivation
+from .lights import LightTable
+from .routing import CongestionField, Router
+from .trace import STEP, Tracer
+from .metrics import (
+    CARS_SPAWNED, PHASE_ACTIVATION, PHASE_DATA_COLLECTION, PHASE_RECORDING, PHASE_SPAWNING,
+    STEP_SECONDS, StepProfiler,
+)
+from .metricstore import MetricsStore
+from .replay import ReplayRecorder
+from .engine import DIRECTION_CODES, NO_DIRECTION, VectorCarEngine
+from .citymap import *
+import numpy as np
+import sys
+import time
 
 
 class CityModel(Model):
     """
     Creates a model based on a city map.
+    Args:
+        engine: "agents" para mover cada Car como agente de Mesa, o "numpy" para
+            usar el motor vectorizado (VectorCarEngine)
+        map_file: Año de un mapa incluido ("2021" a "2024") o ruta de un mapa propio
+        dictionary_file: Diccionario de símbolos del mapa
+        use_map_cache: Si es False, el mapa se compila sin leer ni escribir el caché
+        seed: Semilla del generador aleatorio del modelo; con la misma semilla la simulación se repite igual
+        spawn_interval: Pasos entre cada generación de coches en las esquinas
+        light_period: Pasos entre cambios de los semáforos; None usa los del diccionario del mapa
+        activation: "random" para activar todos los coches en cada paso, o "event" para que los
+            coches bloqueados esperen fuera del schedule hasta que su celda se libere (EventActivation)
+        routing: "shortest" para rutas de menos saltos, o "congestion" para A* con pesos de
+            ocupación y colas (solo con el motor agents)
+        reroute_threshold: Con ruteo "congestion", aumento del costo del resto de la ruta sobre
+            el planeado a partir del cual un coche busca otra (una celda ocupada cuesta 2)
+        tracer: Tracer que recibe los eventos de los coches y del modelo; por defecto no se registra nada
     """
 
-    def __init__(self):
-        # Cargar el diccionario de datos del mapa
-        dataDictionary = json.load(open("city_files/mapDictionary.json"))
-
-        self.traffic_lights = []
-        self.destinations = []  # Lista para almacenar las posiciones de los destinos
-        self.graph = {}  # Grafo como lista de adyacencia
+    def __init__(
+        self,
+        engine="agents",
+        map_file=DEFAULT_MAP,
+        dictionary_file=DEFAULT_DICTIONARY,
+        use_map_cache=True,
+        seed=None,
+        spawn_interval=10,
+        light_period=None,
+        activation="random",
+        routing="shortest",
+        reroute_threshold=2.0,
+        tracer=None,
+    ):
+        if seed is not None:
+            # Mesa solo toma la semilla si se pasa por nombre; así también funciona posicional
+            self.reset_randomizer(seed)
+        if engine not in ("agents", "numpy"):
+            raise ValueError(f"Motor desconocido: {engine}")
+        if activation not in ("random", "event"):
+            raise ValueError(f"Activación desconocida: {activation}")
+        if routing not in ("shortest", "congestion"):
+            raise ValueError(f"Ruteo desconocido: {routing}")
+        if routing == "congestion" and engine != "agents":
+            raise ValueError("El ruteo por congestión solo funciona con el motor agents")
+        self.engine = engine
+        self.activation = activation
+        self.routing = routing
+        self.reroute_threshold = reroute_threshold
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.car_engine = None  # Motor vectorizado, solo si engine == "numpy"
+
+        # Mapa compilado (se abre del caché si el contenido no cambió)
+        self.map_file = map_file
+        self.dictionary_file = dictionary_file
+        self.city_map = load_map(map_file, dictionary_file, use_cache=use_map_cache)
 
         # Variables para el control de generación de agentes
         self.spawned_agents = 0  # Contador de agentes generados
         self.agents_reached_destination = 0  # Contador de agentes que llegaron a su destino
-        self.spawned_agents = 0  # Contador de agentes generados
-        self.spawn_interval = 10  # Intervalo de pasos para generar agentes
+        self.spawn_interval = spawn_interval  # Intervalo de pasos para generar agentes
         self.step_count = 0  # Contador de pasos
+        self.profiler = None  # StepProfiler activo, ver start_profile
+        self.profile_report = None  # Resultado de la última captura de cProfile
+        self.recorder = None  # ReplayRecorder activo, ver start_recording
+
+        self.width = self.city_map.width
+        self.height = self.city_map.height
+
+        self.grid = MultiGrid(self.width, self.height, torus=False)
+        self.schedule = EventActivation(self) if activation == "event" else RandomActivation(self)
+
+        # Mapa estático: tipo de celda y máscara de direcciones por posición [y][x]
+        self.cell_type = self.city_map.cell_type
+        self.cell_directions = self.city_map.cell_directions
+        # Candidatos de cambio de carril por celda y dirección, precalculados con el mapa
+        self.lane_targets = self.city_map.lane_targets
+
+        # Grafo como lista de adyacencia y posiciones de los destinos
+        self.graph = self.city_map.graph()
+        self.destinations = self.city_map.positions(self.city_map.destinations)
+
+        # Posiciones de las cuatro esquinas
+        self.spawn_positions = self.city_map.positions(self.city_map.spawn_points)
+        # Dirección inicial de los coches generados en cada esquina
+        self.spawn_directions = {
+            (0, 0): "Right",
+            (self.width - 1, 0): "Up",
+            (0, self.height - 1): "Down",
+            (self.width - 1, self.height - 1): "Left",
+        }
+
+        # Semáforos: tabla de fases por grupo; su estado se calcula con el número de paso,
+        # así que no son agentes ni entran al schedule
+        self.lights = LightTable.from_map(
+            self.city_map,
+            [self.cell_id(pos, "tl") for pos in self.city_map.positions(self.city_map.light_cells)],
+            light_period=light_period,
+        )
 
-        # Leer el archivo del mapa
-        with open("city_files/2024_base.txt") as baseFile:
-            lines = baseFile.readlines()
-            self.width = len(lines[0]) - 1
-            self.height = len(lines)
-
-            self.grid = MultiGrid(self.width, self.height, torus=False)
-            self.schedule = RandomActivation(self)
-
-            self.static_map = [
-                [None for _ in range(self.width)] for _ in range(self.height)
-            ]
-
-            # Posiciones de las cuatro esquinas
-            self.spawn_positions = [
-                (0, 0),  # Esquina inferior izquierda
-                (self.width - 1, 0),  # Esquina inferior derecha
-                (0, self.height - 1),  # Esquina superior izquierda
-                (self.width - 1, self.height - 1),  # Esquina superior derecha
-            ]
-
-            # Crear agentes y generar el grafo
-            for r, row in enumerate(lines):
-                for c, col in enumerate(row):
-                    cell_pos = (c, self.height - r - 1)  # Ajustar posición según Mesa
-                    if (
-                        col in dataDictionary
-                    ):  # Verificar que la celda está en el diccionario
-                        # Direcciones específicas de cada celda
-                        directions = (
-                            dataDictionary[col]
-                            if isinstance(dataDictionary[col], list)
-                            else [dataDictionary[col]]
-                        )
-
-                        # Inicializar nodo en el grafo con vecinos calculados
-                        self.graph[cell_pos] = self.get_neighbors(
-                            cell_pos, directions, dataDictionary, lines, col
-                        )
-
-                        # Asignar agentes a las celdas según su tipo
-                        if col in [
-                            "V",
-                            "v",
-                            "^",
-                            ">",
-                            "<",
-                            "I",
-                            "i",
-                            "O",
-                            "o",
-                            "A",
-                            "a",
-                            "Z",
-                            "z",
-                        ]:
-                            agent = Road(f"r_{r*self.width+c}", self, directions)
-                            self.grid.place_agent(agent, cell_pos)
-                            self.static_map[cell_pos[1]][cell_pos[0]] = {
-                                "type": "Road",
-                                "directions": directions,
-                            }
-                        elif col == "D":
-                            agent = Destination(f"d_{r*self.width+c}", self)
-                            self.grid.place_agent(agent, cell_pos)
-                            self.destinations.append(
-                                cell_pos
-                            )  # Agregar posición del destino
-                            self.static_map[cell_pos[1]][cell_pos[0]] = {
-                                "type": "Destination"
-                            }
-                        elif col in ["S", "s"]:
-                            # Asignar dirección heredada al semáforo
-                            inherited_directions = self.get_inherited_direction(
-                                cell_pos, lines, dataDictionary
-                            )
-                            agent = Traffic_Light(
-                                f"tl_{r*self.width+c}",
-                                self,
-                                False if col == "S" else True,
-                                int(dataDictionary[col][0]),
-                            )
-                            self.grid.place_agent(agent, cell_pos)
-                            self.schedule.add(agent)
-                            self.traffic_lights.append((cell_pos, inherited_directions))
-                            self.static_map[cell_pos[1]][cell_pos[0]] = {
-                                "type": "Traffic_Light",
-                                "directions": inherited_directions,
-                            }
-                        elif col == "#":
-                            agent = Obstacle(f"ob_{r*self.width+c}", self)
-                            self.grid.place_agent(agent, cell_pos)
-                            self.static_map[cell_pos[1]][cell_pos[0]] = {
-                                "type": "Obstacle"
-                            }
-
-            # Crear los primeros 4 coches en las esquinas
-            self.spawn_cars()
-
-        # DataCollector para recolectar datos durante la simulación
-        self.datacollector = DataCollector(
-            model_reporters={
-                "Current Agents": self.get_current_agents,
-                "Agents Reached Destination": self.get_agents_reached_destination,
-            }
+        # Servicio de ruteo: tablas de siguiente salto por destino, caché LRU de rutas y grafo
+        # contraído entre cruces, semáforos, destinos y esquinas para las búsquedas
+        self.router = Router(
+            self.graph,
+            self.destinations,
+            self.width,
+            self.height,
+            tables=(self.city_map.next_hop, self.city_map.distance),
+            keep=[*self.lights.positions, *self.spawn_positions],
         )
+        # Ocupación y colas por celda para el ruteo por congestión; la actualizan los coches
+        self.congestion = None
+        if routing == "congestion":
+            self.congestion = CongestionField(self.width, self.height, contracted=self.router.contracted)
+
+        if self.engine == "numpy":
+            self.car_engine = VectorCarEngine(self)
+
+        # Crear los primeros 4 coches en las esquinas
+        self.spawn_cars()
+
+        # Agregados por paso y registros por viaje, en columnas que se pueden exportar por bloques
+        self.metrics_store = MetricsStore()
 
 
         self.running = True
 
+    def invalidate_routes(self):
+        """Invalida las rutas guardadas. Llamar cada vez que cambie el grafo del mapa."""
+        self.router.invalidate()
+        if self.congestion is not None:
+            self.congestion.attach(self.router.contracted)
+
+    def cell_id(self, pos, prefix):
+        """
+        Identificador estable de una celda estática, con el mismo formato que tenían
+        los agentes Road/Obstacle/Destination (prefijo + índice de la celda en el archivo).
+        """
+        x, y = pos
+        return f"{prefix}_{(self.height - y - 1) * self.width + x}"
+
+    def get_roads(self):
+        """Regresa (id, (x, y), direcciones) de cada celda de calle."""
+        return [
+            (
+                self.cell_id(pos, "r"),
+                pos,
+                mask_to_directions(int(self.cell_directions[pos[1], pos[0]])),
+            )
+            for pos in cells_of_type(self.cell_type, CELL_ROAD)
+        ]
+
+    def get_obstacles(self):
+        """Regresa (id, (x, y)) de cada obstáculo."""
+        return [
+            (self.cell_id(pos, "ob"), pos)
+            for pos in cells_of_type(self.cell_type, CELL_OBSTACLE)
+        ]
+
+    def get_destination_cells(self):
+        """Regresa (id, (x, y)) de cada destino."""
+        return [(self.cell_id(pos, "d"), pos) for pos in self.destinations]
+
+    def get_lights(self):
+        """Regresa (id, (x, y), estado) de cada semáforo."""
+        return list(zip(self.lights.ids, self.lights.positions, self.lights.states(self.step_count).tolist()))
+
+    def get_changed_lights(self, since=None):
+        """
+        Regresa (id, (x, y), estado) de los semáforos que cambiaron desde el paso since
+        (por defecto, solo en el último paso).
+        """
+        step = self.step_count
+        since = step - 1 if since is None else since
+        changed = self.lights.changed_since(since, step).tolist()
+        states = self.lights.states(step)
+        return [(self.lights.ids[i], self.lights.positions[i], bool(states[i])) for i in changed]
+
+    def memory_usage(self):
+        """
+        Memoria aproximada del modelo en bytes.
+        El mapa compilado está mapeado en memoria y se comparte entre los modelos del mismo mapa.
+        """
+        tables = self.router.tables
+        usage = {
+            "map_shared": self.city_map.nbytes(),
+            "routing": tables.next_hop.nbytes + tables.distance.nbytes,
+            "lights": self.lights.nbytes(),
+            "congestion": self.congestion.nbytes() if self.congestion is not None else 0,
+            "contracted_graph": self.router._contracted.nbytes() if self.router._contracted is not None else 0,
+            "metrics_store": self.metrics_store.nbytes(),
+            "route_cache": sum(
+                sys.getsizeof(path) + 64 * len(path)
+                for path in self.router._cache.values()
+                if path is not None
+            ),
+        }
+        if self.car_engine is not None:
+            usage["cars"] = self.car_engine.nbytes()
+        else:
+            usage["cars"] = sum(
+                sys.getsizeof(agent.__dict__) + 64 * len(agent.path or [])
+                for agent in self.schedule.agents
+                if isinstance(agent, Car)
+            )
+        return usage
+
     def get_current_agents(self):
         """Obtiene el número actual de agentes en la simulación."""
-        return len(
-            [agent for agent in self.schedule.agents if isinstance(agent, Car)]
-        )
+        if self.car_engine is not None:
+            return self.car_engine.count
+        # El schedule solo tiene coches y lleva su cuenta al agregar y quitar
+        return self.schedule.get_agent_count()
 
     def get_agents_reached_destination(self):
         """Obtiene el número de agentes que han llegado a su destino."""
         return self.agents_reached_destination
-    
+
+    def get_car_states(self):
+        """
+        Regresa (id, (x, y), dirección) de cada coche, sin importar el motor usado.
+        """
+        if self.car_engine is not None:
+            return self.car_engine.car_states()
+        return [
+            (agent.unique_id, agent.pos, agent.direction)
+            for agent in self.schedule.agents
+            if isinstance(agent, Car)
+        ]
+
+    def get_car_arrays(self):
+        """
+        Regresa (ids, x, y, códigos de dirección) de los coches como arreglos de NumPy.
+        Los ids son el número de "car_N" y las direcciones usan los códigos de DIRECTIONS (-1 sin dirección).
+        """
+        if self.car_engine is not None:
+            return self.car_engine.car_arrays()
+        cars = [agent for agent in self.schedule.agents if isinstance(agent, Car)]
+        ids = np.fromiter((int(car.unique_id[4:]) for car in cars), dtype=np.int64, count=len(cars))
+        xs = np.fromiter((car.pos[0] for car in cars), dtype=np.int64, count=len(cars))
+        ys = np.fromiter((car.pos[1] for car in cars), dtype=np.int64, count=len(cars))
+        directions = np.fromiter(
+            (DIRECTION_CODES.get(car.direction, NO_DIRECTION) for car in cars),
+            dtype=np.int64,
+            count=len(cars),
+        )
+        return ids, xs, ys, directions
+
     def spawn_cars(self):
         """
         Generar coches en las cuatro esquinas.
         Detener la simulación si las cuatro esquinas están bloqueadas.
         """
+        spawned = self.spawned_agents
+        if self.car_engine is not None:
+            # El motor vectorizado coloca los coches en sus propios arreglos
+            if not self.car_engine.spawn(self.spawn_positions, self.spawn_directions):
+                self.running = False
+            CARS_SPAWNED.inc(self.spawned_agents - spawned)
+            return
+
         all_corners_blocked = (
             True  # Bandera para verificar si todas las esquinas están bloqueadas
         )
@@ -169,22 +297,19 @@ class CityModel(Model):
             cell_contents = self.grid.get_cell_list_contents(spawn_pos)
 
             # Verificar si la celda está ocupada
-            if not any(isinstance(agent, (Car, Obstacle)) for agent in cell_contents):
+            if self.cell_type[spawn_pos[1], spawn_pos[0]] != CELL_OBSTACLE and not any(
+                isinstance(agent, Car) for agent in cell_contents
+            ):
                 # Crear y asignar el coche si la celda está libre
                 car = Car(f"car_{self.spawned_agents}", self)
-                if spawn_pos == (0, 0):
-                    car.direction = "Right"
-                elif spawn_pos == (self.width - 1, 0):
-                    car.direction = "Up"
-                elif spawn_pos == (0, self.height - 1):
-                    car.direction = "Down"
-                elif spawn_pos == (self.width - 1, self.height - 1):
-                    car.direction = "Left"
+                car.direction = self.spawn_directions[spawn_pos]
 
                 self.grid.place_agent(car, spawn_pos)
                 self.schedule.add(car)
+                if self.congestion is not None:
+                    self.congestion.enter(spawn_pos)
                 if self.destinations:
-                    car.destination = random.choice(
+                    car.destination = self.random.choice(
                         self.destinations
                     )  # Asignar un destino aleatorio
                 self.spawned_agents += 1
@@ -192,110 +317,93 @@ class CityModel(Model):
                     False  # Al menos una esquina permitió generar un coche
                 )
 
+        CARS_SPAWNED.inc(self.spawned_agents - spawned)
+
         # Detener la simulación si no se pudo generar un coche en ninguna esquina
         if all_corners_blocked:
             self.running = False
 
-    def get_neighbors(self, pos, directions, dataDictionary, lines, cell_type):
+    def start_profile(self, steps):
+        """Captura con cProfile los siguientes steps pasos; el resultado queda en profile_report."""
+        self.profiler = StepProfiler(steps)
+        self.profile_report = None
+
+    def start_recording(self, path, chunk_steps=64):
+        """Graba el paso actual y cada paso siguiente en el log de repetición path."""
+        self.stop_recording()
+        self.recorder = ReplayRecorder(path, self, chunk_steps=chunk_steps)
+        self.recorder.record(self)
+        return self.recorder
+
+    def stop_recording(self):
+        """Termina la grabación activa, si hay una."""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def export_metrics(self, steps_path=None, trips_path=None):
         """
-        Obtiene las celdas vecinas según las direcciones permitidas.
-        Los semáforos heredan la dirección del nodo previo y se conectan correctamente al siguiente nodo.
+        Escribe los agregados por paso y los registros por viaje en archivos CSV o Parquet
+        (según la extensión): primero lo ya registrado y después un bloque cada vez que se llena.
         """
-        x, y = pos
-        neighbors = []
-
-        for direction in directions:
-            current = (x, y)
-            while True:
-                if direction == "Right":
-                    next_pos = (current[0] + 1, current[1])
-                elif direction == "Left":
-                    next_pos = (current[0] - 1, current[1])
-                elif direction == "Up":
-                    next_pos = (current[0], current[1] + 1)
-                elif direction == "Down":
-                    next_pos = (current[0], current[1] - 1)
-                else:
-                    break
-
-                # Verificar límites del mapa
-                if not (
-                    0 <= next_pos[0] < self.width and 0 <= next_pos[1] < self.height
-                ):
-                    break
-
-                neighbor_cell = lines[self.height - next_pos[1] - 1][next_pos[0]]
-
-                # Si es un obstáculo, detener
-                if neighbor_cell == "#":
-                    break
-
-                # Si es un semáforo, agregarlo y detener el loop
-                if neighbor_cell in ["S", "s"]:
-                    neighbors.append(next_pos)  # Conectar solo al semáforo
-                    break  # No continuar más allá del semáforo
-
-                # Si es un nodo transitable y no es un semáforo, agregarlo como vecino
-                if neighbor_cell in dataDictionary:
-                    neighbors.append(next_pos)
-                    break
-
-        return neighbors
-
-    def get_inherited_direction(self, pos, lines, dataDictionary):
-        """
-        Obtiene la dirección heredada para una celda de semáforo.
-        """
-        x, y = pos
-        inherited_directions = []
-
-        # Revisar las celdas adyacentes para heredar la dirección
-        for dx, dy, direction in [
-            (-1, 0, "Right"),
-            (1, 0, "Left"),
-            (0, -1, "Up"),
-            (0, 1, "Down"),
-        ]:
-            neighbor = (x + dx, y + dy)
-            if 0 <= neighbor[0] < self.width and 0 <= neighbor[1] < self.height:
-                neighbor_cell = lines[self.height - neighbor[1] - 1][neighbor[0]]
-                if neighbor_cell in [
-                    "v",
-                    "^",
-                    ">",
-                    "<",
-                    "I",
-                    "i",
-                    "O",
-                    "o",
-                    "A",
-                    "a",
-                    "Z",
-                    "z",
-                ]:
-                    inherited_directions.append(direction)
-
-        return inherited_directions
+        self.metrics_store.export(steps_path, trips_path)
+
+    def close_metrics(self):
+        """Escribe lo pendiente y cierra los archivos de export_metrics."""
+        self.metrics_store.close()
 
     def step(self):
         """Avanzar el modelo en un paso."""
+        if self.profiler is None:
+            self._step()
+            return
+
+        self.profiler.run_step(self._step)
+        if self.profiler.done:
+            self.profile_report = self.profiler.report()
+            self.profiler = None
+
+    def _step(self):
         if self.running:  # Verificar si la simulación está activa
+            start = time.perf_counter()
+            self.tracer.step_number = self.step_count + 1  # Los eventos llevan el número del paso en curso
             self.schedule.step()
+            if self.car_engine is not None:
+                # Los coches se mueven en lote, con los semáforos del paso en curso
+                self.car_engine.step()
             self.step_count += 1
+            phase_end = time.perf_counter()
+            PHASE_ACTIVATION.observe(phase_end - start)
 
             # Generar más coches cada intervalo de pasos
             if self.step_count % self.spawn_interval == 0:
+                phase_start = phase_end
                 self.spawn_cars()
+                phase_end = time.perf_counter()
+                PHASE_SPAWNING.observe(phase_end - phase_start)
 
             # Recolectar datos
-            self.datacollector.collect(self)
-
-            # Imprimir datos recolectados en este paso
-            current_agents = self.get_current_agents()
-            agents_reached = self.get_agents_reached_destination()
-            print(
-                f"Paso {self.step_count}: Agentes actuales = {current_agents}, "
-                f"Agentes que llegaron a su destino = {agents_reached}"
+            phase_start = phase_end
+            self.metrics_store.record_step(
+                self.step_count,
+                self.get_current_agents(),
+                self.spawned_agents,
+                self.agents_reached_destination,
+                phase_start - start,
             )
-
-
+            phase_end = time.perf_counter()
+            PHASE_DATA_COLLECTION.observe(phase_end - phase_start)
+
+            # Grabar el paso en el log de repetición
+            if self.recorder is not None:
+                phase_start = phase_end
+                self.recorder.record(self)
+                phase_end = time.perf_counter()
+                PHASE_RECORDING.observe(phase_end - phase_start)
+
+            # Registrar los datos recolectados en este paso
+            if self.tracer.step:
+                self.tracer.emit(
+                    STEP, -1, self.get_current_agents(), self.get_agents_reached_destination()
+                )
+            STEP_SECONDS.observe(time.perf_counter() - start)
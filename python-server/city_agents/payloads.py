@@ -0,0 +1,54 @@
+# 17/10/2026
+# File with the precomputed static payloads for the city simulation server
+
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import threading
+
+# Máximo de capas guardadas (varios mapas x capas)
+MAX_PAYLOADS = 32
+
+_payloads = OrderedDict()  # {(hash del mapa, capa): StaticPayload}
+_payloads_lock = threading.Lock()  # Los hilos de Flask comparten el caché
+
+
+class StaticPayload:
+    """
+    Respuesta ya codificada: cuerpo JSON, cuerpo gzip y su ETag.
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(",", ":")).encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+    def etag_for(self, use_gzip):
+        """ETag de la variante servida; la versión gzip tiene su propia etiqueta."""
+        return f"{self.etag}-gz" if use_gzip else self.etag
+
+
+def static_payload(map_hash, layer, build):
+    """
+    Regresa el StaticPayload de una capa del mapa, construyéndolo solo la primera vez.
+    Args:
+        map_hash: Hash de contenido del mapa compilado
+        layer: Nombre de la capa ("roads", "obstacles", "destinations")
+        build: Función sin argumentos que regresa los datos de la capa
+    """
+    key = (map_hash, layer)
+    with _payloads_lock:
+        payload = _payloads.get(key)
+        if payload is not None:
+            _payloads.move_to_end(key)
+            return payload
+
+    # Se codifica sin el candado; si dos hilos la construyen a la vez, se guarda la primera
+    payload = StaticPayload(build())
+    with _payloads_lock:
+        payload = _payloads.setdefault(key, payload)
+        _payloads.move_to_end(key)
+        while len(_payloads) > MAX_PAYLOADS:
+            _payloads.popitem(last=False)
+    return payload
@@ -0,0 +1,236 @@
+# 17/10/2026
+# File with the replay log of the city simulation
+
+import bisect
+from collections import OrderedDict
+import json
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from .binframe import HEADER as CARS_HEADER, NO_DIRECTION_CODE, decode_cars, encode_cars
+from .engine import DIRECTIONS
+
+REPLAY_VERSION = 1
+MAGIC = b"CITYRPL\0"
+EXTENSION = ".cityrpl"
+CHUNK = struct.Struct("<IIII")  # primer paso, pasos, bytes comprimidos, bytes sin comprimir
+INDEX = struct.Struct("<IIQI")  # primer paso, pasos, offset del chunk en el log, bytes comprimidos
+
+
+class ReplayRecorder:
+    """
+    Graba los pasos de un modelo en un log de repetición.
+    """
+
+    def __init__(self, path, model, chunk_steps=64, level=6):
+        """
+        Args:
+            path: Archivo del log; el índice se escribe en path + ".idx"
+            model: CityModel grabado (de él salen el mapa y los semáforos del encabezado)
+            chunk_steps: Pasos por chunk; chunks más chicos permiten saltos más finos
+            level: Nivel de compresión de zlib
+        """
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self.level = level
+        self.light_bytes = (len(model.lights) + 7) // 8
+        self.last_step = None
+        self._pending = []
+        self._first_step = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = json.dumps({
+            "version": REPLAY_VERSION,
+            "width": model.width,
+            "height": model.height,
+            "map_file": str(model.map_file),
+            "source_hash": model.city_map.source_hash,
+            "engine": model.engine,
+            "chunk_steps": chunk_steps,
+            "lights": model.lights.ids,
+        }).encode()
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.file.flush()
+        self.index = open(path + ".idx", "wb")
+
+    def record(self, model):
+        """Agrega el estado actual del modelo; un paso ya grabado se ignora."""
+        step = model.step_count
+        if step == self.last_step:
+            return
+        ids, xs, ys, directions = model.get_car_arrays()
+        lights = model.lights.states(step)
+        self._pending.append(encode_cars(step, ids, xs, ys, directions) + np.packbits(lights).tobytes())
+        if self._first_step is None:
+            self._first_step = step
+        self.last_step = step
+        if len(self._pending) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Escribe los pasos pendientes como un chunk y agrega su registro al índice."""
+        if not self._pending:
+            return
+        raw = b"".join(self._pending)
+        data = zlib.compress(raw, self.level)
+        offset = self.file.tell()
+        self.file.write(CHUNK.pack(self._first_step, len(self._pending), len(data), len(raw)) + data)
+        self.file.flush()
+        # El índice se escribe después del chunk: nunca apunta a datos incompletos
+        self.index.write(INDEX.pack(self._first_step, len(self._pending), offset, len(data)))
+        self.index.flush()
+        self._pending = []
+        self._first_step = None
+
+    def close(self):
+        """Escribe lo pendiente y cierra los archivos."""
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.index.close()
+            self.file = None
+
+
+class ReplayReader:
+    """
+    Lectura de un log de repetición con acceso aleatorio por número de paso.
+    Los últimos chunks leídos se guardan descomprimidos para ir y volver sin leer de nuevo.
+    """
+
+    def __init__(self, path, cache_chunks=8):
+        self.path = path
+        self.cache_chunks = cache_chunks
+        self._chunks = OrderedDict()  # {número de chunk: [(paso, bytes del paso)]}
+        self.lock = threading.Lock()  # Para compartir el lector entre hilos del servidor
+        self._open()
+        self.refresh()
+
+    def _open(self):
+        """Lee el encabezado del log y olvida los chunks leídos antes."""
+        with open(self.path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} no es un log de repetición")
+            (header_length,) = struct.unpack("<I", file.read(4))
+            self.header = json.loads(file.read(header_length))
+        self.light_ids = self.header["lights"]
+        self.light_bytes = (len(self.light_ids) + 7) // 8
+        self.first_steps = []
+        self.entries = []  # (primer paso, pasos, offset, bytes comprimidos)
+        self._chunks.clear()
+        self._index_size = 0
+
+    def refresh(self):
+        """Lee los registros nuevos del índice (el log puede seguir creciendo mientras se graba)."""
+        index_path = self.path + ".idx"
+        if not os.path.isfile(index_path):
+            self._chunks.clear()
+            self._rebuild_index()
+            return
+        size = os.path.getsize(index_path)
+        if size < self._index_size:
+            # Un índice más corto que lo ya leído: el log se volvió a grabar desde el principio
+            self._open()
+        if size == self._index_size:
+            return
+        with open(index_path, "rb") as file:
+            file.seek(self._index_size)
+            data = file.read(size - self._index_size)
+        usable = len(data) - len(data) % INDEX.size
+        for entry in INDEX.iter_unpack(data[:usable]):
+            self.entries.append(entry)
+            self.first_steps.append(entry[0])
+        self._index_size += usable
+
+    def _rebuild_index(self):
+        """Reconstruye el índice recorriendo los encabezados de los chunks del log."""
+        self.entries, self.first_steps = [], []
+        with open(self.path, "rb") as file:
+            file.seek(len(MAGIC))
+            (header_length,) = struct.unpack("<I", file.read(4))
+            offset = len(MAGIC) + 4 + header_length
+            end = os.path.getsize(self.path)
+            while offset + CHUNK.size <= end:
+                file.seek(offset)
+                first_step, steps, length, _ = CHUNK.unpack(file.read(CHUNK.size))
+                if offset + CHUNK.size + length > end:
+                    break  # Chunk cortado al final del archivo
+                self.entries.append((first_step, steps, offset, length))
+                self.first_steps.append(first_step)
+                offset += CHUNK.size + length
+
+    @property
+    def first_step(self):
+        return self.entries[0][0] if self.entries else None
+
+    @property
+    def last_step(self):
+        if not self.entries:
+            return None
+        return self._chunk(len(self.entries) - 1)[-1][0]
+
+    def info(self):
+        return {
+            "map_file": self.header["map_file"],
+            "engine": self.header["engine"],
+            "first_step": self.first_step,
+            "last_step": self.last_step,
+            "chunks": len(self.entries),
+            "bytes": os.path.getsize(self.path),
+        }
+
+    def _chunk(self, number):
+        """Pasos de un chunk como lista de (paso, bytes del paso)."""
+        steps = self._chunks.get(number)
+        if steps is not None:
+            self._chunks.move_to_end(number)
+            return steps
+
+        _, count, offset, length = self.entries[number]
+        with open(self.path, "rb") as file:
+            file.seek(offset + CHUNK.size)
+            raw = memoryview(zlib.decompress(file.read(length)))
+        steps = []
+        position = 0
+        for _ in range(count):
+            step, cars = CARS_HEADER.unpack_from(raw, position)
+            size = CARS_HEADER.size + 9 * cars + self.light_bytes
+            steps.append((step, raw[position:position + size]))
+            position += size
+
+        self._chunks[number] = steps
+        while len(self._chunks) > self.cache_chunks:
+            self._chunks.popitem(last=False)
+        return steps
+
+    def records(self, start, end):
+        """Genera (paso, bytes del paso) de los pasos grabados en [start, end]."""
+        number = max(0, bisect.bisect_right(self.first_steps, start) - 1)
+        while number < len(self.entries) and self.entries[number][0] <= end:
+            for step, data in self._chunk(number):
+                if step > end:
+                    return
+                if step >= start:
+                    yield step, data
+            number += 1
+
+    def states(self, start, end):
+        """
+        Genera (paso, coches, semáforos) de los pasos grabados en [start, end], con
+        coches como {id: (x, z, dirección)} y semáforos como {id: estado}, igual que frames.snapshot.
+        """
+        for step, data in self.records(start, end):
+            _, ids, xs, zs, directions = decode_cars(data)
+            light_bits = np.frombuffer(data, dtype=np.uint8, offset=len(data) - self.light_bytes)
+            lights = np.unpackbits(light_bits, count=len(self.light_ids)).astype(bool).tolist()
+            cars = {
+                f"car_{car_id}": (x, z, DIRECTIONS[direction] if direction != NO_DIRECTION_CODE else None)
+                for car_id, x, z, direction in zip(ids.tolist(), xs.tolist(), zs.tolist(), directions.tolist())
+            }
+            yield step, cars, dict(zip(self.light_ids, lights))
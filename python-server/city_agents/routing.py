@@ -0,0 +1,402 @@
+# 17/10/2026
+# File with the routing service for the city simulation
+
+from collections import OrderedDict, deque
+import heapq
+import time
+import numpy as np
+
+from .contraction import ContractedGraph
+from .metrics import (
+    ROUTE_ASTAR_SECONDS, ROUTE_BFS_SECONDS, ROUTE_CONTRACTED_SECONDS, ROUTE_FROM_ASTAR, ROUTE_FROM_BFS,
+    ROUTE_FROM_CACHE, ROUTE_FROM_CONTRACTED, ROUTE_FROM_TABLE, ROUTE_TABLE_SECONDS,
+)
+
+
+class RoutingTables:
+    """
+    Tablas de siguiente salto y distancia para cada destino del mapa.
+    Se guardan como arreglos [destino, celda] con el índice plano de la celda (y * ancho + x);
+    -1 indica que no hay ruta.
+    """
+
+    def __init__(self, graph, destinations, width, height, next_hop=None, distance=None):
+        """
+        Construye las tablas a partir del grafo del modelo.
+        Args:
+            graph: Lista de adyacencia {nodo: [vecinos]}
+            destinations: Lista de posiciones de destino
+            width, height: Dimensiones del mapa
+            next_hop, distance: Tablas ya calculadas (por ejemplo, de un mapa compilado)
+        """
+        self.graph = graph
+        self.width = width
+        self.height = height
+        if next_hop is None or distance is None:
+            self.rebuild(destinations)
+        else:
+            self.index = {pos: d for d, pos in enumerate(destinations)}
+            self.next_hop = next_hop
+            self.distance = distance
+
+    def rebuild(self, destinations):
+        """Recalcula todas las tablas, una búsqueda inversa por destino."""
+        reverse_graph = {}
+        for node, neighbors in self.graph.items():
+            for neighbor in neighbors:
+                reverse_graph.setdefault(neighbor, []).append(node)
+
+        self.index = {pos: d for d, pos in enumerate(destinations)}
+        num_cells = self.width * self.height
+        self.next_hop = np.full((len(destinations), num_cells), -1, dtype=np.int32)
+        self.distance = np.full((len(destinations), num_cells), -1, dtype=np.int32)
+        for d, destination in enumerate(destinations):
+            self._reverse_bfs(reverse_graph, destination, self.next_hop[d], self.distance[d])
+
+    def _reverse_bfs(self, reverse_graph, destination, next_hop, distance):
+        """
+        BFS desde el destino sobre las aristas invertidas.
+        El nodo desde el que se descubre un vecino es su siguiente salto hacia el destino.
+        """
+        width = self.width
+        distance[destination[1] * width + destination[0]] = 0
+        queue = deque([(destination, 0)])
+
+        while queue:
+            current_node, current_distance = queue.popleft()
+            current_index = current_node[1] * width + current_node[0]
+            for previous in reverse_graph.get(current_node, []):
+                previous_index = previous[1] * width + previous[0]
+                if distance[previous_index] < 0:
+                    distance[previous_index] = current_distance + 1
+                    next_hop[previous_index] = current_index
+                    queue.append((previous, current_distance + 1))
+
+    def next_node(self, node, destination):
+        """Siguiente nodo de la ruta más corta, o None si no hay ruta."""
+        d = self.index.get(destination)
+        if d is None:
+            return None
+        next_index = int(self.next_hop[d, node[1] * self.width + node[0]])
+        if next_index < 0:
+            return None
+        return (next_index % self.width, next_index // self.width)
+
+    def path(self, start, destination):
+        """
+        Reconstruye la ruta completa siguiendo la tabla de siguiente salto.
+        Regresa None si el destino no tiene tabla o no es alcanzable desde start.
+        """
+        d = self.index.get(destination)
+        if d is None:
+            return None
+        start_index = start[1] * self.width + start[0]
+        if self.distance[d, start_index] < 0:
+            return None
+
+        table = self.next_hop[d]
+        width = self.width
+        path = [start]
+        index = start_index
+        for _ in range(int(self.distance[d, start_index])):
+            index = int(table[index])
+            path.append((index % width, index // width))
+        return path
+
+
+def bfs_shortest_path(graph, start, destination, avoid_node=None):
+    """
+    BFS con apuntadores al padre: cada nodo guarda de dónde fue descubierto y la ruta
+    se reconstruye una sola vez al llegar al destino.
+    """
+    if start == destination:
+        return [start]
+
+    parents = {start: None}
+    queue = deque([start])
+
+    while queue:
+        current_node = queue.popleft()
+        for neighbor in graph.get(current_node, []):
+            if neighbor in parents or neighbor == avoid_node:
+                continue
+            parents[neighbor] = current_node
+            if neighbor == destination:
+                path = [neighbor]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                path.reverse()
+                return path
+            queue.append(neighbor)
+
+    return None
+
+
+class CongestionField:
+    """
+    Ocupación y largo de cola de cada celda, en listas planas (y * ancho + x).
+    Los coches la actualizan al entrar o salir de una celda y al quedarse bloqueados frente
+    a una, así que se mantiene al día sin recorrer el mapa en cada paso. weights guarda el
+    costo extra de entrar a cada celda ya combinado, porque A* lo lee por cada vecino que
+    visita (listas de Python, que se leen más rápido que un arreglo de NumPy elemento por elemento).
+    Con un grafo contraído, edge_weights lleva además la suma de los pesos de las celdas
+    interiores de cada super-arista.
+    """
+
+    def __init__(self, width, height, occupied_cost=2.0, queue_cost=1.0, contracted=None):
+        """
+        Args:
+            width, height: Dimensiones del mapa
+            occupied_cost: Costo extra de entrar a una celda ocupada por un coche
+            queue_cost: Costo extra por cada coche bloqueado esperando entrar a la celda
+            contracted: ContractedGraph cuyas super-aristas se mantienen al día
+        """
+        self.width = width
+        self.height = height
+        self.occupied_cost = occupied_cost
+        self.queue_cost = queue_cost
+        self.contracted = None
+        self.reset()
+        self.attach(contracted)
+
+    def reset(self):
+        """Deja todas las celdas libres y sin cola."""
+        cells = self.width * self.height
+        self.occupied = [0] * cells
+        self.queue = [0] * cells
+        self.weights = [0.0] * cells
+        if self.contracted is not None:
+            self.edge_weights = [0.0] * self.contracted.edge_count
+
+    def attach(self, contracted):
+        """Usa otro grafo contraído (o ninguno) y recalcula los pesos de sus super-aristas."""
+        self.contracted = contracted
+        self.cell_edge = None
+        self.edge_weights = None
+        if contracted is None:
+            return
+        self.cell_edge = contracted.cell_edge.tolist()
+        self.edge_weights = [0.0] * contracted.edge_count
+        for index, weight in enumerate(self.weights):
+            edge = self.cell_edge[index]
+            if weight and edge >= 0:
+                self.edge_weights[edge] += weight
+
+    def _add_weight(self, index, cost):
+        self.weights[index] += cost
+        if self.cell_edge is not None:
+            edge = self.cell_edge[index]
+            if edge >= 0:
+                self.edge_weights[edge] += cost
+
+    def enter(self, pos):
+        index = pos[1] * self.width + pos[0]
+        self.occupied[index] += 1
+        self._add_weight(index, self.occupied_cost)
+
+    def leave(self, pos):
+        index = pos[1] * self.width + pos[0]
+        self.occupied[index] -= 1
+        self._add_weight(index, -self.occupied_cost)
+
+    def join_queue(self, pos):
+        index = pos[1] * self.width + pos[0]
+        self.queue[index] += 1
+        self._add_weight(index, self.queue_cost)
+
+    def leave_queue(self, pos):
+        index = pos[1] * self.width + pos[0]
+        self.queue[index] -= 1
+        self._add_weight(index, -self.queue_cost)
+
+    def edge_costs(self, path):
+        """Costo de cada arista de path: su largo más el peso de la celda a la que entra."""
+        width, weights = self.width, self.weights
+        return [
+            abs(b[0] - a[0]) + abs(b[1] - a[1]) + weights[b[1] * width + b[0]]
+            for a, b in zip(path, path[1:])
+        ]
+
+    def nbytes(self):
+        # Un apuntador por elemento; los enteros chicos son compartidos
+        lists = 4 if self.cell_edge is not None else 3
+        return lists * 8 * len(self.weights) + 8 * len(self.edge_weights or ())
+
+
+def astar_path(graph, start, destination, weights, width, avoid_node=None, hops=None):
+    """
+    A* con heurística Manhattan. Una arista cuesta su largo más el peso de la celda a la que
+    entra (weights, indexado por y * width + x), nunca menos que la distancia Manhattan que
+    avanza, así que la heurística es consistente.
+    hops, si se indica, es la fila de la tabla de distancias del destino (saltos sin
+    congestión): cada arista cuesta al menos un salto, así que el máximo de las dos cotas
+    también es consistente y, con poco tráfico, A* casi no se desvía de la ruta.
+    Regresa (ruta, costo de cada arista) o (None, None) si no hay ruta.
+    """
+    if start == destination:
+        return [start], []
+
+    goal_x, goal_y = destination
+    best = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+    heap = [(abs(start[0] - goal_x) + abs(start[1] - goal_y), 0.0, 0, start)]
+    pushed = 1  # Desempate por orden de llegada, para que el resultado no dependa de las tuplas
+    heappush, heappop, best_cost = heapq.heappush, heapq.heappop, best.get  # Búsquedas locales en el ciclo
+
+    while heap:
+        _, cost, _, node = heappop(heap)
+        if node in closed:
+            continue
+        if node == destination:
+            path = [node]
+            while parents[path[-1]] is not None:
+                path.append(parents[path[-1]])
+            path.reverse()
+            return path, [best[b] - best[a] for a, b in zip(path, path[1:])]
+        closed.add(node)
+
+        x, y = node
+        for neighbor in graph.get(node, ()):
+            if neighbor in closed or neighbor == avoid_node:
+                continue
+            nx, ny = neighbor
+            index = ny * width + nx
+            new_cost = cost + abs(nx - x) + abs(ny - y) + weights[index]
+            if new_cost < best_cost(neighbor, new_cost + 1):
+                best[neighbor] = new_cost
+                parents[neighbor] = node
+                estimate = abs(nx - goal_x) + abs(ny - goal_y)
+                if hops is not None:
+                    estimate = max(estimate, int(hops[index]))
+                heappush(heap, (new_cost + estimate, new_cost, pushed, neighbor))
+                pushed += 1
+
+    return None, None
+
+
+class Router:
+    """
+    Servicio de ruteo compartido por todos los coches del modelo.
+    Usa las tablas precalculadas cuando no hay nodo a evitar, una búsqueda en el grafo
+    contraído en otro caso, y guarda los resultados en un caché LRU acotado.
+    congested_path usa A* con pesos de congestión.
+    """
+
+    def __init__(self, graph, destinations, width, height, cache_size=4096, tables=None, keep=()):
+        """
+        Args:
+            graph: Lista de adyacencia {nodo: [vecinos]}
+            destinations: Lista de posiciones de destino
+            width, height: Dimensiones del mapa
+            cache_size: Número máximo de rutas guardadas en el caché
+            tables: (next_hop, distance) ya calculadas, para no recalcularlas
+            keep: Posiciones que son nodos del grafo contraído además de los destinos
+                (semáforos, esquinas)
+        """
+        self.graph = graph
+        self.destinations = destinations
+        self.width = width
+        self.height = height
+        self.keep = list(keep)
+        self.cache_size = cache_size
+        self._contracted = None
+        next_hop, distance = tables if tables is not None else (None, None)
+        self.tables = RoutingTables(
+            graph, destinations, width, height, next_hop=next_hop, distance=distance
+        )
+        self._cache = OrderedDict()  # {(inicio, destino, nodo evitado): ruta}
+
+        # Contadores del caché
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def contracted(self):
+        """Grafo contraído; se construye la primera vez que se necesita."""
+        if self._contracted is None:
+            self._contracted = ContractedGraph(
+                self.graph, self.width, self.height, keep=[*self.destinations, *self.keep]
+            )
+        return self._contracted
+
+    def _hops(self, destination):
+        d = self.tables.index.get(destination)
+        return self.tables.distance[d] if d is not None else None
+
+    def shortest_path(self, start, destination, avoid_node=None):
+        """
+        Regresa una copia de la ruta más corta de start a destination, o None si no existe.
+        La copia es necesaria porque los coches consumen su ruta con pop(0).
+        """
+        key = (start, destination, avoid_node)
+        if key in self._cache:
+            self.hits += 1
+            ROUTE_FROM_CACHE.inc()
+            self._cache.move_to_end(key)
+            path = self._cache[key]
+            return list(path) if path is not None else None
+
+        self.misses += 1
+        start_time = time.perf_counter()
+        if avoid_node is None and destination in self.tables.index:
+            path = self.tables.path(start, destination)
+            ROUTE_FROM_TABLE.inc()
+            ROUTE_TABLE_SECONDS.observe(time.perf_counter() - start_time)
+        elif destination in self.contracted.node_index:
+            path = self.contracted.search(start, destination, avoid_node, hops=self._hops(destination))
+            ROUTE_FROM_CONTRACTED.inc()
+            ROUTE_CONTRACTED_SECONDS.observe(time.perf_counter() - start_time)
+        else:
+            path = bfs_shortest_path(self.graph, start, destination, avoid_node)
+            ROUTE_FROM_BFS.inc()
+            ROUTE_BFS_SECONDS.observe(time.perf_counter() - start_time)
+
+        self._cache[key] = tuple(path) if path is not None else None
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+        return path
+
+    def congested_path(self, start, destination, field, avoid_node=None):
+        """
+        Ruta de menor costo con los pesos actuales de field (un CongestionField).
+        Regresa (ruta, costo de cada arista) o (None, None); no usa el caché.
+        """
+        start_time = time.perf_counter()
+        hops = self._hops(destination)
+        if field.contracted is not None and destination in field.contracted.node_index:
+            path = field.contracted.search(
+                start, destination, avoid_node, field.weights, field.edge_weights, hops
+            )
+            costs = field.edge_costs(path) if path is not None else None
+        else:
+            path, costs = astar_path(self.graph, start, destination, field.weights, field.width, avoid_node, hops)
+        ROUTE_FROM_ASTAR.inc()
+        ROUTE_ASTAR_SECONDS.observe(time.perf_counter() - start_time)
+        return path, costs
+
+    def invalidate(self):
+        """
+        Descarta las rutas guardadas y recalcula las tablas.
+        Debe llamarse cada vez que cambie el grafo o la lista de destinos.
+        """
+        self._cache.clear()
+        self._contracted = None
+        self.tables.rebuild(self.destinations)
+
+    def graph_info(self):
+        """Tamaño del grafo de celdas y del grafo contraído que usan las búsquedas."""
+        return self.contracted.info()
+
+    def cache_info(self):
+        """Regresa los contadores y el tamaño actual del caché."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+        }
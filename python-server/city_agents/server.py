@@ -4,6 +4,7 @@
 
 from agent import *
 from model import CityModel
+from citymap import *
 from mesa.visualization import CanvasGrid, ModularServer
 
 def agent_portrayal(agent):
@@ -15,31 +16,52 @@ def agent_portrayal(agent):
         "h": 1,
     }
 
-    if isinstance(agent, Road):
-        portrayal.update({"Color": "grey", "Layer": 0, "text": agent.direction, "text_color": "black"})
-    elif isinstance(agent, Destination):
-        portrayal.update({"Color": "lightgreen", "Layer": 0})
-    elif isinstance(agent, Traffic_Light):
-        portrayal.update({
-            "Color": "red" if not agent.state else "green",
-            "Layer": 0,
-            "w": 0.8,
-            "h": 0.8,
-        })
-    elif isinstance(agent, Obstacle):
-        portrayal.update({"Color": "cadetblue", "Layer": 0, "w": 0.8, "h": 0.8})
-    elif isinstance(agent, Car):
+    if isinstance(agent, Car):
         portrayal = {"Shape": "circle", "Color": "yellow", "Filled": "true", "Layer": 1, "r": 0.5}
 
     return portrayal
 
+def cell_portrayal(model, x, y):
+    """Portrayal de las celdas estáticas, que ya no son agentes."""
+    code = model.cell_type[y, x]
+    portrayal = {"Shape": "rect", "Filled": "true", "Layer": 0, "w": 1, "h": 1}
+
+    if code == CELL_ROAD:
+        directions = mask_to_directions(int(model.cell_directions[y, x]))
+        portrayal.update({"Color": "grey", "text": directions, "text_color": "black"})
+    elif code == CELL_DESTINATION:
+        portrayal.update({"Color": "lightgreen"})
+    elif code == CELL_OBSTACLE:
+        portrayal.update({"Color": "cadetblue", "w": 0.8, "h": 0.8})
+    elif code == CELL_TRAFFIC_LIGHT:
+        green = model.lights.is_green((x, y), model.step_count)
+        portrayal.update({"Color": "green" if green else "red", "w": 0.8, "h": 0.8})
+    else:
+        return None
+
+    return portrayal
+
+class StaticCanvasGrid(CanvasGrid):
+    """CanvasGrid que también dibuja el mapa estático del modelo."""
+
+    def render(self, model):
+        grid_state = super().render(model)
+        for y in range(model.height):
+            for x in range(model.width):
+                portrayal = cell_portrayal(model, x, y)
+                if portrayal:
+                    portrayal["x"] = x
+                    portrayal["y"] = y
+                    grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
 # Leer el archivo base solo una vez
 with open("../city_files/2024_base.txt") as baseFile:
     lines = baseFile.readlines()
     width = len(lines[0]) - 1
     height = len(lines)
 
-grid = CanvasGrid(agent_portrayal, width, height, 500, 500)
+grid = StaticCanvasGrid(agent_portrayal, width, height, 500, 500)
 
 server = ModularServer(CityModel, [grid], "Traffic Base")
 server.port = 8523
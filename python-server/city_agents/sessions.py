@@ -0,0 +1,221 @@
+# 17/10/2026
+# File with the simulation sessions of the city server
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import sys
+import threading
+import time
+import uuid
+
+from .frames import FrameHistory
+from .simthread import BackgroundSimulator
+
+
+class Session:
+    """
+    Una simulación independiente: modelo, historial de frames y candado propio.
+    """
+
+    def __init__(self, model):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.frames = FrameHistory(model)
+        self.lock = threading.RLock()  # Serializa solo las peticiones de esta sesión
+        self.current_step = 0
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.simulator = None  # BackgroundSimulator en modo de ejecución libre
+        self.simulator_lock = threading.Lock()  # Serializa el arranque y paro del simulador
+        self.forked_from = None  # Id de la sesión de la que se bifurcó, ver /fork
+        self.stream_viewers = 0  # Visores suscritos a /stream
+        self.stream_simulator = None  # Simulador que arrancó un visor de /stream
+
+    def start_simulator(self, lookahead=32, steps_per_second=None):
+        """Arranca (o reemplaza) el simulador en segundo plano de la sesión."""
+        with self.simulator_lock:
+            self._stop_simulator()
+            self.simulator = BackgroundSimulator(
+                self, lookahead=lookahead, steps_per_second=steps_per_second
+            ).start()
+            return self.simulator
+
+    def open_stream(self, lookahead=32, steps_per_second=None):
+        """Suscribe un visor de /stream: regresa el simulador activo, arrancándolo si no hay uno."""
+        with self.simulator_lock:
+            if self.simulator is None or self.simulator.done:
+                self._stop_simulator()
+                self.simulator = BackgroundSimulator(
+                    self, lookahead=lookahead, steps_per_second=steps_per_second
+                ).start()
+                self.stream_simulator = self.simulator
+            self.stream_viewers += 1
+            return self.simulator
+
+    def close_stream(self):
+        """
+        Da de baja un visor de /stream. Al irse el último, detiene el simulador si lo arrancó
+        un stream, para que /step y /update vuelvan a funcionar; uno arrancado con /run sigue.
+        """
+        with self.simulator_lock:
+            self.stream_viewers -= 1
+            if self.stream_viewers == 0:
+                if self.simulator is not None and self.simulator is self.stream_simulator:
+                    self._stop_simulator()
+                self.stream_simulator = None
+
+    @contextmanager
+    def stepping(self):
+        """
+        Candados para avanzar el modelo desde una petición (/step, /update). Da False si la sesión
+        corre en segundo plano; con True, ningún simulador puede arrancar hasta salir del bloque.
+        """
+        with self.simulator_lock:
+            if self.simulator is not None:
+                yield False
+                return
+            with self.lock:
+                yield True
+
+    def stop_simulator(self):
+        """Detiene el simulador en segundo plano, si existe."""
+        with self.simulator_lock:
+            self._stop_simulator()
+
+    def _stop_simulator(self):
+        if self.simulator is not None:
+            self.simulator.stop()
+            self.simulator = None
+
+    def close(self):
+        """Libera los recursos de la sesión al cerrarla o desalojarla."""
+        self.stop_simulator()
+        self.model.stop_recording()
+        self.model.tracer.close()
+
+    def touch(self):
+        """Marca la sesión como usada ahora."""
+        self.last_used = time.monotonic()
+
+    def memory_usage(self):
+        """Memoria aproximada de la sesión en bytes, separada por componente."""
+        usage = self.model.memory_usage()
+        usage["frames"] = sum(
+            sys.getsizeof(cars) + sys.getsizeof(lights) + 100 * len(cars)
+            for cars, lights in self.frames.frames.values()
+        )
+        # El mapa compilado se comparte entre sesiones, no cuenta en el total propio
+        usage["total"] = sum(v for k, v in usage.items() if k != "map_shared")
+        return usage
+
+    def info(self):
+        """Resumen de la sesión para el endpoint /sessions."""
+        now = time.monotonic()
+        return {
+            "session": self.id,
+            "step": self.model.step_count,
+            "cars": self.model.get_current_agents(),
+            "engine": self.model.engine,
+            "age_seconds": round(now - self.created, 1),
+            "idle_seconds": round(now - self.last_used, 1),
+            "memory": self.memory_usage(),
+            "simulator": self.simulator.info() if self.simulator is not None else None,
+            "forked_from": self.forked_from,
+        }
+
+
+class SessionRegistry:
+    """
+    Sesiones vivas, ordenadas de la menos a la más recientemente usada.
+    """
+
+    def __init__(self, max_sessions=8, idle_timeout=1800):
+        """
+        Args:
+            max_sessions: Máximo de sesiones vivas; al crear una más se desaloja la menos usada
+            idle_timeout: Segundos sin uso tras los que una sesión se desaloja
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()  # {id: Session}
+        self.lock = threading.Lock()  # Protege solo el diccionario de sesiones
+        self.evicted = 0
+
+    def create(self, model_factory, evict=True):
+        """
+        Crea el modelo con model_factory() y registra su sesión.
+        El modelo se construye fuera del candado para no bloquear a las demás sesiones.
+        """
+        return self.add(Session(model_factory()), evict)
+
+    def add(self, session, evict=True):
+        """
+        Registra una sesión ya construida. Con evict=False no desaloja a ninguna sesión activa:
+        si no hay lugar, cierra la nueva y regresa None.
+        """
+        with self.lock:
+            evicted = self._evict_idle()
+            if not evict and len(self.sessions) >= self.max_sessions:
+                evicted.append(session)
+                session = None
+            else:
+                while len(self.sessions) >= self.max_sessions:
+                    evicted.append(self.sessions.popitem(last=False)[1])
+                    self.evicted += 1
+                self.sessions[session.id] = session
+        self._close(evicted)
+        return session
+
+    def free_slots(self):
+        """Sesiones que se pueden crear sin desalojar a otra activa."""
+        with self.lock:
+            evicted = self._evict_idle()
+            free = self.max_sessions - len(self.sessions)
+        self._close(evicted)
+        return free
+
+    def get(self, session_id):
+        """Regresa la sesión y la marca como usada, o None si no existe o ya fue desalojada."""
+        with self.lock:
+            evicted = self._evict_idle()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.touch()
+                self.sessions.move_to_end(session_id)
+        self._close(evicted)
+        return session
+
+    def remove(self, session_id):
+        """Cierra una sesión. Regresa True si existía."""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def list(self):
+        """Lista de las sesiones vivas."""
+        with self.lock:
+            return list(self.sessions.values())
+
+    def _evict_idle(self):
+        """
+        Quita las sesiones sin uso por más de idle_timeout segundos y las regresa.
+        Se llama con el candado tomado; las sesiones se cierran después con _close.
+        """
+        evicted = []
+        now = time.monotonic()
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if now - oldest.last_used <= self.idle_timeout:
+                break
+            evicted.append(self.sessions.popitem(last=False)[1])
+            self.evicted += 1
+        return evicted
+
+    @staticmethod
+    def _close(sessions):
+        """Cierra sesiones desalojadas (o rechazadas) sin el candado: detener un simulador puede esperar a su hilo."""
+        for session in sessions:
+            session.close()
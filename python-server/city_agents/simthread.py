@@ -0,0 +1,187 @@
+# 17/10/2026
+# File with the background simulator of a session
+
+from collections import deque
+import threading
+import time
+
+from .frames import build_frame, snapshot
+
+
+class BackgroundSimulator:
+    """
+    Hilo que avanza el modelo de una sesión hasta lookahead pasos por delante del último
+    frame leído y guarda los snapshots en un buffer circular.
+    """
+
+    def __init__(self, session, lookahead=32, steps_per_second=None, capacity=None):
+        """
+        Args:
+            session: Session cuyo modelo se avanza (se usa su candado en cada paso)
+            lookahead: Pasos que el hilo puede adelantarse al último frame leído
+            steps_per_second: Ritmo máximo de la simulación; None la deja correr sin límite
+            capacity: Frames guardados en el buffer; por defecto 2 * lookahead + 16, para
+                que el paso que ya tiene un cliente siga disponible para calcular el delta
+        """
+        self.session = session
+        self.lookahead = max(1, int(lookahead))
+        self.steps_per_second = steps_per_second
+        self.capacity = capacity or 2 * self.lookahead + 16
+        self.buffer = deque(maxlen=self.capacity)  # [(paso, coches, semáforos)]
+        self.read_step = -1  # Último paso entregado a algún cliente
+        self.finished = False  # El modelo terminó (model.running es False)
+
+        # Protege solo el buffer y read_step; nunca se toma mientras se calcula un paso
+        self.condition = threading.Condition()
+        self.running = threading.Event()
+        self.running.set()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name=f"simulator-{session.id[:8]}", daemon=True
+        )
+
+        # Contadores
+        self.steps = 0
+        self.step_seconds = 0.0
+
+    def start(self):
+        """Guarda el frame actual y arranca el hilo."""
+        with self.session.lock:
+            self._push(self.session.model.step_count, *snapshot(self.session.model))
+        self.thread.start()
+        return self
+
+    def pause(self):
+        """Detiene el avance del modelo; los frames ya calculados se siguen sirviendo."""
+        self.running.clear()
+
+    def resume(self):
+        """Reanuda el avance del modelo."""
+        self.running.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def stop(self, timeout=1.0):
+        """Termina el hilo y espera a que suelte el modelo."""
+        self.stopped.set()
+        self.running.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    @property
+    def latest_step(self):
+        """Último paso calculado, o -1 si el buffer está vacío."""
+        return self.buffer[-1][0] if self.buffer else -1
+
+    def _push(self, step, cars, lights):
+        with self.condition:
+            self.buffer.append((step, cars, lights))
+            self.condition.notify_all()
+
+    def _wait_for_reader(self):
+        """Espera mientras el hilo vaya lookahead pasos por delante del último frame leído."""
+        with self.condition:
+            while (
+                not self.stopped.is_set()
+                and self.latest_step - self.read_step >= self.lookahead
+            ):
+                self.condition.wait(0.5)
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self.stopped.is_set():
+            self.running.wait()
+            self._wait_for_reader()
+            if self.stopped.is_set():
+                break
+
+            if self.steps_per_second:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    self.stopped.wait(delay)
+                    continue
+                next_time = max(next_time, time.monotonic() - 1.0) + 1.0 / self.steps_per_second
+
+            model = self.session.model
+            start = time.perf_counter()
+            with self.session.lock:
+                if not model.running:
+                    self.finished = True
+                    break
+                model.step()
+                step = model.step_count
+                self.session.current_step += 1
+                cars, lights = snapshot(model)
+            self.step_seconds += time.perf_counter() - start
+            self.steps += 1
+            self._push(step, cars, lights)
+
+        with self.condition:
+            self.condition.notify_all()
+
+    def frame(self, ack=None, full=False, wait=0.0, latest=False):
+        """
+        Primer frame posterior a ack que ya está en el buffer, como delta respecto a ack.
+        Sin ack regresa el frame más reciente completo. Si todavía no hay un frame nuevo
+        espera hasta wait segundos y regresa None si no llegó; nunca avanza el modelo.
+        Con latest=True salta los frames intermedios y regresa el más reciente como delta
+        respecto a ack, para los clientes que no alcanzan el ritmo de la simulación.
+        """
+        deadline = time.monotonic() + wait
+        with self.condition:
+            while True:
+                entry, base = self._find(ack, latest)
+                if entry is not None or self.done:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            if entry is None:
+                return None
+            step, cars, lights = entry
+            if step > self.read_step:
+                self.read_step = step
+                self.condition.notify_all()
+
+        return build_frame(step, cars, lights, None if full else base)
+
+    def _find(self, ack, latest=False):
+        """Regresa (frame a enviar, estado base del cliente) o (None, None)."""
+        if not self.buffer:
+            return None, None
+        if ack is None:
+            return self.buffer[-1], None
+
+        if ack >= self.latest_step:
+            return None, None
+        oldest = self.buffer[0][0]
+        if ack < oldest:
+            # El paso del cliente ya salió del buffer: recibe el frame más reciente completo
+            return self.buffer[-1], None
+
+        # Los pasos del buffer son consecutivos
+        position = ack - oldest
+        entry = self.buffer[-1] if latest else self.buffer[position + 1]
+        return entry, self.buffer[position][1:]
+
+    @property
+    def done(self):
+        """True si el hilo ya no va a producir más frames."""
+        return self.finished or self.stopped.is_set()
+
+    def info(self):
+        """Estado del simulador para los endpoints."""
+        return {
+            "running": self.running.is_set() and not self.done,
+            "finished": self.finished,
+            "latest_step": self.latest_step,
+            "read_step": self.read_step,
+            "buffered": len(self.buffer),
+            "lookahead": self.lookahead,
+            "steps_per_second": self.steps_per_second,
+            "mean_step_ms": round(1000 * self.step_seconds / self.steps, 3) if self.steps else None,
+        }
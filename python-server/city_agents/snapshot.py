@@ -0,0 +1,476 @@
+# 17/10/2026
+# File with the binary snapshots of the city model
+
+from collections import deque
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+from .agent import Car
+from .citymap import DEFAULT_DICTIONARY, MAP_FILES, allowed_map_path, resolve_map_path, source_hash
+from .engine import DIRECTION_CODES, DIRECTIONS, NO_DIRECTION
+from .model import CityModel
+
+SNAPSHOT_VERSION = 3
+MAGIC = b"CITYSNP\0"
+MIME_TYPE = "application/octet-stream"
+
+
+def _pack(header, arrays):
+    """MAGIC, largo del encabezado (uint32), encabezado JSON y los arreglos uno tras otro."""
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+    header["arrays"] = layout
+    header_bytes = json.dumps(header).encode()
+    parts = [MAGIC, struct.pack("<I", len(header_bytes)), header_bytes]
+    parts.extend(np.ascontiguousarray(array).tobytes() for array in arrays.values())
+    return b"".join(parts)
+
+
+def _unpack(data):
+    """
+    Regresa (encabezado, arreglos); los arreglos son copias que se pueden modificar.
+    Lanza ValueError si los datos están cortados o el encabezado describe arreglos fuera de ellos.
+    """
+    data = memoryview(data)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Los datos no son un snapshot del modelo")
+    start = len(MAGIC) + 4
+    try:
+        (header_length,) = struct.unpack_from("<I", data, len(MAGIC))
+        header = json.loads(bytes(data[start:start + header_length]))
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError(f"Encabezado de snapshot inválido: {error}") from error
+    if not isinstance(header, dict) or not isinstance(header.get("arrays"), dict):
+        raise ValueError("Encabezado de snapshot inválido")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot de la versión {header.get('version')}, se esperaba {SNAPSHOT_VERSION}")
+
+    body = start + header_length
+    arrays = {}
+    for name, layout in header["arrays"].items():
+        try:
+            dtype, shape, offset = layout
+            dtype = np.dtype(dtype)
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"Arreglo {name} inválido en el snapshot") from error
+        if (
+            dtype.kind not in "biuf"
+            or not isinstance(shape, list)
+            or not all(isinstance(size, int) and size >= 0 for size in shape)
+            or not isinstance(offset, int)
+            or offset < 0
+        ):
+            raise ValueError(f"Arreglo {name} inválido en el snapshot")
+        count = math.prod(shape)
+        # Cada arreglo tiene que caber en los datos: un encabezado no puede pedir más memoria que esa
+        if body + offset + count * dtype.itemsize > len(data):
+            raise ValueError(f"El arreglo {name} no cabe en el snapshot")
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=body + offset).reshape(shape).copy()
+    return header, arrays
+
+
+def _check(condition, message):
+    if not condition:
+        raise ValueError(f"Snapshot inválido: {message}")
+
+
+def _check_range(arrays, names, low, high, length=None):
+    """Comprueba que los arreglos sean vectores (de largo length, si se indica) con valores en [low, high)."""
+    for name in names:
+        array = arrays[name]
+        _check(array.ndim == 1 and (length is None or len(array) == length), f"{name} tiene otra forma")
+        _check(not len(array) or (array.min() >= low and array.max() < high), f"{name} fuera de rango")
+
+
+def _check_lists(arrays, offsets_name, values_name, count, low, high):
+    """Comprueba una lista empacada por _pack_lists: count listas con valores en [low, high)."""
+    offsets = arrays[offsets_name]
+    _check_range(arrays, [values_name], low, high)
+    _check(
+        offsets.ndim == 1 and len(offsets) == count + 1 and offsets[0] == 0
+        and bool(np.all(np.diff(offsets) >= 0)) and offsets[-1] == len(arrays[values_name]),
+        f"{offsets_name} no corresponde a {values_name}",
+    )
+
+
+def _check_header(header):
+    """Comprueba los tipos y valores de los parámetros y contadores del encabezado."""
+    _check(header.get("engine") in ("agents", "numpy"), "engine")
+    _check(header.get("activation", "random") in ("random", "event"), "activation")
+    _check(header.get("routing", "shortest") in ("shortest", "congestion"), "routing")
+    _check(isinstance(header.get("reroute_threshold", 2.0), (int, float)), "reroute_threshold")
+    _check(isinstance(header.get("spawn_interval"), int) and header["spawn_interval"] > 0, "spawn_interval")
+    for name in ("step_count", "spawned_agents", "agents_reached_destination", "mesa_steps", "schedule_steps"):
+        _check(isinstance(header.get(name), int) and header[name] >= 0, name)
+    for name in ("mesa_time", "schedule_time"):
+        _check(isinstance(header.get(name), (int, float)), name)
+    _check(isinstance(header.get("running"), bool), "running")
+    random_state = header.get("random")
+    _check(
+        isinstance(random_state, list) and len(random_state) == 2 and isinstance(random_state[0], int)
+        and (random_state[1] is None or isinstance(random_state[1], float)),
+        "random",
+    )
+    totals = header.get("metrics")
+    _check(
+        totals is None or (isinstance(totals, dict) and all(isinstance(value, int) for value in totals.values())),
+        "metrics",
+    )
+
+
+def _check_arrays(header, arrays, model):
+    """
+    Comprueba los arreglos de un snapshot contra el mapa antes de modificar el modelo: formas
+    de los arreglos, celdas, destinos y direcciones dentro del mapa, y la capacidad del motor acotada.
+    """
+    lights = model.lights
+    for name, table in (("light_initial", lights.initial), ("light_group_period", lights.period),
+                        ("light_group_offset", lights.offset)):
+        _check(arrays[name].shape == table.shape, name)
+    store = model.metrics_store
+    for prefix, table in (("metrics_step_", store.steps), ("metrics_trip_", store.trips)):
+        columns = [arrays[prefix + name] for name, _ in table.schema]
+        _check(all(column.ndim == 1 and len(column) == len(columns[0]) for column in columns), prefix[:-1])
+
+    engine = model.car_engine
+    cells = model.width * model.height
+    destinations = len(model.destinations)
+    saved = header["cars"]
+    _check(isinstance(saved, dict), "cars")
+    if engine is not None:
+        capacity = saved["capacity"]
+        # El motor duplica su capacidad al llenarse y nunca tiene más coches que celdas
+        _check(isinstance(capacity, int) and 0 <= capacity <= max(engine.capacity, 2 * cells), "capacity")
+        _check(isinstance(saved["count"], int) and 0 <= saved["count"] <= capacity, "count")
+        _check_range(arrays, ["alive", "car_id", "spawn_step", "moves", "reroutes"], 0, np.inf, capacity)
+        _check_range(arrays, ["inactive_steps", "steps_waited", "route_index"], 0, np.inf, capacity)
+        alive = arrays["alive"].astype(bool)
+        _check_range(arrays, ["position"], -1, cells, capacity)
+        _check_range(arrays, ["destination"], 0, max(destinations, 1), capacity)
+        _check_range(arrays, ["direction"], NO_DIRECTION, len(DIRECTIONS), capacity)
+        _check(bool(np.all(arrays["position"][alive] >= 0)), "position")
+        _check_range(arrays, ["free_slots", "detour_slots"], 0, capacity)
+        _check_lists(arrays, "detour_offsets", "detour_cells", len(arrays["detour_slots"]), 0, cells)
+        return
+
+    count = len(arrays["car_id"])
+    _check(saved.get("count", count) == count, "count")
+    _check_range(arrays, ["car_id", "spawn_step", "moves", "reroutes"], 0, np.inf, count)
+    _check_range(arrays, ["inactive_steps", "steps_waited"], 0, np.inf, count)
+    _check_range(arrays, ["position"], 0, cells, count)
+    _check_range(arrays, ["blocked_node"], -1, cells, count)
+    _check_range(arrays, ["destination"], -1, destinations, count)
+    _check_range(arrays, ["direction"], NO_DIRECTION, len(DIRECTIONS), count)
+    _check_lists(arrays, "path_offsets", "path_cells", count, -1, cells)
+    _check_lists(arrays, "previous_offsets", "previous_cells", count, -1, cells)
+    if model.congestion is not None:
+        _check_lists(arrays, "path_cost_offsets", "path_cost_values", count, -np.inf, np.inf)
+        _check_range(arrays, ["queued_at"], -1, cells, count)
+    if model.activation == "event":
+        _check_range(arrays, ["parked_cell"], -1, cells, count)
+        _check_range(arrays, ["parked_until"], -1, np.inf, count)
+
+
+def _pack_lists(lists, dtype=np.int32):
+    """Empaca una lista de secuencias de enteros como (offsets, valores)."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.fromiter((v for values in lists for v in values), dtype=dtype, count=int(offsets[-1]))
+    return offsets, values
+
+
+def _unpack_lists(offsets, values):
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def take_snapshot(model):
+    """
+    Serializa el estado completo de un CityModel y lo regresa como bytes.
+    Llamar con el modelo detenido (por ejemplo, con el candado de su sesión tomado).
+    """
+    width = model.width
+    version, state, gauss_next = model.random.getstate()
+    store = model.metrics_store
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "engine": model.engine,
+        "activation": model.activation,
+        "routing": model.routing,
+        "reroute_threshold": model.reroute_threshold,
+        "map_file": str(model.map_file),
+        "dictionary_file": str(model.dictionary_file),
+        "source_hash": model.city_map.source_hash,
+        "spawn_interval": model.spawn_interval,
+        "step_count": model.step_count,
+        "spawned_agents": model.spawned_agents,
+        "agents_reached_destination": model.agents_reached_destination,
+        "running": model.running,
+        "mesa_steps": model._steps,
+        "mesa_time": model._time,
+        "schedule_steps": model.schedule.steps,
+        "schedule_time": model.schedule.time,
+        "random": [version, gauss_next],
+        "metrics": store.totals(),
+    }
+    lights = model.lights
+    arrays = {
+        "random_state": np.array(state, dtype=np.uint32),
+        "light_initial": lights.initial,
+        "light_group_period": lights.period,
+        "light_group_offset": lights.offset,
+    }
+    # Filas del almacén de métricas que siguen en memoria (las exportadas ya están en su archivo);
+    # el encabezado guarda los totales y las sumas de todos los viajes
+    for prefix, table in (("metrics_step_", store.steps), ("metrics_trip_", store.trips)):
+        for name, _ in table.schema:
+            arrays[prefix + name] = table.column(name)
+
+    engine = model.car_engine
+    if engine is not None:
+        capacity = engine.capacity
+        header["cars"] = {
+            "count": engine.count,
+            "arrived": engine.arrived,
+            "capacity": capacity,
+            "rng": engine.rng.bit_generator.state,
+        }
+        detour_slots = sorted(engine.detours)
+        detour_offsets, detour_cells = _pack_lists([engine.detours[slot] for slot in detour_slots])
+        arrays.update({
+            "alive": engine.alive[:capacity],
+            "car_id": engine.car_id[:capacity],
+            "position": engine.position[:capacity],
+            "destination": engine.destination[:capacity],
+            "direction": engine.direction[:capacity],
+            "inactive_steps": engine.inactive_steps[:capacity],
+            "steps_waited": engine.steps_waited[:capacity],
+            "route_index": engine.route_index[:capacity],
+            "spawn_step": engine.spawn_step[:capacity],
+            "moves": engine.moves[:capacity],
+            "reroutes": engine.reroutes[:capacity],
+            "free_slots": np.array(engine.free_slots, dtype=np.int32),
+            "detour_slots": np.array(detour_slots, dtype=np.int32),
+            "detour_offsets": detour_offsets,
+            "detour_cells": detour_cells,
+        })
+        return _pack(header, arrays)
+
+    # Coches de Mesa, en el orden del schedule: RandomActivation deja el orden barajado del
+    # último paso y el siguiente paso baraja desde ahí. EventActivation baraja los activos en
+    # su orden de llegada y despierta a los estacionados en el orden en que empezaron a esperar
+    schedule = model.schedule
+    if model.activation == "event":
+        cars = list(schedule.active) + list(schedule.parked)
+        header["lights_checked"] = schedule.lights_version == model.lights.version
+    else:
+        cars = list(schedule.agents)
+    destination_index = {pos: i for i, pos in enumerate(model.destinations)}
+
+    def cell(pos):
+        return -1 if pos is None else pos[1] * width + pos[0]
+
+    path_offsets, path_cells = _pack_lists([[cell(pos) for pos in car.path or []] for car in cars])
+    previous_offsets, previous_cells = _pack_lists([[cell(pos) for pos in car.previous_positions] for car in cars])
+    header["cars"] = {"count": len(cars)}
+    arrays.update({
+        "car_id": np.array([car.number for car in cars], dtype=np.int64),
+        "position": np.array([cell(car.pos) for car in cars], dtype=np.int32),
+        "destination": np.array([destination_index.get(car.destination, -1) for car in cars], dtype=np.int32),
+        "direction": np.array([DIRECTION_CODES.get(car.direction, NO_DIRECTION) for car in cars], dtype=np.int8),
+        "inactive_steps": np.array([car.inactive_steps for car in cars], dtype=np.int32),
+        "steps_waited": np.array([car.steps_waited for car in cars], dtype=np.int32),
+        "spawn_step": np.array([car.spawn_step for car in cars], dtype=np.int64),
+        "moves": np.array([car.moves for car in cars], dtype=np.int32),
+        "reroutes": np.array([car.reroutes for car in cars], dtype=np.int32),
+        "blocked_node": np.array([cell(car.blocked_node) for car in cars], dtype=np.int32),
+        "path_offsets": path_offsets,
+        "path_cells": path_cells,
+        "previous_offsets": previous_offsets,
+        "previous_cells": previous_cells,
+    })
+    if model.congestion is not None:
+        cost_offsets, cost_values = _pack_lists([car.path_costs for car in cars], dtype=np.float64)
+        arrays["path_cost_offsets"] = cost_offsets
+        arrays["path_cost_values"] = cost_values
+        arrays["queued_at"] = np.array([cell(car.queued_at) for car in cars], dtype=np.int32)
+    if model.activation == "event":
+        parked = [schedule.parked.get(car) for car in cars]
+        arrays["parked_cell"] = np.array([cell(p[0]) if p else -1 for p in parked], dtype=np.int32)
+        arrays["parked_until"] = np.array(
+            [-1 if p is None or p[1] is None else p[1] for p in parked], dtype=np.int64
+        )
+    return _pack(header, arrays)
+
+
+def _snapshot_map(header, map_dir=None):
+    """
+    Rutas del mapa y del diccionario de un snapshot, comprobadas antes de abrir nada.
+    Con map_dir (snapshots enviados por clientes remotos) el mapa tiene que ser uno incluido o
+    estar dentro de map_dir, y el diccionario el de siempre, como en allowed_map_path.
+    Después se compara el hash de su contenido con el del snapshot.
+    """
+    map_file = str(header["map_file"])
+    dictionary_file = str(header["dictionary_file"])
+    if map_dir is None:
+        map_path = resolve_map_path(map_file)
+    else:
+        bundled = {path: year for year, path in MAP_FILES.items()}
+        name = map_file if map_file in MAP_FILES else bundled.get(map_file, os.path.basename(map_file))
+        try:
+            map_path = allowed_map_path(name, map_dir)
+        except ValueError:
+            map_path = None
+        if map_path is None or os.path.normpath(MAP_FILES.get(map_file, map_file)) != os.path.normpath(map_path):
+            raise ValueError(f"Mapa no permitido: {map_file}")
+        if os.path.normpath(dictionary_file) != os.path.normpath(DEFAULT_DICTIONARY):
+            raise ValueError(f"Diccionario no permitido: {dictionary_file}")
+    if source_hash(map_path, dictionary_file) != header["source_hash"]:
+        raise ValueError(f"El mapa {map_file} cambió desde que se tomó el snapshot")
+    return map_path, dictionary_file
+
+
+def restore_snapshot(data, tracer=None, seed=None, spawn_interval=None, light_period=None, map_dir=None):
+    """
+    Crea un CityModel nuevo con el estado guardado en un snapshot.
+    Args:
+        data: Bytes de take_snapshot
+        tracer: Tracer del modelo restaurado
+        seed: Si se indica, el generador aleatorio se vuelve a sembrar (la rama diverge del original)
+        spawn_interval: Si se indica, reemplaza el intervalo de generación de coches
+        light_period: Si se indica, todos los semáforos cambian cada light_period pasos
+        map_dir: Si se indica, solo se aceptan mapas incluidos o dentro de esta carpeta (ver _snapshot_map)
+    """
+    header, arrays = _unpack(data)
+    map_path, dictionary_file = _snapshot_map(header, map_dir)
+    _check_header(header)
+    model = CityModel(
+        engine=header["engine"],
+        map_file=map_path,
+        dictionary_file=dictionary_file,
+        spawn_interval=header["spawn_interval"],
+        activation=header.get("activation", "random"),
+        routing=header.get("routing", "shortest"),
+        reroute_threshold=header.get("reroute_threshold", 2.0),
+        tracer=tracer,
+    )
+    _check_arrays(header, arrays, model)
+
+    # Quitar los coches que generó el constructor
+    for car in [agent for agent in model.schedule.agents if isinstance(agent, Car)]:
+        model.grid.remove_agent(car)
+        model.schedule.remove(car)
+        car.remove()
+
+    model.step_count = header["step_count"]
+    model.spawned_agents = header["spawned_agents"]
+    model.agents_reached_destination = header["agents_reached_destination"]
+    model.running = header["running"]
+    model._steps = header["mesa_steps"]
+    model._time = header["mesa_time"]
+    model.schedule.steps = header["schedule_steps"]
+    model.schedule.time = header["schedule_time"]
+    version, gauss_next = header["random"]
+    model.random.setstate((version, tuple(arrays["random_state"].tolist()), gauss_next))
+    model.metrics_store.load(
+        {name: arrays["metrics_step_" + name] for name, _ in model.metrics_store.steps.schema},
+        {name: arrays["metrics_trip_" + name] for name, _ in model.metrics_store.trips.schema},
+        header.get("metrics"),
+    )
+    model.lights.initial[:] = arrays["light_initial"]
+    model.lights.period[:] = arrays["light_group_period"]
+    model.lights.offset[:] = arrays["light_group_offset"]
+
+    width = model.width
+    saved = header["cars"]
+    engine = model.car_engine
+    if engine is not None:
+        capacity = saved["capacity"]
+        if engine.capacity < capacity:
+            engine._grow(capacity)
+        for name in ("alive", "car_id", "position", "destination", "direction",
+                     "inactive_steps", "steps_waited", "route_index", "spawn_step", "moves", "reroutes"):
+            getattr(engine, name)[:capacity] = arrays[name]
+        engine.free_slots = arrays["free_slots"].tolist()
+        engine.detours = dict(zip(
+            arrays["detour_slots"].tolist(),
+            _unpack_lists(arrays["detour_offsets"], arrays["detour_cells"]),
+        ))
+        engine.occupancy[:] = -1
+        slots = np.flatnonzero(engine.alive)
+        engine.occupancy[engine.position[slots]] = slots
+        engine.count = saved["count"]
+        engine.arrived = saved["arrived"]
+        engine.rng.bit_generator.state = saved["rng"]
+        engine.red_step = None
+    else:
+        def pos(cell):
+            return None if cell < 0 else (cell % width, cell // width)
+
+        paths = _unpack_lists(arrays["path_offsets"], arrays["path_cells"])
+        previous = _unpack_lists(arrays["previous_offsets"], arrays["previous_cells"])
+        cars = []
+        for i, number in enumerate(arrays["car_id"].tolist()):
+            car = Car(f"car_{number}", model)
+            destination = int(arrays["destination"][i])
+            direction = int(arrays["direction"][i])
+            car.destination = model.destinations[destination] if destination >= 0 else None
+            car.direction = DIRECTIONS[direction] if direction != NO_DIRECTION else None
+            car.inactive_steps = int(arrays["inactive_steps"][i])
+            car.steps_waited = int(arrays["steps_waited"][i])
+            car.spawn_step = int(arrays["spawn_step"][i])
+            car.moves = int(arrays["moves"][i])
+            car.reroutes = int(arrays["reroutes"][i])
+            car.blocked_node = pos(int(arrays["blocked_node"][i]))
+            car.path = [pos(cell) for cell in paths[i].tolist()]
+            car.previous_positions = deque((pos(cell) for cell in previous[i].tolist()), maxlen=5)
+            model.grid.place_agent(car, pos(int(arrays["position"][i])))
+            model.schedule.add(car)  # Mismo orden del schedule que el modelo original
+            cars.append(car)
+        if model.congestion is not None:
+            # El campo de congestión se reconstruye con las posiciones y colas de los coches
+            model.congestion.reset()
+            costs = _unpack_lists(arrays["path_cost_offsets"], arrays["path_cost_values"])
+            for car, car_costs, queued_at in zip(cars, costs, arrays["queued_at"].tolist()):
+                car.path_costs = car_costs.tolist()
+                model.congestion.enter(car.pos)
+                if queued_at >= 0:
+                    car.join_queue(pos(queued_at))
+        if model.activation == "event":
+            schedule = model.schedule
+            for car, parked_cell, until in zip(
+                cars, arrays["parked_cell"].tolist(), arrays["parked_until"].tolist()
+            ):
+                if parked_cell >= 0:
+                    schedule._park(car, pos(parked_cell), None if until < 0 else until)
+            if header["lights_checked"]:
+                schedule.lights_version = model.lights.version
+
+    # Parámetros de la rama
+    if spawn_interval is not None:
+        model.spawn_interval = spawn_interval
+    if light_period is not None:
+        model.lights.set_phase(model.step_count, period=light_period)
+    if seed is not None:
+        model.reset_randomizer(seed)
+        if engine is not None:
+            engine.rng = np.random.default_rng(model.random.getrandbits(64))
+    return model
+
+
+def save_snapshot(model, path):
+    """Guarda el snapshot del modelo en un archivo."""
+    with open(path, "wb") as file:
+        file.write(take_snapshot(model))
+
+
+def load_snapshot(path, **options):
+    """Restaura un modelo desde un archivo de save_snapshot; options van a restore_snapshot."""
+    with open(path, "rb") as file:
+        return restore_snapshot(file.read(), **options)
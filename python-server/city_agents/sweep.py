@@ -0,0 +1,122 @@
+# 17/10/2026
+# File with the batch experiment runner of the city simulation
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import json
+import os
+import traceback
+
+from .citymap import load_map
+from .headless import run_simulation
+
+
+def run_key(map_file, spawn_interval, light_period, seed, steps, engine):
+    """Identificador estable de una corrida, usado para reanudar el barrido."""
+    period = "map" if light_period is None else light_period
+    return f"map={map_file}|spawn={spawn_interval}|light={period}|seed={seed}|steps={steps}|engine={engine}"
+
+
+def expand_runs(maps, spawn_intervals, light_periods, seeds, steps=1000, engine="agents"):
+    """Lista de corridas (diccionarios de parámetros) del producto de todos los valores."""
+    return [
+        {
+            "run": run_key(map_file, spawn_interval, light_period, seed, steps, engine),
+            "map_file": map_file,
+            "spawn_interval": spawn_interval,
+            "light_period": light_period,
+            "seed": seed,
+            "steps": steps,
+            "engine": engine,
+        }
+        for map_file, spawn_interval, light_period, seed in itertools.product(
+            maps, spawn_intervals, light_periods, seeds
+        )
+    ]
+
+
+def completed_runs(results_path):
+    """Identificadores de las corridas que ya están en el archivo de resultados."""
+    done = set()
+    if not os.path.isfile(results_path):
+        return done
+    with open(results_path) as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # Línea cortada por una interrupción: la corrida se repite
+            if "error" not in result:
+                done.add(result["run"])
+    return done
+
+
+def _run_one(run):
+    """Corre una simulación en un proceso del pool. Los errores se regresan como resultado."""
+    try:
+        summary = run_simulation(
+            map_file=run["map_file"],
+            steps=run["steps"],
+            seed=run["seed"],
+            spawn_interval=run["spawn_interval"],
+            light_period=run["light_period"],
+            engine=run["engine"],
+        )
+    except Exception:
+        return {"run": run["run"], "error": traceback.format_exc()}
+    summary["run"] = run["run"]
+    return summary
+
+
+def run_sweep(
+    results_path,
+    maps=("2021", "2022", "2023", "2024"),
+    spawn_intervals=(10,),
+    light_periods=(None,),
+    seeds=range(10),
+    steps=1000,
+    engine="agents",
+    workers=None,
+    progress=None,
+):
+    """
+    Corre el barrido y agrega cada resultado al archivo results_path (JSON Lines).
+    Args:
+        results_path: Archivo de resultados; las corridas que ya tiene no se repiten
+        maps, spawn_intervals, light_periods, seeds: Valores a combinar
+        steps: Pasos por corrida
+        engine: "agents" o "numpy"
+        workers: Procesos del pool (None usa el número de CPUs)
+        progress: Función opcional llamada con (terminadas, total, resultado)
+    Regresa (corridas ejecutadas, corridas con error).
+    """
+    runs = expand_runs(maps, spawn_intervals, light_periods, seeds, steps, engine)
+    done = completed_runs(results_path)
+    pending = [run for run in runs if run["run"] not in done]
+
+    # Compilar cada mapa una sola vez; los procesos abren el archivo del caché
+    for map_file in maps:
+        load_map(map_file)
+
+    failed = 0
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        with open(results_path, "a+b") as results:
+            # Una línea cortada al final del archivo se termina para no pegarle el siguiente resultado
+            if results.tell() > 0:
+                results.seek(-1, os.SEEK_END)
+                if results.read(1) != b"\n":
+                    results.write(b"\n")
+            futures = [pool.submit(_run_one, run) for run in pending]
+            for finished, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                failed += "error" in result
+                results.write(json.dumps(result).encode() + b"\n")
+                results.flush()
+                if progress is not None:
+                    progress(len(done) + finished, len(runs), result)
+    finally:
+        # Si se interrumpe, las corridas pendientes se descartan y se retoman en la siguiente ejecución
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return len(pending), failed
@@ -0,0 +1,177 @@
+# 17/10/2026
+# File with the event trace of the city simulation
+
+from collections import deque
+import json
+import struct
+
+from .engine import DIRECTIONS
+
+# Niveles, con los mismos valores que el módulo logging
+DEBUG = 10
+INFO = 20
+LEVELS = {"debug": DEBUG, "info": INFO}
+
+# Categorías que se pueden activar por separado
+CATEGORIES = ("route", "move", "block", "lane", "light", "arrival", "step")
+
+# Códigos de evento: (categoría, nivel, plantilla)
+# En la plantilla, car es el número del coche (car_N), a-d los argumentos y dir el nombre
+# de la dirección con código a
+ROUTE_NO_DESTINATION = 1
+ROUTE_SEARCH = 2
+ROUTE_FOUND = 3
+ROUTE_NOT_FOUND = 4
+DIRECTION_CHANGED = 5
+ARRIVED = 6
+NO_ROUTE = 7
+CELL_CONTENTS = 8
+BLOCKED = 9
+LANE_CHANGE = 10
+LANE_REJECTED = 11
+REROUTE = 12
+RED_LIGHT = 13
+MOVE = 14
+STEP = 15
+CONGESTION_REROUTE = 16
+
+EVENTS = {
+    ROUTE_NO_DESTINATION: ("route", INFO, "Coche car_{car} no tiene destino asignado."),
+    ROUTE_SEARCH: ("route", DEBUG, "Coche car_{car} buscando la ruta más corta de ({a}, {b}) a ({c}, {d})."),
+    ROUTE_FOUND: ("route", DEBUG, "Coche car_{car} calculó una ruta de {a} nodos hacia ({b}, {c})."),
+    ROUTE_NOT_FOUND: ("route", INFO, "Coche car_{car} no encontró un camino a ({a}, {b})."),
+    DIRECTION_CHANGED: ("move", DEBUG, "Coche car_{car} cambió dirección a {dir}."),
+    ARRIVED: ("arrival", INFO, "Coche car_{car} ha llegado a su destino en ({a}, {b})."),
+    NO_ROUTE: ("route", INFO, "Coche car_{car} no tiene una ruta válida o ya está en el destino."),
+    CELL_CONTENTS: ("move", DEBUG, "Coche car_{car}: nodo ({a}, {b}) contiene {c} coches y {d} semáforos."),
+    BLOCKED: ("block", DEBUG, "Coche car_{car} bloqueado por un coche en el nodo ({a}, {b}), {c} pasos inactivo."),
+    LANE_CHANGE: ("lane", INFO, "Coche car_{car} cambia al carril ({a}, {b})."),
+    LANE_REJECTED: ("lane", DEBUG, "Coche car_{car} no puede cambiar al carril ({a}, {b}) porque no tiene la misma dirección."),
+    REROUTE: ("block", INFO, "Coche car_{car} bloqueado. Recalculando ruta alternativa evitando ({a}, {b})."),
+    RED_LIGHT: ("light", DEBUG, "Coche car_{car} se detuvo frente al semáforo en el nodo ({a}, {b})."),
+    MOVE: ("move", DEBUG, "Coche car_{car} avanzando de ({a}, {b}) al nodo ({c}, {d})."),
+    STEP: ("step", INFO, "Paso {step}: Agentes actuales = {a}, Agentes que llegaron a su destino = {b}"),
+    CONGESTION_REROUTE: ("route", INFO, "Coche car_{car} cambia de ruta por congestión: costo {a} -> {b}."),
+}
+
+# Archivo binario: MAGIC, longitud del encabezado JSON (uint32), encabezado y eventos
+MAGIC = b"CITYTRC\0"
+EVENT = struct.Struct("<IiB3xiiii")  # paso, coche, código, a, b, c, d
+FLUSH_EVENTS = 4096
+
+
+class Tracer:
+    """
+    Destino de los eventos de la simulación.
+    Cada categoría es un atributo booleano (tracer.route, tracer.move, ...) que el código
+    revisa antes de llamar a emit, así una categoría apagada no calcula ni formatea nada.
+    """
+
+    def __init__(self, categories=(), level=INFO, capacity=None, path=None, echo=None):
+        """
+        Args:
+            categories: Categorías activas (ver CATEGORIES); "all" activa todas
+            level: Nivel mínimo de los eventos que se guardan (DEBUG o INFO)
+            capacity: Si se indica, los últimos capacity eventos se guardan en memoria
+            path: Si se indica, los eventos se escriben en este archivo binario
+            echo: Si se indica, cada evento se formatea y se escribe en este stream
+        """
+        if categories == "all":
+            categories = CATEGORIES
+        unknown = set(categories) - set(CATEGORIES)
+        if unknown:
+            raise ValueError(f"Categorías de traza desconocidas: {', '.join(sorted(unknown))}")
+
+        self.level = level
+        self.step_number = 0  # El modelo lo actualiza en cada paso
+        self.buffer = deque(maxlen=capacity) if capacity else None
+        self.echo = echo
+        self.file = None
+        self._pending = bytearray()
+        self._pending_events = 0
+        if path is not None:
+            self.file = open(path, "wb")
+            header = json.dumps({
+                "version": 1,
+                "events": {code: list(event) for code, event in EVENTS.items()},
+                "directions": DIRECTIONS,
+            }).encode()
+            self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+        # Sin destino no hay nada que guardar: todas las categorías quedan apagadas
+        has_sink = self.buffer is not None or self.file is not None or echo is not None
+        for category in CATEGORIES:
+            active = has_sink and category in categories and any(
+                event_category == category and event_level >= level
+                for event_category, event_level, _ in EVENTS.values()
+            )
+            setattr(self, category, active)
+
+    def emit(self, code, car=-1, a=0, b=0, c=0, d=0):
+        """Registra un evento del paso actual."""
+        if EVENTS[code][1] < self.level:
+            return
+        event = (self.step_number, car, code, a, b, c, d)
+        if self.buffer is not None:
+            self.buffer.append(event)
+        if self.file is not None:
+            self._pending += EVENT.pack(*event)
+            self._pending_events += 1
+            if self._pending_events >= FLUSH_EVENTS:
+                self.flush()
+        if self.echo is not None:
+            print(format_event(event), file=self.echo)
+
+    def flush(self):
+        """Escribe en el archivo los eventos pendientes."""
+        if self.file is not None and self._pending:
+            self.file.write(self._pending)
+            self.file.flush()
+            self._pending.clear()
+            self._pending_events = 0
+
+    def close(self):
+        """Escribe lo pendiente y cierra el archivo."""
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def events(self):
+        """Eventos del buffer en memoria, del más viejo al más reciente."""
+        return list(self.buffer) if self.buffer is not None else []
+
+
+def format_event(event, events=EVENTS, directions=DIRECTIONS):
+    """Texto de un evento (paso, coche, código, a, b, c, d)."""
+    step, car, code, a, b, c, d = event
+    direction = directions[a] if 0 <= a < len(directions) else None
+    return events[code][2].format(step=step, car=car, a=a, b=b, c=c, d=d, dir=direction)
+
+
+def read_trace(path):
+    """
+    Lee un archivo binario de traza.
+    Regresa (encabezado, generador de eventos); el encabezado trae las plantillas
+    con las que se escribió el archivo, así se puede decodificar con otra versión del código.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} no es un archivo de traza")
+        (header_length,) = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(header_length))
+        data = file.read()
+
+    header["events"] = {int(code): tuple(event) for code, event in header["events"].items()}
+    usable = len(data) - len(data) % EVENT.size  # Un evento cortado al final se ignora
+    return header, EVENT.iter_unpack(memoryview(data)[:usable])
+
+
+def decode_trace(path, categories=None, level=DEBUG):
+    """Genera el texto de cada evento de un archivo de traza, con filtro opcional."""
+    header, events = read_trace(path)
+    for event in events:
+        category, event_level, _ = header["events"][event[2]]
+        if event_level < level or (categories and category not in categories):
+            continue
+        yield format_event(event, header["events"], header["directions"])
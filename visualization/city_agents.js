@@ -41,6 +41,7 @@ const settings = {
 };
 
 const UPDATE_INTERVAL = 0.25; // Intervalo de actualización en segundos
+const USE_STREAM = true; // Recibir los frames por Server-Sent Events en lugar de pedirlos con /step
 
 // carga los datos del obj a json
 function loadObj(data) {
@@ -109,6 +110,17 @@ class Object3D {
 // Define la URI del servidor de agentes
 const agent_server_uri = "http://localhost:8585/";
 
+// Sesión asignada por el servidor en /init; cada visor tiene su propia simulación
+let sessionId = null;
+
+/*
+ * Construye la URL de una ruta del servidor incluyendo la sesión y otros parámetros.
+ */
+function serverUrl(route, params = {}) {
+  const query = new URLSearchParams({ session: sessionId, ...params });
+  return `${agent_server_uri}${route}?${query}`;
+}
+
 // Inicializa arrays para almacenar agentes y otros objetos
 let agents = [];
 const obstacles = [];
@@ -137,6 +149,12 @@ const data = {
   height: 25,
 };
 
+// Último paso recibido del servidor
+let lastStep = null;
+
+// True cuando los frames llegan por el stream y no hace falta pedirlos
+let streaming = false;
+
 // Variables para controlar el tiempo
 let lastFrameTime = performance.now();
 let lastUpdateTime = performance.now();
@@ -194,6 +212,11 @@ async function main() {
   await getRoads();
   await getLights();
 
+  // Recibe los frames por el stream si el navegador lo soporta
+  if (USE_STREAM && window.EventSource) {
+    startStream();
+  }
+
   // Dibuja la escena
   await drawScene();
 }
@@ -214,6 +237,7 @@ async function initAgentsModel() {
     if (response.ok) {
       // Analiza la respuesta como JSON y registra el mensaje
       let result = await response.json();
+      sessionId = result.session;
       console.log(result.message);
     }
   } catch (error) {
@@ -224,17 +248,22 @@ async function initAgentsModel() {
 
 /*
  * Obtiene las posiciones actuales de todos los agentes (coches) del servidor de agentes.
+ * Se piden en el formato binario descrito en el README y se decodifican con decodeAgents.
  */
 async function getAgents() {
   try {
     // Enviar una solicitud GET al servidor de agentes para obtener las posiciones
-    let response = await fetch(agent_server_uri + "getAgents");
-    let rotation = [0, 0, 0];
+    let response = await fetch(serverUrl("getAgents"), {
+      headers: { Accept: "application/octet-stream" },
+    });
 
     // Verificar si la respuesta fue exitosa
     if (response.ok) {
-      // Analizar la respuesta como JSON
-      let result = await response.json();
+      // El servidor regresa JSON si no soporta el formato binario
+      let result =
+        response.headers.get("Content-Type") === "application/octet-stream"
+          ? decodeAgents(await response.arrayBuffer())
+          : await response.json();
 
       // Obtener los IDs de los agentes recibidos
       const receivedIds = result.positions.map((agent) => agent.id);
@@ -244,58 +273,7 @@ async function getAgents() {
 
       // Agregar nuevos agentes o actualizar los existentes
       for (const agent of result.positions) {
-        const existingAgent = agents.find(
-          (object3d) => object3d.id === agent.id,
-        );
-
-        // Determinar la rotación según la dirección del agente
-        if (agent.direction == "Down") {
-          rotation = [0, Math.PI, 0];
-        } else if (agent.direction == "Up") {
-          rotation = [0, 0, 0];
-        } else if (agent.direction == "Left") {
-          rotation = [0, -Math.PI / 2, 0];
-        } else if (agent.direction == "Right") {
-          rotation = [0, Math.PI / 2, 0];
-        } else {
-          rotation = [0, 0, 0];
-        }
-
-        if (!existingAgent) {
-          // Generar un color aleatorio para el nuevo agente
-          const randomColor = [
-            Math.random(),
-            Math.random(),
-            Math.random(),
-            1, // Valor alfa
-          ];
-
-          // Crear un nuevo agente y agregarlo al array
-          const newAgent = new Object3D(
-            agent.id,
-            [agent.x, agent.y, agent.z],
-            rotation,
-            [0.6, 0.8, 0.4],
-            [0.1, 0.1, 0.1, 1], // ambientColor
-            randomColor, // diffuseColor (color aleatorio)
-            [1.0, 1.0, 1.0, 1], // specularColor
-            50, // shininess
-          );
-
-          // Establecer previousPosition y targetPosition al mismo valor
-          newAgent.previousPosition = [agent.x, agent.y, agent.z];
-          newAgent.targetPosition = [agent.x, agent.y, agent.z];
-          newAgent.interpolationFactor = 1;
-
-          agents.push(newAgent);
-        } else {
-          // Actualizar la posición y rotación del agente existente
-          existingAgent.previousPosition = existingAgent.position.slice();
-          existingAgent.targetPosition = [agent.x, agent.y, agent.z];
-          existingAgent.interpolationFactor = 0;
-          existingAgent.rotation = rotation;
-          // No cambiar los colores de los agentes existentes
-        }
+        updateAgent(agent);
       }
 
       // Registrar el array de agentes actualizado
@@ -309,10 +287,104 @@ async function getAgents() {
   }
 }
 
+// Nombres de los códigos de dirección del formato binario (255 = sin dirección)
+const DIRECTION_NAMES = ["Up", "Down", "Left", "Right"];
+
+/*
+ * Decodifica un frame binario de /getAgents al mismo formato que la respuesta JSON.
+ * Encabezado uint32 paso y uint32 número de coches, seguidos de los bloques int32 ids,
+ * uint16 x, uint16 z y uint8 dirección, todos little-endian.
+ */
+function decodeAgents(buffer) {
+  const header = new DataView(buffer, 0, 8);
+  const step = header.getUint32(0, true);
+  const count = header.getUint32(4, true);
+
+  let offset = 8;
+  const ids = new Int32Array(buffer, offset, count);
+  offset += 4 * count;
+  const xs = new Uint16Array(buffer, offset, count);
+  offset += 2 * count;
+  const zs = new Uint16Array(buffer, offset, count);
+  offset += 2 * count;
+  const directions = new Uint8Array(buffer, offset, count);
+
+  const positions = new Array(count);
+  for (let i = 0; i < count; i++) {
+    positions[i] = {
+      id: `car_${ids[i]}`,
+      x: xs[i],
+      y: 1.05,
+      z: zs[i],
+      direction: DIRECTION_NAMES[directions[i]] ?? null,
+    };
+  }
+  return { step, positions };
+}
+
+/*
+ * Agrega un agente nuevo o actualiza la posición y rotación de uno existente.
+ */
+function updateAgent(agent) {
+  let rotation = [0, 0, 0];
+  const existingAgent = agents.find(
+    (object3d) => object3d.id === agent.id,
+  );
+
+  // Determinar la rotación según la dirección del agente
+  if (agent.direction == "Down") {
+    rotation = [0, Math.PI, 0];
+  } else if (agent.direction == "Up") {
+    rotation = [0, 0, 0];
+  } else if (agent.direction == "Left") {
+    rotation = [0, -Math.PI / 2, 0];
+  } else if (agent.direction == "Right") {
+    rotation = [0, Math.PI / 2, 0];
+  } else {
+    rotation = [0, 0, 0];
+  }
+
+  if (!existingAgent) {
+    // Generar un color aleatorio para el nuevo agente
+    const randomColor = [
+      Math.random(),
+      Math.random(),
+      Math.random(),
+      1, // Valor alfa
+    ];
+
+    // Crear un nuevo agente y agregarlo al array
+    const newAgent = new Object3D(
+      agent.id,
+      [agent.x, agent.y, agent.z],
+      rotation,
+      [0.6, 0.8, 0.4],
+      [0.1, 0.1, 0.1, 1], // ambientColor
+      randomColor, // diffuseColor (color aleatorio)
+      [1.0, 1.0, 1.0, 1], // specularColor
+      50, // shininess
+    );
+
+    // Establecer previousPosition y targetPosition al mismo valor
+    newAgent.previousPosition = [agent.x, agent.y, agent.z];
+    newAgent.targetPosition = [agent.x, agent.y, agent.z];
+    newAgent.interpolationFactor = 1;
+
+    agents.push(newAgent);
+  } else {
+    // Actualizar la posición y rotación del agente existente
+    existingAgent.previousPosition = existingAgent.position.slice();
+    existingAgent.targetPosition = [agent.x, agent.y, agent.z];
+    existingAgent.interpolationFactor = 0;
+    existingAgent.rotation = rotation;
+    // No cambiar los colores de los agentes existentes
+  }
+}
+
 async function getObstacles() {
   try {
     // Send a GET request to the agent server to retrieve the obstacle positions
-    let response = await fetch(agent_server_uri + "getObstacles");
+    let response = await fetch(serverUrl("getObstacles"));
 
     // Check if the response was successful
     if (response.ok) {
@@ -370,7 +442,7 @@ async function getObstacles() {
 async function getLights() {
   try {
     // Send a GET request to the agent server to retrieve the traffic light positions
-    let response = await fetch(agent_server_uri + "getLights");
+    let response = await fetch(serverUrl("getLights"));
 
     // Check if the response was successful
     if (response.ok) {
@@ -418,18 +490,7 @@ async function getLights() {
       } else {
         // Update the positions and states of existing traffic lights
         for (const light of result.positions) {
-          const current_light = trafficLights.find(
-            (object3d) => object3d.id == light.id,
-          );
-
-          // Check if the traffic light exists in the trafficLights array
-          if (current_light != undefined) {
-            // Update the traffic light's state and color
-            current_light.state = light.state;
-            current_light.diffuseColor = light.state
-              ? [0.0, 1.0, 0.0, 0.2]
-              : [1.0, 0.0, 0.0, 0.2]; // Green or Red
-          }
+          updateLight(light);
         }
       }
     }
@@ -439,13 +500,31 @@ async function getLights() {
   }
 }
 
+/*
+ * Updates the state and color of an existing traffic light.
+ */
+function updateLight(light) {
+  const current_light = trafficLights.find(
+    (object3d) => object3d.id == light.id,
+  );
+
+  // Check if the traffic light exists in the trafficLights array
+  if (current_light != undefined) {
+    // Update the traffic light's state and color
+    current_light.state = light.state;
+    current_light.diffuseColor = light.state
+      ? [0.0, 1.0, 0.0, 0.2]
+      : [1.0, 0.0, 0.0, 0.2]; // Green or Red
+  }
+}
+
 /*
  * Retrieves the current positions of all destinations from the agent server.
  */
 async function getDestinations() {
   try {
     // Send a GET request to the agent server to retrieve the destination positions
-    let response = await fetch(agent_server_uri + "getDestinations");
+    let response = await fetch(serverUrl("getDestinations"));
 
     // Check if the response was successful
     if (response.ok) {
@@ -481,7 +560,7 @@ async function getDestinations() {
 async function getRoads() {
   try {
     // Send a GET request to the agent server to retrieve the road positions
-    let response = await fetch(agent_server_uri + "getRoads");
+    let response = await fetch(serverUrl("getRoads"));
 
     // Check if the response was successful
     if (response.ok) {
@@ -528,19 +607,17 @@ async function getRoads() {
 
 /*
  * Actualiza las posiciones de los agentes y los estados de los semáforos enviando una solicitud al servidor de agentes.
+ * El servidor avanza un paso y solo regresa los coches y semáforos que cambiaron desde el último paso recibido.
  */
 async function update() {
   try {
-    // Envía una solicitud al servidor de agentes para actualizar las posiciones y semáforos
-    let response = await fetch(agent_server_uri + "update");
+    // Envía el último paso recibido para que el servidor regrese solo los cambios
+    let params = lastStep !== null ? { ack: lastStep } : {};
+    let response = await fetch(serverUrl("step", params));
 
     // Verifica si la respuesta fue exitosa
     if (response.ok) {
-      // Recupera las posiciones actualizadas de los agentes y los estados de los semáforos
-      await getAgents();
-      await getLights();
-      // Registra un mensaje indicando que los agentes y semáforos han sido actualizados
-      console.log("Updated agents and traffic lights");
+      applyFrame(await response.json());
     }
   } catch (error) {
     // Registra cualquier error que ocurra durante la solicitud
@@ -548,6 +625,66 @@ async function update() {
   }
 }
 
+/*
+ * Se suscribe al stream de frames del servidor (Server-Sent Events).
+ * El servidor avanza la simulación a 1 / UPDATE_INTERVAL pasos por segundo y empuja cada frame;
+ * si el visor se atrasa recibe directamente el más reciente.
+ * Si el stream falla se vuelve a pedir los pasos con /step (ver stopStream).
+ */
+function startStream() {
+  const source = new EventSource(
+    serverUrl("stream", { sps: 1 / UPDATE_INTERVAL }),
+  );
+  source.onmessage = (event) => applyFrame(JSON.parse(event.data));
+  source.addEventListener("end", () => stopStream(source));
+  source.onerror = (error) => {
+    console.log(error);
+    stopStream(source);
+  };
+  streaming = true;
+}
+
+/*
+ * Cierra el stream y vuelve al polling. Antes detiene el simulador que el stream dejó corriendo
+ * en el servidor; mientras corre, /step regresa 409.
+ */
+async function stopStream(source) {
+  source.close();
+  try {
+    await fetch(serverUrl("stop"), { method: "POST" });
+  } catch (error) {
+    console.log(error);
+  }
+  streaming = false;
+}
+
+/*
+ * Aplica un frame del servidor: agrega, mueve y elimina agentes y actualiza los semáforos que cambiaron.
+ */
+function applyFrame(frame) {
+  // Un frame completo reemplaza a todos los agentes
+  if (frame.full) {
+    const receivedIds = new Set(frame.spawned.map((agent) => agent.id));
+    agents = agents.filter((object3d) => receivedIds.has(object3d.id));
+  }
+
+  // Eliminar los agentes que ya no existen
+  const despawned = new Set(frame.despawned);
+  agents = agents.filter((object3d) => !despawned.has(object3d.id));
+
+  // Agregar los nuevos agentes y mover los existentes
+  for (const agent of frame.spawned.concat(frame.moved)) {
+    updateAgent(agent);
+  }
+
+  // Actualizar solo los semáforos que cambiaron
+  for (const light of frame.lights) {
+    updateLight(light);
+  }
+
+  lastStep = frame.step;
+}
+
 /*
  * Dibuja la escena renderizando todos los objetos.
  */
@@ -579,7 +716,7 @@ async function drawScene() {
   }
 
   // Verifica si es momento de actualizar
-  if ((now - lastUpdateTime) / 1000 >= UPDATE_INTERVAL) {
+  if (!streaming && (now - lastUpdateTime) / 1000 >= UPDATE_INTERVAL) {
     lastUpdateTime = now;
     await update();
   }